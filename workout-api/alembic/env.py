@@ -4,6 +4,7 @@ from alembic import context
 from sqlalchemy import pool
 from sqlalchemy.ext.asyncio import create_async_engine
 
+from db_context import is_memory_database
 from models import Base
 from settings import connection_string, test_connection_string
 
@@ -13,7 +14,8 @@ config = context.config
 
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
-if config.config_file_name is not None:
+# (not when the app runs the migrations on its own connection, it keeps its logging)
+if config.config_file_name is not None and "connection" not in config.attributes:
     fileConfig(config.config_file_name)
 
 # add your model's MetaData object here
@@ -54,7 +56,9 @@ def run_migrations_offline() -> None:
 
 
 def do_run_migrations(connection):
-    context.configure(connection=connection, target_metadata=target_metadata)
+    # SQLite can not alter constraints, batch mode recreates the tables instead
+    context.configure(connection=connection, target_metadata=target_metadata,
+                      render_as_batch=connection.dialect.name == 'sqlite')
 
     with context.begin_transaction():
         context.run_migrations()
@@ -78,6 +82,9 @@ async def run_migrations_online():
     )
 
     for connectable in [connectable_main, connectable_test]:
+        if is_memory_database(connectable.url):
+            # migrated by the app when its engine starts
+            continue
         try:
             async with connectable.connect() as connection:
                 await connection.run_sync(do_run_migrations)
@@ -89,6 +96,8 @@ async def run_migrations_online():
 
 if context.is_offline_mode():
     run_migrations_offline()
+elif "connection" in config.attributes:
+    do_run_migrations(config.attributes["connection"])
 else:
     import asyncio
     asyncio.run(run_migrations_online())
@@ -0,0 +1,257 @@
+"""
+analytics.py
+Module with the process pool used to run CPU-heavy route analytics
+(distance, splits, simplification) outside the event loop.
+"""
+import asyncio
+import math
+import threading
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from settings import ANALYTICS_MAX_WORKERS, ANALYTICS_MAX_CONCURRENT_JOBS, ANALYTICS_JOB_TIMEOUT
+
+EARTH_RADIUS_METERS = 6371008.8
+DOUBLE_SIZE = array('d').itemsize
+
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    """
+    Function to get the distance in meters between two coordinates.
+    """
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    delta_phi = phi2 - phi1
+    delta_lambda = math.radians(lon2 - lon1)
+    a = math.sin(delta_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(math.sqrt(a))
+
+
+def route_distance(lats, lons):
+    """
+    Function to get the total distance in meters of a route.
+    """
+    total = 0.0
+    for index in range(1, len(lats)):
+        total += haversine_distance(lats[index - 1], lons[index - 1], lats[index], lons[index])
+    return total
+
+
+def route_splits(lats, lons, split_length=1000.0):
+    """
+    Function to split a route every `split_length` meters.
+
+    Returns:
+        A list with the point index and the covered distance where each split ends.
+    """
+    splits = []
+    covered = 0.0
+    next_split = split_length
+    for index in range(1, len(lats)):
+        covered += haversine_distance(lats[index - 1], lons[index - 1], lats[index], lons[index])
+        if covered >= next_split:
+            splits.append({"split": len(splits) + 1, "point_index": index, "distance": covered})
+            next_split += split_length
+    return splits
+
+
+def simplify_route(lats, lons, tolerance=5.0):
+    """
+    Function to simplify a route with the Douglas-Peucker algorithm.
+    The tolerance is expressed in meters.
+
+    Returns:
+        The indexes of the points to keep.
+    """
+    length = len(lats)
+    if length < 3:
+        return list(range(length))
+
+    # project to a local plane (meters) so the perpendicular distance is cheap to compute
+    scale = math.cos(math.radians(lats[0]))
+    xs = [math.radians(lon) * scale * EARTH_RADIUS_METERS for lon in lons]
+    ys = [math.radians(lat) * EARTH_RADIUS_METERS for lat in lats]
+
+    keep = bytearray(length)
+    keep[0] = keep[-1] = 1
+    stack = [(0, length - 1)]
+    while stack:
+        start, end = stack.pop()
+        dx = xs[end] - xs[start]
+        dy = ys[end] - ys[start]
+        segment_length = math.hypot(dx, dy)
+        max_distance = 0.0
+        max_index = start
+        for index in range(start + 1, end):
+            if segment_length == 0:
+                distance = math.hypot(xs[index] - xs[start], ys[index] - ys[start])
+            else:
+                distance = abs(dy * xs[index] - dx * ys[index] + xs[end] * ys[start] - ys[end] * xs[start]) \
+                    / segment_length
+            if distance > max_distance:
+                max_distance = distance
+                max_index = index
+        if max_distance > tolerance:
+            keep[max_index] = 1
+            stack.append((start, max_index))
+            stack.append((max_index, end))
+
+    return [index for index in range(length) if keep[index]]
+
+
+ROUTE_JOBS = {
+    "distance": route_distance,
+    "splits": route_splits,
+    "simplify": simplify_route,
+}
+
+
+def _run_route_job(job_name: str, shm_name: str, length: int, params: dict):
+    """
+    Function executed inside the worker process. It attaches to the shared memory block
+    holding the coordinates (lats followed by lons) without copying them.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    coordinates = shm.buf[:length * 2 * DOUBLE_SIZE].cast('d')
+    lats = coordinates[:length]
+    lons = coordinates[length:]
+    try:
+        return ROUTE_JOBS[job_name](lats, lons, **params)
+    finally:
+        lats.release()
+        lons.release()
+        coordinates.release()
+        shm.close()
+
+
+class SharedRoute:
+    """
+    Class to hold the coordinates of a route (lats followed by lons) in a shared memory block read by the workers.
+    The block is written once and shared by every job over the route. It is unlinked when the owner and every job
+    released it, so a queued worker can still attach to it after a timeout.
+    """
+
+    def __init__(self, lats, lons):
+        self.length = len(lats)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(self.length * 2 * DOUBLE_SIZE, DOUBLE_SIZE))
+        self.name = self.shm.name
+        coordinates = self.shm.buf[:self.length * 2 * DOUBLE_SIZE].cast('d')
+        coordinates[:self.length] = array('d', lats)
+        coordinates[self.length:] = array('d', lons)
+        coordinates.release()
+        # the owner holds the first reference
+        self._references = 1
+        self._unlink_lock = threading.Lock()
+        self.unlinked = False
+
+    def acquire(self):
+        self._references += 1
+
+    def release(self):
+        """
+        Function to release a reference (the last one unlinks the block).
+        """
+        self._references -= 1
+        if self._references == 0:
+            self.unlink()
+
+    def unlink(self):
+        """
+        Function to free the shared memory block, whatever the references left. It can be called from the pool
+        threads once the event loop is closed, and only the first call frees the block.
+        """
+        with self._unlink_lock:
+            if self.unlinked:
+                return
+            self.unlinked = True
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc_info):
+        self.release()
+
+
+class RouteAnalyticsExecutor:
+    """
+    Class to handle the process pool used for the route analytics jobs.
+    """
+
+    def __init__(self, max_workers: int, max_concurrent_jobs: int, timeout: float):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor = None
+        self._semaphore = asyncio.Semaphore(max_concurrent_jobs)
+        # routes with submitted jobs, freed by the shutdown if their jobs never report back to the loop
+        self._routes = set()
+
+    def _get_executor(self):
+        """
+        Function to get the process pool (created on first use).
+        """
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    async def submit(self, job_name: str, route: SharedRoute, **params):
+        """
+        Function to run an analytics job over a shared route in the process pool.
+        A job keeps its concurrency slot and its reference to the route until the worker is done with it,
+        even when the caller stopped waiting (timeout): the timed out jobs do not pile up over the limit.
+
+        Raises:
+            ValueError if the job does not exist.
+            asyncio.TimeoutError if the job takes longer than the configured timeout.
+        """
+        if job_name not in ROUTE_JOBS:
+            raise ValueError(f'Unknown analytics job: {job_name}.')
+
+        await self._semaphore.acquire()
+        route.acquire()
+        self._routes.add(route)
+        try:
+            job = self._get_executor().submit(_run_route_job, job_name, route.name, route.length, params)
+        except BaseException:
+            self._job_finished(route)
+            raise
+
+        loop = asyncio.get_running_loop()
+
+        def on_job_done(_job):
+            # called from the pool thread, the slot and the route are released on the event loop
+            try:
+                loop.call_soon_threadsafe(self._job_finished, route)
+            except RuntimeError:
+                # the loop is closed (shutdown): the owner and the other jobs can not release their references
+                # anymore, so the block is freed here instead of leaking (the reference count is only updated
+                # on the loop)
+                route.unlink()
+
+        job.add_done_callback(on_job_done)
+        # the timeout cancels the job if no worker started it yet
+        return await asyncio.wait_for(asyncio.wrap_future(job), timeout=self.timeout)
+
+    def _job_finished(self, route: SharedRoute):
+        route.release()
+        if route.unlinked:
+            self._routes.discard(route)
+        self._semaphore.release()
+
+    def shutdown(self):
+        """
+        Function to stop the process pool and free the shared memory of the unfinished jobs.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        for route in self._routes:
+            route.unlink()
+        self._routes.clear()
+
+
+route_analytics = RouteAnalyticsExecutor(max_workers=ANALYTICS_MAX_WORKERS,
+                                         max_concurrent_jobs=ANALYTICS_MAX_CONCURRENT_JOBS,
+                                         timeout=ANALYTICS_JOB_TIMEOUT)
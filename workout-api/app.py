@@ -1,7 +1,47 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 
+from analytics import route_analytics
+from db_context import db_engine, async_session, prepare_database
+from ingest import map_point_ingest
+from instrumentation import QueryStatsMiddleware
+from json_response import FastJSONResponse
+from loop_monitor import loop_monitor
+from metrics import MetricsMiddleware, register_pool_metrics, register_tracking_metrics
+from profiling import ProfilingMiddleware
+from repository.utils import tracking_ws_handler
 from routers import main_router
+from structured_logging import AccessLogMiddleware, logging_pipeline
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """
+    Function to handle the application startup and shutdown.
+    """
+    # started here (not at import) so the pipeline stopped by a previous lifespan cycle is installed again
+    logging_pipeline.start()
+    await prepare_database(db_engine)
+    loop_monitor.start()
+    map_point_ingest.start(_app.state.session_factory)
+    yield
+    # the buffered tracking points are committed before the workers stop
+    await map_point_ingest.stop()
+    await loop_monitor.stop()
+    route_analytics.shutdown()
+    logging_pipeline.stop()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+# session factory of the background work started by the lifespan (the tests and the benchmarks set their own)
+app.state.session_factory = async_session
+app.add_middleware(AccessLogMiddleware)
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(QueryStatsMiddleware)
+app.add_middleware(MetricsMiddleware)
 
-app = FastAPI()
+register_pool_metrics(db_engine)
+register_tracking_metrics(tracking_ws_handler)
 
 app.include_router(main_router.main_router_v1, prefix="/api/v1")
@@ -0,0 +1,4 @@
+"""
+benchmarks
+Performance benchmarks for the workout-api (run them from the workout-api folder with "python -m benchmarks.<name>").
+"""
@@ -0,0 +1,252 @@
+"""
+dataset.py
+Synthetic dataset generator for scale testing. It fills the user, workout, exercise, tracking_data and map_point
+tables with realistic distributions: the workouts per user follow a power law, every user has a multi-year
+history (signup date spread over --years) and the cardio exercises carry long GPS routes (a point every
+--point-interval seconds). The same seed and scale always produce the same rows (only the bcrypt salt of the
+shared user password changes), starting from the first free id of every table.
+Rows are generated in Python and loaded in batches: COPY (asyncpg copy_records_to_table) on PostgreSQL,
+multi-row inserts on the other databases. The ids are assigned by the generator, so no row is read back.
+
+Usage:
+    python -m benchmarks.dataset [--scale 1] [--seed 42] [--years 3] [--point-interval 5]
+                                 [--batch-size 50000] [--test-db]
+"""
+import argparse
+import asyncio
+import math
+import random
+import time
+from datetime import datetime, timezone
+
+import sqlalchemy as sa
+
+from crypto import hash_password
+from models import User, Workout, Exercise, TrackingData, MapPoint
+
+USERS_PER_SCALE = 1000
+# workouts per user: MIN_WORKOUTS * pareto(WORKOUTS_ALPHA), capped (~80% of the workouts from ~20% of the users)
+MIN_WORKOUTS = 5
+WORKOUTS_ALPHA = 1.16
+WORKOUTS_PER_YEAR_CAP = 400
+SCHEDULED_SHARE = 0.03
+TRACKED_SHARE = 0.6
+DAY = 24 * 3600
+YEAR = 365 * DAY
+METERS_PER_DEGREE = 111_320
+# the histories end on a fixed date, so the dataset does not depend on the day it is generated
+END_TIME = int(datetime(2026, 1, 1, tzinfo=timezone.utc).timestamp())
+DATASET_PASSWORD = "dataset_password"
+
+WORKOUT_TYPES = {"CARDIO": 45, "STRENGTH": 35, "FLEXIBILITY": 12, "BALANCE": 8}
+# workout type -> (exercise name, meters per second when tracked)
+EXERCISES = {
+    "CARDIO": [("run", 2.8), ("walk", 1.4), ("cycle", 6.0), ("hike", 1.1), ("row", 3.5)],
+    "STRENGTH": [("squat", None), ("bench press", None), ("deadlift", None), ("pull up", None), ("lunge", None)],
+    "FLEXIBILITY": [("yoga", None), ("stretching", None), ("pilates", None)],
+    "BALANCE": [("single leg stand", None), ("bosu squat", None), ("tai chi", None)],
+}
+CITIES = [(40.4168, -3.7038), (19.4326, -99.1332), (51.5072, -0.1276), (40.7128, -74.0060), (-33.8688, 151.2093)]
+
+TABLES = [User, Workout, Exercise, TrackingData, MapPoint]
+COLUMNS = {
+    User: ("id", "name", "age", "username", "email", "password", "created_at"),
+    Workout: ("id", "user_id", "workout_type", "duration", "calories", "created_at", "is_schedule",
+              "schedule_date"),
+    Exercise: ("id", "name", "exercise_type", "duration", "calories", "created_at", "workout_id"),
+    TrackingData: ("id", "description", "exercise_id", "duration", "is_new_set", "is_new_record",
+                   "distance_covered", "created_at", "last_updated_at"),
+    MapPoint: ("id", "lat", "lon", "created_at", "last_updated_at", "tracking_data_id"),
+}
+
+
+class DatasetGenerator:
+    """
+    Class to generate the rows (tuples in COLUMNS order) of the users, their workouts and routes.
+    """
+
+    def __init__(self, seed: int, years: float, point_interval: int, next_ids: dict):
+        self.random = random.Random(seed)
+        self.seed = seed
+        self.years = years
+        self.point_interval = point_interval
+        self.next_ids = next_ids
+        self.password = hash_password(DATASET_PASSWORD)
+
+    def new_id(self, model):
+        row_id = self.next_ids[model]
+        self.next_ids[model] += 1
+        return row_id
+
+    def user(self, index: int, rows: dict):
+        """
+        Function to generate a user with its whole history.
+        """
+        rng = self.random
+        signup = END_TIME - int(rng.uniform(0.05, 1) * self.years * YEAR)
+        user_id = self.new_id(User)
+        username = f"dataset_{self.seed}_{index}"
+        rows[User].append((user_id, f"Dataset user {index}", max(16, int(rng.gauss(36, 12))), username,
+                           f"{username}@example.com", self.password, signup))
+
+        active_years = (END_TIME - signup) / YEAR
+        workouts = min(int(MIN_WORKOUTS * rng.paretovariate(WORKOUTS_ALPHA)),
+                       int(WORKOUTS_PER_YEAR_CAP * active_years) + MIN_WORKOUTS)
+        home = rng.choice(CITIES)
+        for created_at in sorted(rng.randint(signup, END_TIME) for _ in range(workouts)):
+            self.workout(user_id, created_at, home, rows)
+
+    def workout(self, user_id: int, created_at: int, home: tuple, rows: dict):
+        rng = self.random
+        workout_type = rng.choices(list(WORKOUT_TYPES), list(WORKOUT_TYPES.values()))[0]
+        is_schedule = rng.random() < SCHEDULED_SHARE
+        schedule_date = created_at + rng.randint(1, 14) * DAY if is_schedule else created_at
+        workout_id = self.new_id(Workout)
+        exercises = rng.choices((1, 2, 3, 4, 5, 6), (30, 25, 20, 12, 8, 5))[0]
+
+        total_duration = total_calories = 0
+        for _ in range(exercises):
+            name, speed = rng.choice(EXERCISES[workout_type])
+            duration = max(5, int(rng.lognormvariate(math.log(25), 0.5)))
+            calories = int(duration * rng.uniform(5, 12))
+            total_duration += duration
+            total_calories += calories
+
+            exercise_id = self.new_id(Exercise)
+            rows[Exercise].append((exercise_id, name, workout_type.lower(), duration, calories, created_at,
+                                   workout_id))
+            if speed and not is_schedule and rng.random() < TRACKED_SHARE:
+                self.route(exercise_id, created_at, duration * 60, speed, home, rows)
+
+        rows[Workout].append((workout_id, user_id, workout_type, total_duration, total_calories, created_at,
+                              is_schedule, schedule_date))
+
+    def route(self, exercise_id: int, start: int, duration: int, speed: float, home: tuple, rows: dict):
+        """
+        Function to generate a tracking data room with its route (a random walk around home).
+        """
+        rng = self.random
+        tracking_data_id = self.new_id(TrackingData)
+        lat = home[0] + rng.uniform(-0.05, 0.05)
+        lon = home[1] + rng.uniform(-0.05, 0.05)
+        heading = rng.uniform(0, 2 * math.pi)
+        step = speed * self.point_interval
+        distance = 0.0
+        map_points = rows[MapPoint]
+        new_id = self.new_id
+
+        for point_time in range(start, start + duration, self.point_interval):
+            map_points.append((new_id(MapPoint), lat, lon, point_time, point_time, tracking_data_id))
+            heading += rng.gauss(0, 0.25)
+            meters = step * rng.uniform(0.7, 1.3)
+            distance += meters
+            lat += meters * math.cos(heading) / METERS_PER_DEGREE
+            lon += meters * math.sin(heading) / (METERS_PER_DEGREE * math.cos(math.radians(lat)))
+
+        rows[TrackingData].append((tracking_data_id, "dataset route", exercise_id, duration, True,
+                                   rng.random() < 0.05, int(distance), start, start + duration))
+
+
+class DatasetLoader:
+    """
+    Class to load batches of rows (parents first) with COPY on PostgreSQL or multi-row inserts elsewhere.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.use_copy = connection.dialect.name == 'postgresql'
+        self.loaded = {model: 0 for model in TABLES}
+
+    async def next_ids(self):
+        """
+        Function to get the first free id of every table.
+        """
+        next_ids = {}
+        for model in TABLES:
+            max_id = (await self.connection.execute(sa.select(sa.func.max(model.id)))).scalar()
+            next_ids[model] = (max_id or 0) + 1
+        return next_ids
+
+    async def load(self, rows: dict):
+        for model in TABLES:
+            if not rows[model]:
+                continue
+            table = model.__table__
+            if self.use_copy:
+                raw_connection = await self.connection.get_raw_connection()
+                await raw_connection.driver_connection.copy_records_to_table(
+                    table.name, records=rows[model], columns=COLUMNS[model]
+                )
+            else:
+                await self.connection.execute(sa.insert(table), [dict(zip(COLUMNS[model], row))
+                                                                 for row in rows[model]])
+            self.loaded[model] += len(rows[model])
+            rows[model].clear()
+        await self.connection.commit()
+
+    async def reset_sequences(self):
+        """
+        Function to move the PostgreSQL id sequences after the generated ids.
+        """
+        if not self.use_copy:
+            return
+        for model in TABLES:
+            table = model.__table__
+            sequence = sa.func.pg_get_serial_sequence(f'"{table.name}"', 'id')
+            await self.connection.execute(sa.select(sa.func.setval(
+                sequence, sa.select(sa.func.coalesce(sa.func.max(table.c.id), 1)).scalar_subquery()
+            )))
+        await self.connection.commit()
+
+
+async def generate_dataset(engine, scale: float, seed: int, years: float, point_interval: int, batch_size: int):
+    """
+    Function to generate and load the dataset.
+
+    Returns:
+        The loaded rows per table and the elapsed seconds.
+    """
+    start = time.perf_counter()
+    async with engine.connect() as connection:
+        loader = DatasetLoader(connection)
+        generator = DatasetGenerator(seed, years, point_interval, await loader.next_ids())
+        rows = {model: [] for model in TABLES}
+
+        users = max(1, int(USERS_PER_SCALE * scale))
+        for index in range(users):
+            generator.user(index, rows)
+            if sum(len(model_rows) for model_rows in rows.values()) >= batch_size:
+                await loader.load(rows)
+                print(f"\r{index + 1}/{users} users, {sum(loader.loaded.values())} rows", end="", flush=True)
+        await loader.load(rows)
+        await loader.reset_sequences()
+        print()
+
+    return loader.loaded, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=float, default=1, help=f"scale factor ({USERS_PER_SCALE} users per unit)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--years", type=float, default=3, help="maximum history length per user")
+    parser.add_argument("--point-interval", type=int, default=5, help="seconds between two route points")
+    parser.add_argument("--batch-size", type=int, default=50000, help="rows generated before every load")
+    parser.add_argument("--test-db", action="store_true", help="fill the test database")
+    args = parser.parse_args()
+
+    from db_context import db_engine, test_db_engine, is_memory_database
+    engine = test_db_engine if args.test_db else db_engine
+    if is_memory_database(engine.url):
+        parser.error("the database is in memory, set SQLITE_PATH (or TEST_SQLITE_PATH) to a file")
+
+    loaded, elapsed = asyncio.run(generate_dataset(engine, args.scale, args.seed, args.years, args.point_interval,
+                                                   args.batch_size))
+    total = sum(loaded.values())
+    for model, count in loaded.items():
+        print(f"{model.__tablename__:<16}{count:>14,}")
+    print(f"{'total':<16}{total:>14,} rows in {elapsed:.1f} s ({total / elapsed * 60:,.0f} rows/min)")
+
+
+if __name__ == "__main__":
+    main()
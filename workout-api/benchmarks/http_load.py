@@ -0,0 +1,317 @@
+"""
+http_load.py
+End-to-end HTTP load benchmark. Virtual users register, login, and then run a weighted mix of
+workout, exercise and tracking operations for a fixed duration. The app is driven in-process through
+httpx.ASGITransport (default), through a uvicorn server started by the benchmark, or against any running server.
+
+Usage:
+    python -m benchmarks.http_load [--users 10] [--duration 20] [--mix read-heavy|write-heavy|crud]
+                                   [--uvicorn | --url http://localhost:8000] [--test-db]
+                                   [--output results.json] [--compare baseline.json] [--max-regression 0.2]
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+
+import httpx
+
+from benchmarks.results import summarize, build_meta, save_results, print_results, compare_results
+
+API_PREFIX = "/api/v1"
+
+# operation -> weight
+MIXES = {
+    "read-heavy": {
+        "workout_list": 20, "workout_get": 20, "exercise_list": 15, "exercise_get": 10, "tracking_list": 10,
+        "workout_create": 5, "workout_update": 5, "exercise_create": 5, "exercise_update": 5, "exercise_delete": 2,
+    },
+    "write-heavy": {
+        "workout_list": 5, "workout_get": 10, "exercise_list": 5, "exercise_get": 5, "tracking_list": 5,
+        "workout_create": 15, "workout_update": 15, "exercise_create": 20, "exercise_update": 15, "exercise_delete": 5,
+    },
+    "crud": {
+        "workout_get": 10, "exercise_get": 10, "workout_create": 10, "workout_update": 10,
+        "exercise_create": 10, "exercise_update": 10, "exercise_delete": 10,
+    },
+}
+
+
+def created_id(response: httpx.Response, entity: str):
+    """
+    Function to get the id of a created entity from the success message (e.g. "Workout 3 added successfully.").
+    """
+    match = re.search(rf"{entity} (\d+) added successfully", response.json().get("message", ""))
+    return int(match.group(1)) if match else None
+
+
+class VirtualUser:
+    """
+    Class with the state (token, workouts and exercises) and the operations of a benchmark user.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, recorder, seed: int):
+        self.client = client
+        self.record = recorder
+        self.random = random.Random(seed)
+        self.user_id = None
+        self.headers = {}
+        self.workout_ids = []
+        self.exercise_ids = []
+
+    async def request(self, operation: str, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        response = await self.client.request(method, f"{API_PREFIX}{url}", headers=self.headers, **kwargs)
+        self.record(operation, time.perf_counter() - start, response.status_code >= 400)
+        return response
+
+    async def setup(self):
+        """
+        Function to register and login the user and create its first workout, exercise and tracking room.
+        """
+        suffix = uuid.uuid4().hex[:10]
+        credentials = {"username": f"bench_{suffix}", "password": "bench_password"}
+        response = await self.request("register", "POST", "/users/register", json={
+            **credentials, "name": f"Bench {suffix}", "age": 30, "email": f"bench_{suffix}@mail.com"
+        })
+        self.user_id = response.json()["data"]
+
+        response = await self.request("login", "POST", "/login", data=credentials)
+        self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        await self.workout_create()
+        await self.exercise_create()
+        if not self.exercise_ids:
+            raise RuntimeError(f"The setup of the benchmark user {self.user_id} failed, check the API logs.")
+        await self.request("tracking_create", "POST", f"/exercise/tracking/{self.exercise_ids[0]}",
+                           json={"duration": 30, "description": "benchmark", "distance_covered": 1000})
+
+    async def workout_list(self):
+        await self.request("workout_list", "GET", "/workout/")
+
+    async def workout_get(self):
+        await self.request("workout_get", "GET", f"/workout/{self.random.choice(self.workout_ids)}")
+
+    async def workout_create(self):
+        response = await self.request("workout_create", "POST", "/workout/create", json={
+            "user_id": self.user_id, "workout_type": self.random.choice(["cardio", "strength"]),
+            "duration": self.random.randint(10, 90), "calories": self.random.randint(100, 900),
+        })
+        workout_id = created_id(response, "Workout")
+        if workout_id:
+            self.workout_ids.append(workout_id)
+
+    async def workout_update(self):
+        await self.request("workout_update", "PATCH", f"/workout/{self.random.choice(self.workout_ids)}",
+                           json={"duration": self.random.randint(10, 90)})
+
+    async def exercise_list(self):
+        await self.request("exercise_list", "GET", f"/exercise/list/{self.random.choice(self.workout_ids)}")
+
+    async def exercise_get(self):
+        await self.request("exercise_get", "GET", f"/exercise/{self.random.choice(self.exercise_ids)}")
+
+    async def exercise_create(self):
+        response = await self.request("exercise_create", "POST", "/exercise/create", json={
+            "workout_id": self.random.choice(self.workout_ids), "name": "benchmark run", "exercise_type": "cardio",
+            "duration": self.random.randint(5, 30), "calories": self.random.randint(50, 300),
+        })
+        exercise_id = created_id(response, "Exercise")
+        if exercise_id:
+            self.exercise_ids.append(exercise_id)
+
+    async def exercise_update(self):
+        await self.request("exercise_update", "PATCH", f"/exercise/{self.random.choice(self.exercise_ids)}",
+                           json={"calories": self.random.randint(50, 300)})
+
+    async def exercise_delete(self):
+        if len(self.exercise_ids) < 2:
+            # keep the exercise with the tracking room
+            await self.exercise_create()
+            return
+        await self.request("exercise_delete", "DELETE", f"/exercise/{self.exercise_ids.pop()}")
+
+    async def tracking_list(self):
+        await self.request("tracking_list", "GET", f"/exercise/tracking/list/{self.exercise_ids[0]}")
+
+    async def run(self, mix: dict, deadline: float):
+        """
+        Function to run random operations of the mix until the deadline.
+        """
+        operations = list(mix)
+        weights = list(mix.values())
+        while time.perf_counter() < deadline:
+            operation = self.random.choices(operations, weights)[0]
+            await getattr(self, operation)()
+
+
+class Recorder:
+    """
+    Class to collect the latencies and errors per operation.
+    """
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def __call__(self, operation: str, latency: float, failed: bool):
+        self.latencies[operation].append(latency)
+        if failed:
+            self.errors[operation] += 1
+
+    def results(self, elapsed: float):
+        results = {
+            operation: summarize(latencies, elapsed, self.errors[operation])
+            for operation, latencies in sorted(self.latencies.items())
+        }
+        all_latencies = [latency for latencies in self.latencies.values() for latency in latencies]
+        results["total"] = summarize(all_latencies, elapsed, sum(self.errors.values()))
+        return results
+
+
+async def run_benchmark(client: httpx.AsyncClient, users: int, duration: float, mix: dict, seed: int):
+    """
+    Function to run the virtual users (setup first, then the measured mix).
+
+    Returns:
+        The setup results and the measured results.
+    """
+    setup_recorder = Recorder()
+    setup_start = time.perf_counter()
+    virtual_users = [VirtualUser(client, setup_recorder, seed + index) for index in range(users)]
+    await asyncio.gather(*(user.setup() for user in virtual_users))
+    setup_results = setup_recorder.results(time.perf_counter() - setup_start)
+
+    recorder = Recorder()
+    for user in virtual_users:
+        user.record = recorder
+    start = time.perf_counter()
+    await asyncio.gather(*(user.run(mix, start + duration) for user in virtual_users))
+    return setup_results, recorder.results(time.perf_counter() - start)
+
+
+def use_test_database():
+    """
+    Function to run the in-process app against the test database (like the tests do).
+    """
+    from db_context import test_async_session
+    from routers.utils import get_db, get_session_factory
+    from app import app
+
+    async def test_db():
+        async with test_async_session() as session:
+            yield session
+
+    app.dependency_overrides[get_db] = test_db
+    app.dependency_overrides[get_session_factory] = lambda: test_async_session
+    app.state.session_factory = test_async_session
+
+
+@contextlib.contextmanager
+def uvicorn_server(port: int):
+    """
+    Function to run the app in a uvicorn subprocess.
+
+    Yields:
+        The base url of the server.
+    """
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.terminate()
+        server.wait()
+
+
+@contextlib.asynccontextmanager
+async def open_client(args):
+    """
+    Function to open the client of the selected target (in-process app, uvicorn server or running server).
+    """
+    timeout = httpx.Timeout(30)
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=timeout) as client:
+            yield client
+        return
+
+    if args.uvicorn:
+        with uvicorn_server(args.port) as base_url:
+            async with httpx.AsyncClient(base_url=base_url, timeout=timeout) as client:
+                await wait_for_server(client)
+                yield client
+        return
+
+    from app import app
+    from db_context import db_engine, test_db_engine, prepare_database
+    if args.test_db:
+        use_test_database()
+    # the ASGI transport does not run the app startup (in-memory SQLite databases are migrated there)
+    await prepare_database(test_db_engine if args.test_db else db_engine)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark",
+                                 timeout=timeout) as client:
+        yield client
+
+
+async def wait_for_server(client: httpx.AsyncClient, timeout: float = 20):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            await client.get(f"{API_PREFIX}/")
+            return
+        except httpx.TransportError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+async def main_async(args):
+    async with open_client(args) as client:
+        return await run_benchmark(client, args.users, args.duration, MIXES[args.mix], args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds (after the users setup)")
+    parser.add_argument("--mix", choices=sorted(MIXES), default="read-heavy")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--uvicorn", action="store_true", help="start a uvicorn server instead of using ASGI")
+    parser.add_argument("--port", type=int, default=8765, help="port of the uvicorn server")
+    parser.add_argument("--url", help="benchmark a running server")
+    parser.add_argument("--test-db", action="store_true", help="use the test database (in-process app only)")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/)")
+    parser.add_argument("--compare", help="results file of a previous run")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="allowed p95/throughput change before a regression is reported")
+    args = parser.parse_args()
+
+    setup_results, results = asyncio.run(main_async(args))
+
+    print("setup")
+    print_results(setup_results)
+    print(f"\nmix {args.mix}, {args.users} users, {args.duration:.0f} s")
+    print_results(results)
+
+    target = args.url or ("uvicorn" if args.uvicorn else "asgi")
+    meta = build_meta(target=target, users=args.users, duration=args.duration, mix=args.mix, seed=args.seed)
+    output = save_results("http_load", meta, {**results, **{f"setup_{name}": result
+                                                             for name, result in setup_results.items()}},
+                          args.output)
+    print(f"\nresults stored in {output}")
+
+    if args.compare and compare_results(args.compare, results, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""
+query_plans.py
+Query plan regression suite. Every hot repository function (workouts, exercises, tracking and users) runs against
+a scaled dataset (see benchmarks.dataset) while the SQL instrumentation keeps its statements and parameters.
+Each SELECT is then explained: EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) on PostgreSQL, EXPLAIN QUERY PLAN on SQLite
+(plan shape only). The suite records the plan shape, cost, time and buffers of every statement and flags:
+- full scans of the large tables (e.g. a sequential scan on map_point),
+- scan, nested loop, sort or materialize nodes that are not in the baseline plan and cost growth over
+  --max-regression (with --compare).
+Everything runs in a transaction that is rolled back.
+
+Usage:
+    python -m benchmarks.query_plans [--test-db] [--large-tables map_point,tracking_data,exercise,workout]
+                                     [--output results.json] [--compare baseline.json] [--max-regression 0.2]
+"""
+import argparse
+import asyncio
+import json
+import re
+import sys
+from types import SimpleNamespace
+
+import sqlalchemy as sa
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from benchmarks.dataset import DATASET_PASSWORD
+from benchmarks.results import build_meta, save_results
+from instrumentation import QueryStats, current_query_stats
+from models import User, Workout, Exercise, TrackingData, MapPoint
+from repository.exercise import get_exercises, get_exercise, get_exercise_tracking_data_list, \
+    get_exercise_tracking_data_updates, get_exercise_tracking_route
+from repository.fieldsets import parse_fields
+from repository.users import get_user, user_login
+from repository.workouts import get_workouts, get_workout, get_workout_version, get_workout_document
+
+LARGE_TABLES = "map_point,tracking_data,exercise,workout"
+# plan nodes reported when they appear in a plan (PostgreSQL node types and SQLite details)
+REGRESSION_NODES = ("Seq Scan", "Nested Loop", "Sort", "Materialize", "SCAN", "USE TEMP B-TREE")
+
+# case -> function(db, sample) calling the repository function
+CASES = {
+    "get_workouts": lambda db, sample: get_workouts(db=db, user_id=sample.heavy_user_id),
+    "get_workout": lambda db, sample: get_workout(db=db, workout_id=sample.workout_id, user_id=sample.user_id),
+    "get_workout_fields": lambda db, sample: get_workout(
+        db=db, workout_id=sample.workout_id, user_id=sample.user_id,
+        fields=parse_fields("id,calories,exercises(name,calories)")
+    ),
+    "get_workout_version": lambda db, sample: get_workout_version(db=db, workout_id=sample.workout_id,
+                                                                  user_id=sample.user_id),
+    "get_workout_document": lambda db, sample: get_workout_document(db=db, workout_id=sample.workout_id,
+                                                                    user_id=sample.user_id),
+    "get_exercises": lambda db, sample: get_exercises(db=db, user_id=sample.user_id, workout_id=sample.workout_id),
+    "get_exercise": lambda db, sample: get_exercise(db=db, user_id=sample.user_id, exercise_id=sample.exercise_id),
+    "get_tracking_data_list": lambda db, sample: get_exercise_tracking_data_list(
+        db=db, user_id=sample.user_id, exercise_id=sample.exercise_id
+    ),
+    "get_tracking_data_updates": lambda db, sample: get_exercise_tracking_data_updates(
+        db=db, tracking_data_id=sample.tracking_data_id
+    ),
+    "get_tracking_route": lambda db, sample: get_exercise_tracking_route(
+        db=db, user_id=sample.user_id, tracking_data_id=sample.tracking_data_id
+    ),
+    "get_user": lambda db, sample: get_user(db=db, user_id=sample.user_id),
+    "user_login": lambda db, sample: user_login(
+        db=db, user_credentials=SimpleNamespace(username=sample.username, password=DATASET_PASSWORD)
+    ),
+}
+
+
+async def pick_sample(connection):
+    """
+    Function to pick the rows the cases read: the longest route (with its exercise, workout and user)
+    and the user with the most workouts.
+
+    Returns:
+        The sample ids, or None if the database has no routes.
+    """
+    route_query = (
+        sa.select(MapPoint.tracking_data_id)
+        .group_by(MapPoint.tracking_data_id)
+        .order_by(sa.func.count().desc())
+        .limit(1)
+    )
+    tracking_data_id = (await connection.execute(route_query)).scalar()
+    if tracking_data_id is None:
+        return None
+
+    owner_query = (
+        sa.select(TrackingData.exercise_id, Exercise.workout_id, Workout.user_id, User.username)
+        .join(Exercise, Exercise.id == TrackingData.exercise_id)
+        .join(Workout, Workout.id == Exercise.workout_id)
+        .join(User, User.id == Workout.user_id)
+        .where(TrackingData.id == tracking_data_id)
+    )
+    owner = (await connection.execute(owner_query)).one()
+    heavy_user_query = sa.select(Workout.user_id).group_by(Workout.user_id).order_by(sa.func.count().desc()).limit(1)
+    heavy_user_id = (await connection.execute(heavy_user_query)).scalar()
+
+    return SimpleNamespace(tracking_data_id=tracking_data_id, exercise_id=owner.exercise_id,
+                           workout_id=owner.workout_id, user_id=owner.user_id, username=owner.username,
+                           heavy_user_id=heavy_user_id)
+
+
+def postgresql_plan(explain_output, large_tables: set):
+    """
+    Function to summarize an EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) output.
+    """
+    explain = json.loads(explain_output) if isinstance(explain_output, str) else explain_output
+    root = explain[0]["Plan"]
+    shape = []
+    full_scans = []
+
+    def visit(node, depth):
+        description = node["Node Type"]
+        if "Relation Name" in node:
+            description += f" on {node['Relation Name']}"
+        if "Index Name" in node:
+            description += f" using {node['Index Name']}"
+        shape.append("  " * depth + description)
+        if node["Node Type"] == "Seq Scan" and node.get("Relation Name") in large_tables:
+            full_scans.append(node["Relation Name"])
+        for child in node.get("Plans", []):
+            visit(child, depth + 1)
+
+    visit(root, 0)
+    return {
+        "shape": shape,
+        "full_scans": full_scans,
+        "cost": root["Total Cost"],
+        "rows": root.get("Actual Rows"),
+        "time_ms": explain[0].get("Execution Time"),
+        "shared_hit": root.get("Shared Hit Blocks", 0),
+        "shared_read": root.get("Shared Read Blocks", 0),
+    }
+
+
+def sqlite_plan(rows, large_tables: set):
+    """
+    Function to summarize an EXPLAIN QUERY PLAN output (rows of id, parent, unused and detail).
+    """
+    depths = {0: -1}
+    shape = []
+    full_scans = []
+    for node_id, parent, _, detail in rows:
+        depths[node_id] = depths.get(parent, -1) + 1
+        shape.append("  " * depths[node_id] + re.sub(r"\(.*\)", "(...)", detail))
+        words = detail.split()
+        # the ORM aliases of a table (e.g. map_point_1 in a joinedload) keep the table name
+        table = re.sub(r"_\d+$", "", words[1]) if len(words) > 1 else None
+        if words[0] == "SCAN" and table in large_tables:
+            full_scans.append(table)
+    return {"shape": shape, "full_scans": full_scans, "cost": None, "rows": None, "time_ms": None,
+            "shared_hit": None, "shared_read": None}
+
+
+async def explain(connection, statement: str, parameters, large_tables: set):
+    """
+    Function to explain a statement with the parameters of its execution.
+    """
+    if connection.dialect.name == 'postgresql':
+        result = await connection.exec_driver_sql(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {statement}",
+                                                  parameters)
+        return postgresql_plan(result.scalar(), large_tables)
+    result = await connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+    return sqlite_plan(result.all(), large_tables)
+
+
+async def run_suite(engine, large_tables: set):
+    """
+    Function to run the cases and explain their statements.
+
+    Returns:
+        The plan of every statement ("<case>#<n>" -> plan).
+    """
+    results = {}
+    async with engine.connect() as connection:
+        await connection.begin()
+        sample = await pick_sample(connection)
+        if sample is None:
+            raise RuntimeError("The database has no routes, load a dataset first (python -m benchmarks.dataset).")
+
+        for case, call in CASES.items():
+            stats = QueryStats(keep_parameters=True)
+            token = current_query_stats.set(stats)
+            try:
+                # the repository functions commit and close their session, the savepoints keep the transaction
+                db = AsyncSession(bind=connection, expire_on_commit=False, join_transaction_mode="create_savepoint")
+                await call(db, sample)
+            except HTTPException as error:
+                # the statements executed before the error are still explained
+                print(f"{case} failed ({error.status_code}: {error.detail})", file=sys.stderr)
+            finally:
+                current_query_stats.reset(token)
+
+            selects = [(statement, parameters) for statement, parameters in stats.parameters.items()
+                       if statement.lstrip().upper().startswith(("SELECT", "WITH"))]
+            for index, (statement, parameters) in enumerate(selects, 1):
+                plan = await explain(connection, statement, parameters, large_tables)
+                results[f"{case}#{index}"] = {"statement": statement, **plan}
+
+        await connection.rollback()
+    return results
+
+
+def print_plans(results: dict):
+    """
+    Function to print the plans (cost, time and buffers on PostgreSQL).
+    """
+    for key, plan in results.items():
+        measures = ""
+        if plan["cost"] is not None:
+            measures = (f"  cost {plan['cost']:.1f}, {plan['time_ms']:.2f} ms, "
+                        f"buffers hit {plan['shared_hit']} read {plan['shared_read']}")
+        print(f"\n{key}{measures}")
+        for line in plan["shape"]:
+            print(f"    {line}")
+
+
+def find_regressions(results: dict, baseline: dict = None, max_regression: float = 0.2):
+    """
+    Function to find the full scans of large tables and, with a baseline, the new plan nodes and cost growth.
+
+    Returns:
+        The list of (key, reason).
+    """
+    regressions = []
+    for key, plan in results.items():
+        for table in plan["full_scans"]:
+            regressions.append((key, f"full scan on {table}"))
+
+        previous = (baseline or {}).get(key)
+        if not previous:
+            continue
+        if previous["statement"] != plan["statement"]:
+            regressions.append((key, "the statement changed (the baseline plan does not apply)"))
+            continue
+        previous_nodes = {line.strip() for line in previous["shape"]}
+        for node in sorted({line.strip() for line in plan["shape"]} - previous_nodes):
+            if node.startswith(REGRESSION_NODES):
+                regressions.append((key, f"new plan node: {node}"))
+        if previous["cost"] and plan["cost"] and plan["cost"] / previous["cost"] - 1 > max_regression:
+            regressions.append((key, f"cost {previous['cost']:.1f} -> {plan['cost']:.1f}"))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--test-db", action="store_true", help="use the test database")
+    parser.add_argument("--large-tables", default=LARGE_TABLES, help="tables that must not be fully scanned")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/)")
+    parser.add_argument("--compare", help="results file of a previous run")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed plan cost growth")
+    args = parser.parse_args()
+
+    from db_context import db_engine, test_db_engine
+    engine = test_db_engine if args.test_db else db_engine
+    results = asyncio.run(run_suite(engine, set(args.large_tables.split(","))))
+    print_plans(results)
+
+    meta = build_meta(dialect=engine.dialect.name, large_tables=args.large_tables)
+    output = save_results("query_plans", meta, results, args.output)
+    print(f"\nresults stored in {output}")
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+    regressions = find_regressions(results, baseline, args.max_regression)
+    for key, reason in regressions:
+        print(f"REGRESSION {key}: {reason}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+results.py
+Helpers shared by the benchmarks: latency summaries, JSON result files and the comparison between two runs.
+"""
+import json
+import os
+import platform
+import subprocess
+import time
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """
+    Function to get a percentile (nearest rank) of sorted values.
+    """
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def summarize(latencies: list, elapsed: float, errors: int = 0):
+    """
+    Function to summarize the latencies (in seconds) of an operation measured during elapsed seconds.
+    """
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "errors": errors,
+        "throughput": len(values) / elapsed if elapsed else 0.0,
+        "mean_ms": sum(values) / len(values) * 1000 if values else 0.0,
+        "p50_ms": percentile(values, 0.50) * 1000,
+        "p95_ms": percentile(values, 0.95) * 1000,
+        "p99_ms": percentile(values, 0.99) * 1000,
+    }
+
+
+def git_commit():
+    """
+    Function to get the current commit (or None outside of a git checkout).
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_meta(**options):
+    """
+    Function to build the metadata of a run (commit, date, platform and benchmark options).
+    """
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": options,
+    }
+
+
+def save_results(benchmark: str, meta: dict, results: dict, output: str = None, extra: dict = None):
+    """
+    Function to store the results of a run as JSON.
+    By default the file is benchmarks/results/<benchmark>-<commit>-<timestamp>.json.
+    extra holds other measures of the run (stored next to the results, not compared).
+
+    Returns:
+        The path of the results file.
+    """
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{benchmark}-{meta['commit'] or 'local'}-{int(time.time())}.json")
+    with open(output, "w", encoding="utf-8") as results_file:
+        json.dump({"benchmark": benchmark, "meta": meta, "results": results, **(extra or {})}, results_file,
+                  indent=2)
+    return output
+
+
+def print_results(results: dict):
+    """
+    Function to print the results table.
+    """
+    print(f"{'operation':<22}{'count':>8}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, result in results.items():
+        print(f"{name:<22}{result['count']:>8}{result['errors']:>8}{result['throughput']:>10.1f}"
+              f"{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}")
+
+
+def compare_results(baseline_path: str, results: dict, max_regression: float):
+    """
+    Function to compare the results with a stored run.
+    An operation regresses when its p95 latency grows (or its throughput drops) more than max_regression.
+
+    Returns:
+        The list of regressed operations.
+    """
+    with open(baseline_path, encoding="utf-8") as baseline_file:
+        baseline = json.load(baseline_file)
+
+    print(f"\ncompared with {baseline_path} (commit {baseline['meta'].get('commit')})")
+    print(f"{'operation':<22}{'p95 ms':>20}{'change':>10}{'req/s':>20}{'change':>10}")
+    regressions = []
+    for name, result in results.items():
+        previous = baseline["results"].get(name)
+        if not previous:
+            continue
+        p95_change = result["p95_ms"] / previous["p95_ms"] - 1 if previous["p95_ms"] else 0.0
+        throughput_change = result["throughput"] / previous["throughput"] - 1 if previous["throughput"] else 0.0
+        regressed = p95_change > max_regression or throughput_change < -max_regression
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<22}{previous['p95_ms']:>9.2f} -> {result['p95_ms']:>7.2f}{p95_change:>+10.1%}"
+              f"{previous['throughput']:>9.1f} -> {result['throughput']:>7.1f}{throughput_change:>+10.1%}"
+              f"{'  REGRESSION' if regressed else ''}")
+    return regressions
@@ -0,0 +1,87 @@
+"""
+serialization.py
+Benchmark of the JSON serialization of a large tracking response (10k points route):
+the default FastAPI path (jsonable_encoder + stdlib json) against the orjson path used by the API.
+
+Usage:
+    python -m benchmarks.serialization [--points 10000] [--repeat 20]
+"""
+import argparse
+import statistics
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from json_response import FastJSONResponse
+
+
+def build_tracking_updates(points: int):
+    """
+    Function to build a tracking updates response like get_exercise_tracking_data_updates does.
+    """
+    return {
+        "id": 1,
+        "duration": 3600,
+        "is_new_set": False,
+        "is_new_record": True,
+        "distance_covered": 10000,
+        "last_updated_at": 1700000000,
+        "route": [
+            {
+                "id": index,
+                "latitude": 40.4168 + index * 0.00001,
+                "longitude": -3.7038 + index * 0.00001,
+                "tracking_data_id": 1,
+            }
+            for index in range(points)
+        ],
+    }
+
+
+def default_path(content):
+    """
+    FastAPI default path for a dict returned by a route.
+    """
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def fast_path(content):
+    """
+    Path used by the routes that return a FastJSONResponse.
+    """
+    return FastJSONResponse(content).body
+
+
+def measure(function, content, repeat: int):
+    """
+    Function to measure the duration (in ms) of each serialization.
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(content)
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    content = build_tracking_updates(args.points)
+    default_durations = measure(default_path, content, args.repeat)
+    fast_durations = measure(fast_path, content, args.repeat)
+
+    default_median = statistics.median(default_durations)
+    fast_median = statistics.median(fast_durations)
+    print(f"route points:            {args.points}")
+    print(f"jsonable_encoder + json: {default_median:8.2f} ms (median of {args.repeat})")
+    print(f"orjson:                  {fast_median:8.2f} ms (median of {args.repeat})")
+    print(f"saved per response:      {default_median - fast_median:8.2f} ms ({default_median / fast_median:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
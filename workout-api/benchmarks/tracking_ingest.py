@@ -0,0 +1,411 @@
+"""
+tracking_ingest.py
+Tracking websocket ingest benchmark. Every sender socket replays a GPS trace (a synthetic random walk or the
+track points of a recorded GPX file) into its own tracking room at a fixed rate, while spectator sockets listen.
+It measures the map points persisted per second (a point is persisted when its broadcast reaches the sender),
+the broadcast fan-out latency seen by the spectators and the database pool usage (scraped from /metrics).
+Websockets need a real server: a uvicorn server started by the benchmark (default), a uvicorn server running
+in the benchmark process (--in-process, the only mode that supports --test-db) or a running server (--url).
+
+Usage:
+    python -m benchmarks.tracking_ingest [--senders 10] [--spectators 20] [--rate 2] [--duration 20]
+                                         [--gpx trace.gpx] [--update-every 0]
+                                         [--in-process [--test-db] | --url http://localhost:8000]
+                                         [--output results.json] [--compare baseline.json] [--max-regression 0.2]
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import random
+import sys
+import time
+from collections import defaultdict
+
+import httpx
+from websockets.asyncio.client import connect
+from websockets.exceptions import ConnectionClosed
+
+from benchmarks.http_load import API_PREFIX, VirtualUser, Recorder, created_id, uvicorn_server, wait_for_server, \
+    use_test_database
+from benchmarks.results import summarize, build_meta, save_results, print_results, compare_results
+
+METERS_PER_DEGREE = 111_320
+METRICS_INTERVAL = 0.25
+# seconds to wait for the last broadcasts after the senders stop
+DRAIN_TIME = 2
+
+
+def synthetic_trace(rng: random.Random, interval: float, speed: float = 3.0):
+    """
+    Function to generate an endless random walk (speed in m/s) with a point every interval seconds.
+    """
+    lat = 40.4 + rng.uniform(-0.05, 0.05)
+    lon = -3.7 + rng.uniform(-0.05, 0.05)
+    heading = rng.uniform(0, 2 * math.pi)
+    while True:
+        yield lat, lon
+        heading += rng.gauss(0, 0.3)
+        step = speed * interval * rng.uniform(0.8, 1.2)
+        lat += step * math.cos(heading) / METERS_PER_DEGREE
+        lon += step * math.sin(heading) / (METERS_PER_DEGREE * math.cos(math.radians(lat)))
+
+
+def load_gpx_trace(path: str):
+    """
+    Function to read the track points of a GPX file.
+
+    Returns:
+        The list of (lat, lon) of every track point.
+    """
+    from repository.imports import iter_gpx_points
+
+    with open(path, "rb") as gpx_file:
+        return [(event[2], event[3]) for event in iter_gpx_points(gpx_file) if event[0] == "point"]
+
+
+def recorded_trace(points: list, offset: int):
+    """
+    Function to replay the recorded points endlessly, starting at offset (so the senders do not move together).
+    """
+    index = offset
+    while True:
+        yield points[index % len(points)]
+        index += 1
+
+
+class FanOut:
+    """
+    Class with the send times of the points of every room.
+    Broadcasts of a room arrive in the order its points were sent, so the n-th point broadcast of a room
+    received by a socket belongs to the n-th point sent to that room.
+    """
+
+    def __init__(self):
+        self.sent = defaultdict(list)
+
+    def listener(self):
+        """
+        Function to create the matcher of a receiving socket.
+
+        Returns:
+            A function that returns the latency of a received message (or None if it is not a point broadcast).
+        """
+        received = defaultdict(int)
+
+        def match(message: dict, received_at: float):
+            room = message.get("tracking_data_id") if "map_point_id" in message else None
+            if room is None or received[room] >= len(self.sent[room]):
+                return None
+            sent_at = self.sent[room][received[room]]
+            received[room] += 1
+            return received_at - sent_at
+
+        return match
+
+
+async def receive_messages(websocket, match, on_latency):
+    """
+    Function to read the messages of a socket until it is closed.
+    """
+    try:
+        async for raw_message in websocket:
+            received_at = time.perf_counter()
+            message = json.loads(raw_message)
+            if not isinstance(message, dict):
+                continue
+            latency = match(message, received_at)
+            if latency is not None:
+                on_latency(message, latency)
+    except ConnectionClosed:
+        pass
+
+
+class TrackingSender:
+    """
+    Class of a socket that sends the points of a trace to its tracking room.
+    """
+
+    def __init__(self, room: int, trace, fan_out: FanOut):
+        self.room = room
+        self.trace = trace
+        self.fan_out = fan_out
+        self.persisted = []
+        self.sent = 0
+        self.closed_early = False
+
+    def message(self, update: bool):
+        lat, lon = next(self.trace)
+        message = {"map_point": {"lat": lat, "lon": lon}, "update_tracking_data": update}
+        if update:
+            message["updated_tracking_data"] = {"duration": self.sent}
+        return message
+
+    async def run(self, url: str, rate: float, start: float, deadline: float, update_every: int):
+        """
+        Function to send a point every 1/rate seconds (from start to deadline) and wait for the last broadcasts.
+        """
+        interval = 1 / rate
+
+        def on_latency(message, latency):
+            if message["tracking_data_id"] == self.room:
+                self.persisted.append(latency)
+
+        async with connect(url, max_size=None) as websocket:
+            receiver = asyncio.create_task(receive_messages(websocket, self.fan_out.listener(), on_latency))
+            next_send = start + random.uniform(0, interval)
+            try:
+                while next_send < deadline and not receiver.done():
+                    await asyncio.sleep(max(next_send - time.perf_counter(), 0))
+                    update = bool(update_every) and (self.sent + 1) % update_every == 0
+                    self.fan_out.sent[self.room].append(time.perf_counter())
+                    await websocket.send(json.dumps(self.message(update)))
+                    self.sent += 1
+                    # a slow server delays the next points instead of queuing them
+                    next_send = max(next_send + interval, time.perf_counter())
+            except ConnectionClosed:
+                pass
+            self.closed_early = receiver.done()
+
+            drain_deadline = time.perf_counter() + DRAIN_TIME
+            while len(self.persisted) < self.sent and time.perf_counter() < drain_deadline and not receiver.done():
+                await asyncio.sleep(0.05)
+            receiver.cancel()
+
+
+class Spectator:
+    """
+    Class of a socket that only listens to the broadcasts of a tracking room.
+    """
+
+    def __init__(self, fan_out: FanOut):
+        self.fan_out = fan_out
+        self.latencies = []
+        self.websocket = None
+        self.receiver = None
+
+    async def open(self, url: str):
+        self.websocket = await connect(url, max_size=None)
+        self.receiver = asyncio.create_task(receive_messages(
+            self.websocket, self.fan_out.listener(), lambda _message, latency: self.latencies.append(latency)
+        ))
+
+    async def close(self):
+        self.receiver.cancel()
+        await self.websocket.close()
+
+
+def parse_metrics(text: str):
+    """
+    Function to read the samples of the Prometheus text format (the samples of a family are added up).
+    """
+    samples = defaultdict(float)
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        name, _, value = line.rpartition(" ")
+        samples[name.split("{", 1)[0]] += float(value)
+    return samples
+
+
+class PoolSampler:
+    """
+    Class to sample the database pool and tracking socket metrics of the server during the run.
+    """
+
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
+        self.samples = []
+
+    async def scrape(self):
+        response = await self.client.get(f"{API_PREFIX}/metrics")
+        return parse_metrics(response.text)
+
+    async def run(self, stop: asyncio.Event):
+        while not stop.is_set():
+            self.samples.append(await self.scrape())
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(stop.wait(), METRICS_INTERVAL)
+        self.samples.append(await self.scrape())
+
+    def results(self):
+        checked_out = [sample.get("db_pool_checked_out", 0) for sample in self.samples]
+        first, last = self.samples[0], self.samples[-1]
+        return {
+            "pool_size": last.get("db_pool_size", 0),
+            "checked_out_max": max(checked_out),
+            "checked_out_mean": sum(checked_out) / len(checked_out),
+            "overflow_max": max(sample.get("db_pool_overflow", 0) for sample in self.samples),
+            "checkouts": last.get("db_pool_checkouts_total", 0) - first.get("db_pool_checkouts_total", 0),
+            "checkout_wait_seconds": (last.get("db_pool_checkout_wait_seconds_sum", 0)
+                                      - first.get("db_pool_checkout_wait_seconds_sum", 0)),
+            "sockets_max": max(sample.get("tracking_sockets_active", 0) for sample in self.samples),
+        }
+
+
+async def create_rooms(client: httpx.AsyncClient, rooms: int, seed: int):
+    """
+    Function to create a benchmark user with an exercise and its tracking rooms.
+
+    Returns:
+        The tracking room ids.
+    """
+    user = VirtualUser(client, Recorder(), seed)
+    await user.setup()
+    room_ids = []
+    for _ in range(rooms):
+        response = await user.request("tracking_create", "POST", f"/exercise/tracking/{user.exercise_ids[0]}",
+                                      json={"duration": 0, "description": "tracking benchmark", "distance_covered": 0})
+        room_id = created_id(response, "Tracking data")
+        if room_id is None:
+            raise RuntimeError("The tracking rooms could not be created, check the API logs.")
+        room_ids.append(room_id)
+    return room_ids
+
+
+async def run_benchmark(client: httpx.AsyncClient, ws_url: str, args):
+    """
+    Function to connect the spectators, replay the traces of the senders and collect the measures.
+
+    Returns:
+        The latency results and the database pool usage.
+    """
+    rng = random.Random(args.seed)
+    room_ids = await create_rooms(client, args.senders, args.seed)
+    gpx_points = load_gpx_trace(args.gpx) if args.gpx else None
+
+    def room_url(room_id):
+        return f"{ws_url}{API_PREFIX}/exercise/ws/tracking/{room_id}"
+
+    fan_out = FanOut()
+    senders = [
+        TrackingSender(room_id, recorded_trace(gpx_points, index * len(gpx_points) // args.senders) if gpx_points
+                       else synthetic_trace(random.Random(rng.random()), 1 / args.rate), fan_out)
+        for index, room_id in enumerate(room_ids)
+    ]
+    spectators = [Spectator(fan_out) for _ in range(args.spectators)]
+    await asyncio.gather(*(spectator.open(room_url(room_ids[index % len(room_ids)]))
+                           for index, spectator in enumerate(spectators)))
+
+    sampler = PoolSampler(client)
+    stop_sampling = asyncio.Event()
+    sampling = asyncio.create_task(sampler.run(stop_sampling))
+
+    start = time.perf_counter()
+    deadline = start + args.duration
+    await asyncio.gather(*(sender.run(room_url(sender.room), args.rate, start, deadline, args.update_every)
+                           for sender in senders))
+    elapsed = min(time.perf_counter(), deadline) - start
+
+    stop_sampling.set()
+    await sampling
+    await asyncio.gather(*(spectator.close() for spectator in spectators))
+
+    sent = sum(sender.sent for sender in senders)
+    persisted = [latency for sender in senders for latency in sender.persisted]
+    results = {
+        "point_persisted": summarize(persisted, elapsed, sent - len(persisted)),
+        "spectator_fan_out": summarize([latency for spectator in spectators for latency in spectator.latencies],
+                                       elapsed),
+    }
+    usage = {
+        "points_sent": sent,
+        "senders_closed_early": sum(sender.closed_early for sender in senders),
+        "db_pool": sampler.results(),
+    }
+    return results, usage
+
+
+@contextlib.asynccontextmanager
+async def in_process_server(port: int, test_db: bool):
+    """
+    Function to run the app in a uvicorn server inside the benchmark event loop.
+
+    Yields:
+        The base url of the server.
+    """
+    import uvicorn
+    from app import app
+
+    if test_db:
+        from db_context import test_db_engine, prepare_database
+        use_test_database()
+        await prepare_database(test_db_engine)
+    server = uvicorn.Server(uvicorn.Config(app, port=port, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        await serving
+
+
+@contextlib.asynccontextmanager
+async def open_server(args):
+    """
+    Function to start the selected target.
+
+    Yields:
+        The HTTP client and the websockets base url of the server.
+    """
+    async with contextlib.AsyncExitStack() as stack:
+        if args.url:
+            base_url = args.url
+        elif args.in_process:
+            base_url = await stack.enter_async_context(in_process_server(args.port, args.test_db))
+        else:
+            base_url = stack.enter_context(uvicorn_server(args.port))
+        client = await stack.enter_async_context(httpx.AsyncClient(base_url=base_url, timeout=httpx.Timeout(30)))
+        await wait_for_server(client)
+        yield client, "ws" + base_url.removeprefix("http")
+
+
+async def main_async(args):
+    async with open_server(args) as (client, ws_url):
+        return await run_benchmark(client, ws_url, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--senders", type=int, default=10, help="sockets sending points (one tracking room each)")
+    parser.add_argument("--spectators", type=int, default=20, help="sockets only listening to the broadcasts")
+    parser.add_argument("--rate", type=float, default=2, help="points per second of every sender")
+    parser.add_argument("--duration", type=float, default=20, help="seconds sending points")
+    parser.add_argument("--gpx", help="replay the track points of this GPX file instead of synthetic traces")
+    parser.add_argument("--update-every", type=int, default=0,
+                        help="also update the tracking data every n points (0: never)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8765, help="port of the uvicorn server")
+    parser.add_argument("--in-process", action="store_true", help="run the uvicorn server in the benchmark process")
+    parser.add_argument("--url", help="benchmark a running server")
+    parser.add_argument("--test-db", action="store_true", help="use the test database (--in-process only)")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/)")
+    parser.add_argument("--compare", help="results file of a previous run")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="allowed p95/throughput change before a regression is reported")
+    args = parser.parse_args()
+
+    results, usage = asyncio.run(main_async(args))
+
+    print(f"{args.senders} senders at {args.rate:g} points/s, {args.spectators} spectators, {args.duration:.0f} s")
+    print_results(results)
+    print(f"\npoints sent {usage['points_sent']}, persisted {results['point_persisted']['count']} "
+          f"({results['point_persisted']['throughput']:.1f}/s), senders closed early {usage['senders_closed_early']}")
+    pool = usage["db_pool"]
+    print(f"db pool: size {pool['pool_size']:.0f}, checked out max {pool['checked_out_max']:.0f} "
+          f"mean {pool['checked_out_mean']:.1f}, overflow max {pool['overflow_max']:.0f}, "
+          f"checkouts {pool['checkouts']:.0f}, checkout wait {pool['checkout_wait_seconds']:.3f} s")
+
+    target = args.url or ("in-process" if args.in_process else "uvicorn")
+    meta = build_meta(target=target, senders=args.senders, spectators=args.spectators, rate=args.rate,
+                      duration=args.duration, gpx=args.gpx, update_every=args.update_every, seed=args.seed)
+    output = save_results("tracking_ingest", meta, results, args.output, extra=usage)
+    print(f"\nresults stored in {output}")
+
+    if args.compare and compare_results(args.compare, results, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+cache.py
+Module with the read-through cache used for the serialized responses of the read endpoints.
+Entries are grouped by scope (e.g. "workout:1"), each scope keeps one serialized response per user and variant,
+and the repository write functions invalidate the whole scope.
+"""
+import logging
+import time
+import uuid
+from collections import OrderedDict
+
+from json_response import dump_json
+from settings import CACHE_BACKEND, CACHE_MAX_ENTRIES, CACHE_TTL, CACHE_URL
+
+# field of a scope identifying its current generation (dropped with the scope by an invalidation)
+GENERATION_FIELD = '_generation'
+
+
+class LRUCacheBackend:
+    """
+    In-process cache backend with a LRU eviction policy.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    async def get(self, key: str, field: str):
+        """
+        Function to get a cached value.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, fields = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return fields.get(field)
+
+    async def set(self, key: str, field: str, value: bytes, ttl: int):
+        """
+        Function to store a value. The scope expiration starts with its first value.
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            entry = (time.monotonic() + ttl, {})
+            self._entries[key] = entry
+        entry[1][field] = value
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, key: str):
+        """
+        Function to drop every value of a scope.
+        """
+        self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class LocalCacheClient:
+    """
+    Local stand-in for an external key-value store (redis-like hash API), used when no cache server is configured.
+    """
+
+    def __init__(self):
+        self.expirations = 0
+        self._hashes = {}
+        self._expires_at = {}
+
+    def _expire_if_needed(self, name: str):
+        expires_at = self._expires_at.get(name)
+        if expires_at is not None and expires_at < time.monotonic():
+            self._hashes.pop(name, None)
+            self._expires_at.pop(name, None)
+            self.expirations += 1
+
+    async def hget(self, name: str, key: str):
+        """
+        Function to get a field of a hash.
+        """
+        self._expire_if_needed(name)
+        return self._hashes.get(name, {}).get(key)
+
+    async def hset(self, name: str, key: str, value: bytes):
+        """
+        Function to set a field of a hash.
+        """
+        self._expire_if_needed(name)
+        self._hashes.setdefault(name, {})[key] = value
+
+    async def expire(self, name: str, seconds: int, nx: bool = False):
+        """
+        Function to set the expiration of a hash.
+        """
+        if nx and name in self._expires_at:
+            return
+        self._expires_at[name] = time.monotonic() + seconds
+
+    async def delete(self, name: str):
+        """
+        Function to delete a hash.
+        """
+        self._hashes.pop(name, None)
+        self._expires_at.pop(name, None)
+
+    def __len__(self):
+        return len(self._hashes)
+
+
+class ExternalCacheBackend:
+    """
+    Cache backend stored in an external key-value server (any client with the redis hash API).
+    """
+
+    def __init__(self, client, prefix: str = 'workout-api:'):
+        self.client = client
+        self.prefix = prefix
+
+    @property
+    def evictions(self):
+        """
+        Evictions are handled by the server, only the local stand-in reports them.
+        """
+        return getattr(self.client, 'expirations', None)
+
+    async def get(self, key: str, field: str):
+        """
+        Function to get a cached value.
+        """
+        return await self.client.hget(self.prefix + key, field)
+
+    async def set(self, key: str, field: str, value: bytes, ttl: int):
+        """
+        Function to store a value. The scope expiration starts with its first value.
+        """
+        await self.client.hset(self.prefix + key, field, value)
+        await self.client.expire(self.prefix + key, ttl, nx=True)
+
+    async def delete(self, key: str):
+        """
+        Function to drop every value of a scope.
+        """
+        await self.client.delete(self.prefix + key)
+
+    def __len__(self):
+        return len(self.client) if hasattr(self.client, '__len__') else 0
+
+
+class ResponseCache:
+    """
+    Class to handle the read-through cache of serialized responses.
+    """
+
+    def __init__(self, backend, ttl: int):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    async def get_or_load(self, scope: str, user_id: int, loader, variant: str = '', version: int = None) -> bytes:
+        """
+        Function to get the serialized response of a scope for a user,
+        calling the loader (and caching its result) on a miss.
+        The version (of a versioned resource) is part of the key, so a response cached before a change
+        is never served with the ETag of the new version. The unversioned scopes rely on the scope generation:
+        a response loaded while the scope was invalidated may be stale, so it is returned but not stored.
+        """
+        field = f'{user_id}:{version}:{variant}' if version is not None else f'{user_id}:{variant}'
+        cached = await self.backend.get(scope, field)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        self.misses += 1
+        generation = await self.backend.get(scope, GENERATION_FIELD)
+        if generation is None:
+            generation = uuid.uuid4().hex.encode()
+            await self.backend.set(scope, GENERATION_FIELD, generation, self.ttl)
+        payload = dump_json(await loader())
+        if await self.backend.get(scope, GENERATION_FIELD) == generation:
+            await self.backend.set(scope, field, payload, self.ttl)
+        return payload
+
+    async def invalidate(self, *scopes: str):
+        """
+        Function to drop the cached responses of the given scopes.
+        Errors are only logged, the entries will expire with the TTL anyway.
+        """
+        for scope in scopes:
+            try:
+                await self.backend.delete(scope)
+            except Exception as error:
+                logging.error("Cache invalidation of %s failed: %s", scope, error, exc_info=True)
+
+    def stats(self):
+        """
+        Function to get the cache statistics.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": len(self.backend),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.backend.evictions
+        }
+
+
+def create_cache_backend():
+    """
+    Function to create the cache backend configured in the settings.
+    """
+    if CACHE_BACKEND != 'external':
+        return LRUCacheBackend(max_entries=CACHE_MAX_ENTRIES)
+
+    if not CACHE_URL:
+        return ExternalCacheBackend(LocalCacheClient())
+
+    try:
+        from redis import asyncio as redis_asyncio
+    except ImportError as error:
+        raise RuntimeError('The "redis" package is required to use an external cache server.') from error
+    return ExternalCacheBackend(redis_asyncio.from_url(CACHE_URL))
+
+
+def workout_scope(workout_id) -> str:
+    """
+    Cache scope of a workout detail.
+    """
+    return f'workout:{workout_id}'
+
+
+def exercises_scope(workout_id) -> str:
+    """
+    Cache scope of the exercises list of a workout.
+    """
+    return f'workout:{workout_id}:exercises'
+
+
+def tracking_scope(exercise_id) -> str:
+    """
+    Cache scope of the tracking data list of an exercise.
+    """
+    return f'exercise:{exercise_id}:tracking'
+
+
+response_cache = ResponseCache(backend=create_cache_backend(), ttl=CACHE_TTL)
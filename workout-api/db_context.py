@@ -1,9 +1,71 @@
+import os
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import StaticPool
 
+from instrumentation import instrument_engine
+from metrics import InstrumentedQueuePool
 from settings import connection_string, test_connection_string
 
-db_engine = create_async_engine(connection_string)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def is_memory_database(url) -> bool:
+    """
+    Function to check if an url points to an in-memory SQLite database.
+    """
+    url = make_url(url)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def configure_sqlite_connection(dbapi_connection, _connection_record):
+    """
+    Function to enable the foreign keys (and the cascades of the migrations) on every SQLite connection.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+def create_engine(url: str, **options):
+    """
+    Function to create the engine of a database url.
+    An in-memory SQLite database only lives in its connection, so all the sessions share one (StaticPool).
+    """
+    if is_memory_database(url):
+        options["poolclass"] = StaticPool
+    engine = create_async_engine(url, **options)
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine.sync_engine, 'connect', configure_sqlite_connection)
+    instrument_engine(engine)
+    return engine
+
+
+def run_migrations(connection):
+    """
+    Function to upgrade the database of a connection to the last migration.
+    """
+    config = Config(os.path.join(BASE_DIR, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(BASE_DIR, "alembic"))
+    config.attributes["connection"] = connection
+    command.upgrade(config, "head")
+
+
+async def prepare_database(engine):
+    """
+    Function to migrate an in-memory SQLite database, which is empty every time the engine starts.
+    """
+    if is_memory_database(engine.url):
+        async with engine.begin() as connection:
+            await connection.run_sync(run_migrations)
+
+
+db_engine = create_engine(connection_string, poolclass=InstrumentedQueuePool)
 async_session = async_sessionmaker(db_engine, expire_on_commit=False)
 
-test_db_engine = create_async_engine(test_connection_string)
+test_db_engine = create_engine(test_connection_string)
 test_async_session = async_sessionmaker(test_db_engine, expire_on_commit=False)
@@ -1,5 +1,5 @@
 from typing import Optional
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, Field, field_validator, model_validator
 from crypto import hash_password
 
 
@@ -97,3 +97,34 @@ class TrackingBase(BaseModel):
 class CreateTrackingRoomDTO(TrackingBase):
     duration: int
     description: str
+
+
+class TrackingMapPointDTO(BaseModel):
+    # strict: "5" or 5.0 would be stored as 5 by SQLite (missing the resent point) and rejected by COPY
+    lat: float = Field(strict=True, ge=-90, le=90, allow_inf_nan=False)
+    lon: float = Field(strict=True, ge=-180, le=180, allow_inf_nan=False)
+    seq: Optional[int] = Field(None, strict=True, ge=0)
+
+
+class TrackingMessageDTO(BaseModel):
+    map_point: TrackingMapPointDTO
+    update_tracking_data: bool = False
+    updated_tracking_data: Optional[dict] = None
+
+    @model_validator(mode='after')
+    def check_update(self):
+        if self.update_tracking_data and self.updated_tracking_data is None:
+            raise ValueError('The updated tracking data is missing.')
+        return self
+
+
+class CreateNestedExerciseDTO(ExerciseBase):
+    name: str
+    exercise_type: str
+    duration: int
+    calories: int
+    tracking_rooms: list[CreateTrackingRoomDTO] = []
+
+
+class CreateWorkoutWithExercisesDTO(CreateWorkoutDTO):
+    exercises: list[CreateNestedExerciseDTO] = []
@@ -0,0 +1,297 @@
+"""
+ingest.py
+Module with the write-behind buffer of the live tracking points. The tracking sockets of every room put their points
+in one process-wide buffer and a background task writes them in group commits, every INGEST_FLUSH_INTERVAL_MS or
+INGEST_BATCH_SIZE points: COPY into a staging table on PostgreSQL (the ids are reserved from the sequence first),
+a multi-row insert on SQLite. The points with a sequence number are inserted idempotently (ON CONFLICT DO NOTHING on
+the tracking data id and sequence number), so the points resent after a reconnection are only stored once.
+A socket waits until its point is committed, and waits for room in the buffer when INGEST_MAX_PENDING points are not
+flushed yet (backpressure). The pending points are flushed when the app stops.
+"""
+import asyncio
+import contextlib
+import logging
+import time
+
+import sqlalchemy as sa
+from fastapi import HTTPException
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import SQLAlchemyError
+
+from metrics import registry, repository_errors, Counter, Gauge, Histogram
+from models import MapPoint
+from repository.utils import get_current_time
+from settings import INGEST_FLUSH_INTERVAL_MS, INGEST_BATCH_SIZE, INGEST_MAX_PENDING
+
+COLUMNS = ("lat", "lon", "created_at", "last_updated_at", "tracking_data_id", "seq")
+TRACKING_DATA_ID, SEQ = COLUMNS.index("tracking_data_id"), COLUMNS.index("seq")
+STAGING_TABLE = "map_point_staging"
+STOPPED_DETAIL = 'The tracking service is stopping. Please try again later.'
+FLUSH_SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+FLUSH_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+ingest_flush_rows = registry.register(Histogram(
+    'tracking_ingest_flush_rows', 'Map points written per group commit.', buckets=FLUSH_SIZE_BUCKETS
+))
+ingest_flush_duration = registry.register(Histogram(
+    'tracking_ingest_flush_seconds', 'Duration of the map point group commits.', buckets=FLUSH_LATENCY_BUCKETS
+))
+ingest_backpressure_waits = registry.register(Counter(
+    'tracking_ingest_backpressure_waits_total', 'Map points that waited for room in the full ingest buffer.'
+))
+ingest_flush_errors = registry.register(Counter(
+    'tracking_ingest_flush_errors_total', 'Failed group commits (their points are written again one by one).'
+))
+
+
+class MapPointIngestBuffer:
+    """
+    Class to buffer the map points of every tracking room and write them in group commits.
+    """
+
+    def __init__(self, flush_interval: float, batch_size: int, max_pending: int):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.session_factory = None
+        # (row in COLUMNS order, future of the map point id)
+        self.pending = []
+        # the group being written (the points left when the flush task is cancelled)
+        self._flushing = []
+        self._loop = None
+        self._task = None
+        self._slots = None
+        self._has_rows = None
+        self._batch_full = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done() and not self._stopping
+
+    def start(self, session_factory):
+        """
+        Function to start the flush task (must be called from the event loop, does nothing if it already runs).
+        """
+        loop = asyncio.get_running_loop()
+        if self.running and self._loop is loop:
+            return
+        self.session_factory = session_factory
+        self.pending = []
+        self._flushing = []
+        self._loop = loop
+        self._slots = asyncio.Semaphore(self.max_pending)
+        self._has_rows = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10):
+        """
+        Function to flush the pending points and stop the flush task.
+        After the timeout the task is cancelled and the points not flushed yet are failed (their sockets get an error).
+        """
+        if not self.running or self._loop is not asyncio.get_running_loop():
+            return
+        self._stopping = True
+        self._has_rows.set()
+        self._batch_full.set()
+        try:
+            # shielded, so the timeout does not cancel the task in the middle of a write
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            remaining = self._flushing + self.pending
+            self._flushing = []
+            self.pending = []
+            logging.error("The map point ingest buffer was stopped with %s points not flushed.", len(remaining))
+            self._resolve(remaining, error=HTTPException(status_code=503, detail=STOPPED_DETAIL))
+        self._task = None
+
+    async def submit(self, tracking_data_id: int, map_point: dict) -> int:
+        """
+        Function to add a map point to the buffer and wait for its group commit.
+
+        Returns:
+            The id of the new map point, or None if the point (same tracking data and sequence number) is stored.
+        """
+        if not self.running:
+            raise RuntimeError("The map point ingest buffer is not running.")
+        row = map_point_row(tracking_data_id, map_point)
+
+        if self._slots.locked():
+            ingest_backpressure_waits.inc()
+        await self._slots.acquire()
+        if self._task is None:
+            # stopped while waiting for room in the buffer
+            self._slots.release()
+            raise HTTPException(status_code=503, detail=STOPPED_DETAIL)
+        future = self._loop.create_future()
+        self.pending.append((row, future))
+        self._has_rows.set()
+        if len(self.pending) >= self.batch_size:
+            self._batch_full.set()
+        return await future
+
+    async def _run(self):
+        while True:
+            await self._has_rows.wait()
+            if not self.pending:
+                if self._stopping:
+                    return
+                self._has_rows.clear()
+                continue
+
+            if len(self.pending) < self.batch_size and not self._stopping:
+                # the first point of a group waits at most one interval for the points of the other rooms
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._batch_full.wait(), self.flush_interval)
+
+            batch = self.pending[:self.batch_size]
+            del self.pending[:self.batch_size]
+            if len(self.pending) < self.batch_size:
+                self._batch_full.clear()
+            if not self.pending and not self._stopping:
+                self._has_rows.clear()
+            self._flushing = batch
+            await self._flush(batch)
+            self._flushing = []
+
+    async def _flush(self, batch: list):
+        start_time = time.perf_counter()
+        try:
+            map_point_ids = await self._write([row for row, _future in batch])
+        except Exception as error:
+            ingest_flush_errors.inc()
+            if len(batch) > 1:
+                # one invalid point (e.g. of a deleted tracking room) must not fail the points of the other rooms
+                logging.warning("Group commit of %s map points failed, writing them one by one: %s", len(batch), error)
+                while batch:
+                    await self._flush(batch[:1])
+                    # dropped once resolved, the group only keeps the points that are still waiting
+                    del batch[0]
+                return
+            if isinstance(error, SQLAlchemyError):
+                logging.error("Data base error has occurred: %s", error, exc_info=True)
+                detail = 'An internal database-related error occurred. Please try again later.'
+            else:
+                logging.error("Unexpected error has occurred: %s", error, exc_info=True)
+                detail = 'An internal server error occurred. Please try again later.'
+            repository_errors.inc("map_point_ingest")
+            self._resolve(batch, error=HTTPException(status_code=500, detail=detail))
+            return
+
+        ingest_flush_rows.observe(len(batch))
+        ingest_flush_duration.observe(time.perf_counter() - start_time)
+        self._resolve(batch, map_point_ids)
+
+    def _resolve(self, batch: list, map_point_ids: list = None, error: Exception = None):
+        for index, (_row, future) in enumerate(batch):
+            # the socket could be gone (cancelled future), its point is written anyway
+            if not future.done():
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(map_point_ids[index])
+            self._slots.release()
+
+    async def _write(self, rows: list) -> list:
+        """
+        Function to write the rows in one transaction.
+
+        Returns:
+            The ids of the rows (in the same order), None for the rows that were already stored.
+        """
+        async with self.session_factory() as session:
+            map_point_ids = await write_rows(await session.connection(), rows)
+            await session.commit()
+        return map_point_ids
+
+
+def map_point_row(tracking_data_id: int, map_point: dict) -> tuple:
+    """
+    Function to build the row (in COLUMNS order) of a tracking point.
+    """
+    now = get_current_time()
+    return map_point['lat'], map_point['lon'], now, now, tracking_data_id, map_point.get('seq')
+
+
+async def write_rows(connection, rows: list) -> list:
+    """
+    Function to write the rows with the method of the database, in the transaction of the connection.
+
+    Returns:
+        The ids of the rows (in the same order), None for the rows that were already stored.
+    """
+    if connection.dialect.name == 'postgresql':
+        return await copy_rows(connection, rows)
+    return await insert_rows(connection, rows)
+
+
+async def copy_rows(connection, rows: list) -> list:
+    """
+    Function to write the rows on PostgreSQL: COPY into a temporary table, then one INSERT ... SELECT
+    that skips the stored sequence numbers.
+    """
+    # COPY returns nothing, the ids are taken from the sequence like the default of the column
+    sequence = sa.func.pg_get_serial_sequence(MapPoint.__tablename__, 'id')
+    query = sa.select(sa.func.nextval(sequence)).select_from(sa.func.generate_series(1, len(rows)))
+    map_point_ids = (await connection.execute(query)).scalars().all()
+
+    # the staging table lives as long as the pooled connection, its rows are deleted by every commit
+    await connection.exec_driver_sql(f"CREATE TEMPORARY TABLE IF NOT EXISTS {STAGING_TABLE} "
+                                     f"(LIKE {MapPoint.__tablename__}) ON COMMIT DELETE ROWS")
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(
+        STAGING_TABLE, columns=("id",) + COLUMNS,
+        records=[(map_point_id, *row) for map_point_id, row in zip(map_point_ids, rows)]
+    )
+
+    staging = sa.table(STAGING_TABLE, *(sa.column(name) for name in ("id",) + COLUMNS))
+    query = (
+        postgresql.insert(MapPoint)
+        # in the order of the rows, so a point sent twice in the same group is stored by its first copy
+        .from_select(("id",) + COLUMNS, sa.select(*staging.c).order_by(staging.c.id))
+        .on_conflict_do_nothing(index_elements=("tracking_data_id", "seq"))
+        .returning(MapPoint.id)
+    )
+    stored_ids = set((await connection.execute(query)).scalars())
+    return [map_point_id if map_point_id in stored_ids else None for map_point_id in map_point_ids]
+
+
+async def insert_rows(connection, rows: list) -> list:
+    """
+    Function to write the rows on SQLite with multi-row inserts (the rows with a sequence number skip the stored ones).
+    """
+    map_point_ids = [None] * len(rows)
+    unsequenced = [index for index, row in enumerate(rows) if row[SEQ] is None]
+    sequenced = [index for index, row in enumerate(rows) if row[SEQ] is not None]
+
+    if unsequenced:
+        query = sa.insert(MapPoint).returning(MapPoint.id, sort_by_parameter_order=True)
+        result = await connection.execute(query, [dict(zip(COLUMNS, rows[index])) for index in unsequenced])
+        for index, map_point_id in zip(unsequenced, result.scalars()):
+            map_point_ids[index] = map_point_id
+
+    if sequenced:
+        # the skipped rows return nothing, so the stored rows are matched by their sequence number
+        query = (
+            sqlite.insert(MapPoint)
+            .on_conflict_do_nothing(index_elements=("tracking_data_id", "seq"))
+            .returning(MapPoint.id, MapPoint.tracking_data_id, MapPoint.seq)
+        )
+        result = await connection.execute(query, [dict(zip(COLUMNS, rows[index])) for index in sequenced])
+        stored_ids = {(row.tracking_data_id, row.seq): row.id for row in result}
+        for index in sequenced:
+            # a point sent twice in the same group is stored by its first copy
+            map_point_ids[index] = stored_ids.pop((rows[index][TRACKING_DATA_ID], rows[index][SEQ]), None)
+
+    return map_point_ids
+
+
+map_point_ingest = MapPointIngestBuffer(flush_interval=INGEST_FLUSH_INTERVAL_MS / 1000, batch_size=INGEST_BATCH_SIZE,
+                                        max_pending=INGEST_MAX_PENDING)
+registry.register(Gauge('tracking_ingest_pending_rows', 'Map points waiting for the next group commit.',
+                        callback=lambda: len(map_point_ingest.pending)))
@@ -0,0 +1,124 @@
+"""
+instrumentation.py
+Module with the per-request SQL instrumentation. Engine events record the query count, the total database time
+and the slowest statement of the current request; the middleware exposes them as response headers
+(X-DB-Query-Count, X-DB-Time-Ms) and logs slow statements and possible N+1 patterns.
+"""
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+from settings import SLOW_QUERY_MS, N_PLUS_ONE_THRESHOLD
+
+QUERY_COUNT_HEADER = "x-db-query-count"
+QUERY_TIME_HEADER = "x-db-time-ms"
+
+
+class QueryStats:
+    """
+    Class with the SQL statistics of a request.
+    """
+
+    def __init__(self, keep_parameters: bool = False):
+        self.count = 0
+        self.total_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement = None
+        self.statements = Counter()
+        self.keep_parameters = keep_parameters
+        # statement -> parameters of its first execution (only kept on demand, e.g. to explain the statements)
+        self.parameters = {}
+
+    def record(self, statement: str, elapsed: float, parameters=None):
+        """
+        Function to record an executed statement.
+        """
+        self.count += 1
+        self.total_time += elapsed
+        self.statements[statement] += 1
+        if self.keep_parameters and statement not in self.parameters:
+            self.parameters[statement] = parameters
+        if elapsed >= self.slowest_time:
+            self.slowest_time = elapsed
+            self.slowest_statement = statement
+
+    def repeated_statements(self, threshold: int):
+        """
+        Function to get the statements executed at least threshold times (usually an N+1 pattern).
+        """
+        return [(statement, count) for statement, count in self.statements.items() if count >= threshold]
+
+
+current_query_stats: ContextVar[QueryStats | None] = ContextVar("current_query_stats", default=None)
+
+
+def before_cursor_execute(_conn, _cursor, _statement, _parameters, context, _executemany):
+    # the start time lives in the execution context, so a failed statement does not leave anything behind
+    context.query_start_time = time.perf_counter()
+
+
+def after_cursor_execute(_conn, _cursor, statement, parameters, context, _executemany):
+    stats = current_query_stats.get()
+    if stats is not None:
+        stats.record(statement, time.perf_counter() - context.query_start_time, parameters)
+
+
+def instrument_engine(engine):
+    """
+    Function to register the instrumentation events of an (async) engine.
+    """
+    sync_engine = getattr(engine, "sync_engine", engine)
+    if not event.contains(sync_engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(sync_engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", after_cursor_execute)
+
+
+def log_query_stats(path: str, stats: QueryStats):
+    """
+    Function to log the slow statements and the possible N+1 patterns of a request.
+    """
+    if stats.slowest_statement is None:
+        return
+
+    slowest_ms = stats.slowest_time * 1000
+    if slowest_ms >= SLOW_QUERY_MS:
+        logging.warning("Slow query on %s (%.1f ms): %s", path, slowest_ms, stats.slowest_statement)
+    else:
+        logging.debug("Slowest query on %s (%.1f ms): %s", path, slowest_ms, stats.slowest_statement)
+
+    for statement, count in stats.repeated_statements(N_PLUS_ONE_THRESHOLD):
+        logging.warning("Possible N+1 on %s, statement executed %s times: %s", path, count, statement)
+
+
+class QueryStatsMiddleware:
+    """
+    ASGI middleware that collects the SQL statistics of every HTTP request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = current_query_stats.set(stats)
+
+        async def send_with_stats(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((QUERY_COUNT_HEADER.encode(), str(stats.count).encode()))
+                headers.append((QUERY_TIME_HEADER.encode(), f"{stats.total_time * 1000:.2f}".encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            current_query_stats.reset(token)
+            log_query_stats(scope["path"], stats)
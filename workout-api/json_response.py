@@ -0,0 +1,26 @@
+"""
+json_response.py
+Module with the orjson-backed JSON serialization used by the API responses.
+"""
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+
+def dump_json(content) -> bytes:
+    """
+    Function to serialize content to JSON bytes.
+    Plain data (dicts, lists, numbers, enums) is encoded by orjson directly,
+    anything else (ORM entities, pydantic models) falls back to the FastAPI encoder.
+    """
+    return orjson.dumps(content, default=jsonable_encoder, option=orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson.
+    Routes can return it directly to skip the jsonable_encoder pass (and the response_model validation).
+    """
+
+    def render(self, content) -> bytes:
+        return dump_json(content)
@@ -0,0 +1,128 @@
+"""
+loop_monitor.py
+Module with the event loop lag monitor. A heartbeat task measures how late the loop wakes it up (the loop lag),
+and a watchdog thread captures the stack of the event loop thread when the heartbeat stalls over the threshold,
+so the blocking call (e.g. a password hash or a sync I/O call) can be identified.
+"""
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from metrics import registry, Counter, Gauge, Histogram
+from settings import LOOP_LAG_INTERVAL_MS, LOOP_LAG_THRESHOLD_MS
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+LAG_QUANTILES = (0.5, 0.95, 0.99)
+
+loop_lag = registry.register(Histogram(
+    'event_loop_lag_seconds', 'Delay of the event loop heartbeat.', buckets=LAG_BUCKETS
+))
+loop_stalls = registry.register(Counter(
+    'event_loop_stalls_total', 'Event loop stalls over the lag threshold.'
+))
+
+
+class LoopLagMonitor:
+    """
+    Class to handle the heartbeat task and the watchdog thread.
+    """
+
+    def __init__(self, interval: float, threshold: float, window: int = 1000, max_stalls: int = 20):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags = deque(maxlen=window)
+        # written by the watchdog thread, read by the admin endpoint
+        self.stalls = deque(maxlen=max_stalls)
+        self._stalls_lock = threading.Lock()
+        self.last_beat = None
+        self._loop_thread_id = None
+        self._task = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+
+        registry.register(Gauge('event_loop_lag_quantile_seconds', 'Event loop lag percentiles (recent heartbeats).',
+                                ('quantile',), callback=self.quantiles))
+
+    def quantiles(self):
+        """
+        Function to get the lag percentiles of the recent heartbeats.
+        """
+        lags = sorted(self.lags)
+        if not lags:
+            return {}
+        return {(str(quantile),): lags[min(int(quantile * len(lags)), len(lags) - 1)] for quantile in LAG_QUANTILES}
+
+    def recent_stalls(self) -> list:
+        """
+        Function to get a snapshot of the recent stalls (the most recent first).
+        """
+        with self._stalls_lock:
+            return list(reversed(self.stalls))
+
+    def start(self):
+        """
+        Function to start the monitor (must be called from the event loop).
+        """
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self.last_beat = time.perf_counter()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        """
+        Function to stop the monitor.
+        """
+        if self._task is None:
+            return
+        self._stopped.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._watchdog.join(timeout=self.interval * 2)
+        self._watchdog = None
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            lag = max(now - expected, 0.0)
+            self.last_beat = now
+            self.lags.append(lag)
+            loop_lag.observe(lag)
+
+    def _watch(self):
+        stalled_since = None
+        while not self._stopped.wait(self.interval):
+            last_beat = self.last_beat
+            blocked_for = time.perf_counter() - last_beat - self.interval
+            if blocked_for < self.threshold:
+                stalled_since = None
+                continue
+            if stalled_since == last_beat:
+                # this stall was already captured
+                continue
+            stalled_since = last_beat
+            self._capture_stall(blocked_for)
+
+    def _capture_stall(self, blocked_for: float):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+        loop_stalls.inc()
+        with self._stalls_lock:
+            self.stalls.append({"detected_at": time.time(), "blocked_for": blocked_for, "stack": stack})
+        logging.warning("Event loop blocked for %.0f ms, blocking stack:\n%s", blocked_for * 1000, stack)
+
+
+loop_monitor = LoopLagMonitor(interval=LOOP_LAG_INTERVAL_MS / 1000, threshold=LOOP_LAG_THRESHOLD_MS / 1000)
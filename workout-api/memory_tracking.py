@@ -0,0 +1,151 @@
+"""
+memory_tracking.py
+Module with the memory diagnostics: tracemalloc snapshots (top allocation sites and diffs between snapshots)
+and the identity-map sizes of the live ORM sessions.
+tracemalloc is only running between start_tracing and stop_tracing, so the overhead is limited to that window.
+"""
+import itertools
+import time
+import tracemalloc
+import weakref
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+MAX_SNAPSHOTS = 5
+SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+# sessions that began a transaction and are still alive
+live_sessions = weakref.WeakSet()
+
+
+@event.listens_for(Session, "after_begin")
+def register_session(session, _transaction, _connection):
+    live_sessions.add(session)
+
+
+def session_stats():
+    """
+    Function to get the identity-map size (and pending changes) of every live session.
+    The "owner" key of session.info labels long-lived sessions, e.g. the tracking websockets.
+    It reads the session state, so it must be called from the event loop running the sessions.
+    """
+    sessions = [
+        {
+            "session": hex(id(session)),
+            "owner": session.info.get("owner"),
+            "identity_map": len(session.identity_map),
+            "new": len(session.new),
+            "dirty": len(session.dirty),
+            "in_transaction": session.in_transaction(),
+        }
+        for session in list(live_sessions)
+    ]
+    return sorted(sessions, key=lambda stats: stats["identity_map"], reverse=True)
+
+
+def format_statistic(statistic):
+    """
+    Function to format a tracemalloc statistic (or statistic diff).
+    """
+    frame = statistic.traceback[0]
+    formatted = {
+        "file": frame.filename,
+        "line": frame.lineno,
+        "size": statistic.size,
+        "count": statistic.count,
+    }
+    if hasattr(statistic, "size_diff"):
+        formatted["size_diff"] = statistic.size_diff
+        formatted["count_diff"] = statistic.count_diff
+    return formatted
+
+
+class MemoryTracker:
+    """
+    Class to handle tracemalloc and the stored snapshots.
+    """
+
+    def __init__(self, max_snapshots: int = MAX_SNAPSHOTS):
+        self.max_snapshots = max_snapshots
+        self.snapshots = OrderedDict()
+        self._ids = itertools.count(1)
+
+    @staticmethod
+    def status():
+        """
+        Function to get the tracing status and the traced memory.
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        return {"tracing": tracemalloc.is_tracing(), "traced_memory": current, "traced_memory_peak": peak}
+
+    def start_tracing(self, frames: int = 1):
+        """
+        Function to start tracing the allocations (frames is the traceback depth kept per allocation).
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        return self.status()
+
+    def stop_tracing(self):
+        """
+        Function to stop tracing. The traces (and the stored snapshots) are released.
+        """
+        tracemalloc.stop()
+        self.snapshots.clear()
+        return self.status()
+
+    def take_snapshot(self, limit: int = 20):
+        """
+        Function to take and store a snapshot.
+
+        Returns:
+            The snapshot id with its top allocation sites, or None if tracemalloc is not tracing.
+        """
+        if not tracemalloc.is_tracing():
+            return None
+
+        snapshot = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+        snapshot_id = next(self._ids)
+        self.snapshots[snapshot_id] = (time.time(), snapshot)
+        while len(self.snapshots) > self.max_snapshots:
+            self.snapshots.popitem(last=False)
+
+        return {
+            "id": snapshot_id,
+            "top": [format_statistic(statistic) for statistic in snapshot.statistics("lineno")[:limit]],
+        }
+
+    def diff(self, snapshot_id: int, base_id: int = None, limit: int = 20):
+        """
+        Function to compare a snapshot with a previous one (by default the snapshot taken just before it).
+
+        Returns:
+            The top allocation differences, or None if a snapshot is not stored.
+        """
+        if base_id is None:
+            previous_ids = [stored_id for stored_id in self.snapshots if stored_id < snapshot_id]
+            base_id = previous_ids[-1] if previous_ids else None
+
+        if snapshot_id not in self.snapshots or base_id not in self.snapshots:
+            return None
+
+        base_taken_at, base_snapshot = self.snapshots[base_id]
+        taken_at, snapshot = self.snapshots[snapshot_id]
+        statistics = snapshot.compare_to(base_snapshot, "lineno")
+        return {
+            "id": snapshot_id,
+            "base_id": base_id,
+            "elapsed": taken_at - base_taken_at,
+            "size_diff": sum(statistic.size_diff for statistic in statistics),
+            "top": [format_statistic(statistic) for statistic in statistics[:limit]],
+        }
+
+
+memory_tracker = MemoryTracker()
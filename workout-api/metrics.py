@@ -0,0 +1,268 @@
+"""
+metrics.py
+Module with the Prometheus-style metrics of the API (text exposition format, served on /metrics).
+The metrics are plain counters updated from the event loop thread, so they need no locks:
+an update is a dict lookup and an integer/float addition.
+"""
+import time
+from bisect import bisect_left
+
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+POOL_WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+
+def format_labels(label_names: tuple, label_values: tuple, extra: str = '') -> str:
+    """
+    Function to render the labels of a sample.
+    """
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonic counter family.
+    """
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        """
+        Function to increment the counter of the given labels.
+        """
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        for label_values, value in self.values.items():
+            yield self.name, format_labels(self.label_names, label_values), value
+
+
+class Gauge(Counter):
+    """
+    Gauge family. The value is either updated with inc/dec/set or read from a callback on every scrape
+    (the callback returns the value, or a dict of label values -> value for a labeled family).
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = (), callback=None):
+        super().__init__(name, documentation, label_names)
+        self.callback = callback
+
+    def dec(self, *label_values, amount=1):
+        """
+        Function to decrement the gauge of the given labels.
+        """
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, value, *label_values):
+        """
+        Function to set the gauge of the given labels.
+        """
+        self.values[label_values] = value
+
+    def samples(self):
+        if self.callback is not None:
+            value = self.callback()
+            if not isinstance(value, dict):
+                yield self.name, '', value
+                return
+            for label_values, label_value in value.items():
+                yield self.name, format_labels(self.label_names, label_values), label_value
+            return
+        yield from super().samples()
+
+
+class Histogram:
+    """
+    Histogram family with fixed buckets.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        # labels -> [per bucket counts (+Inf last), sum]
+        self.values = {}
+
+    def observe(self, value: float, *label_values):
+        """
+        Function to record an observation.
+        """
+        entry = self.values.get(label_values)
+        if entry is None:
+            entry = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def samples(self):
+        for label_values, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = format_labels(self.label_names, label_values, f'le="{format_value(float(bound))}"')
+                yield f'{self.name}_bucket', labels, cumulative
+            labels = format_labels(self.label_names, label_values)
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, cumulative
+
+
+class MetricsRegistry:
+    """
+    Class to hold the metric families and render them in the text exposition format.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        """
+        Function to register a metric family (a family with the same name is replaced).
+        """
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """
+        Function to render every metric family.
+        """
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+http_request_duration = registry.register(Histogram(
+    'http_request_duration_seconds', 'HTTP request latency by route.', ('method', 'route')
+))
+http_responses = registry.register(Counter(
+    'http_responses_total', 'HTTP responses by route and status code.', ('method', 'route', 'status')
+))
+http_requests_in_flight = registry.register(Gauge(
+    'http_requests_in_flight', 'HTTP requests currently being served.'
+))
+repository_errors = registry.register(Counter(
+    'repository_errors_total', 'Repository calls that ended with a 500 error (handle_errors).', ('function',)
+))
+db_pool_checkouts = registry.register(Counter(
+    'db_pool_checkouts_total', 'Connections checked out from the database pool.'
+))
+db_pool_checkout_wait = registry.register(Histogram(
+    'db_pool_checkout_wait_seconds', 'Time spent waiting for a pool connection.', buckets=POOL_WAIT_BUCKETS
+))
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Async queue pool that records the time spent waiting for a connection.
+    """
+
+    def _do_get(self):
+        start_time = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            db_pool_checkout_wait.observe(time.perf_counter() - start_time)
+
+
+def register_pool_metrics(engine):
+    """
+    Function to export the pool statistics (size, checked out, overflow, checkouts) of an engine.
+    """
+    pool = engine.sync_engine.pool
+    event.listen(pool, 'checkout', lambda *_args: db_pool_checkouts.inc())
+
+    if not hasattr(pool, 'checkedout'):
+        # pools without a queue (e.g. static pools) have no size to report
+        return
+    registry.register(Gauge('db_pool_size', 'Configured size of the database pool.', callback=pool.size))
+    registry.register(Gauge('db_pool_checked_out', 'Database connections currently checked out.',
+                            callback=pool.checkedout))
+    # the pool counts the overflow from -size (no connection opened yet)
+    registry.register(Gauge('db_pool_overflow', 'Database connections opened over the pool size.',
+                            callback=lambda: max(pool.overflow(), 0)))
+
+
+def register_tracking_metrics(ws_handler):
+    """
+    Function to export the active tracking rooms and sockets of a websocket handler.
+    """
+    registry.register(Gauge('tracking_sockets_active', 'Connected tracking websockets.',
+                            callback=lambda: len(ws_handler.active_connections)))
+    registry.register(Gauge('tracking_rooms_active', 'Tracking rooms with at least one connected websocket.',
+                            callback=lambda: len(ws_handler.rooms)))
+
+
+def route_template(scope) -> str:
+    """
+    Function to get the full template of the matched route (e.g. "/api/v1/workout/{workout_id}").
+    Depending on the FastAPI version, an included route keeps the path of its router or the path with the
+    prefixes, so the prefixes are taken from the start of the request path (they have no parameters).
+    """
+    route = scope.get("route")
+    template = getattr(route, "path", None)
+    if template is None:
+        return "unmatched"
+    prefix = scope["path"].rsplit("/", template.count("/"))[0]
+    if template.startswith(prefix):
+        return template
+    return prefix + template
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that records the latency, status code and in-flight count of every HTTP request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        start_time = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_requests_in_flight.dec()
+            # the route template keeps the label cardinality bounded
+            route_path = route_template(scope)
+            http_request_duration.observe(time.perf_counter() - start_time, scope["method"], route_path)
+            http_responses.inc(scope["method"], route_path, str(status_code))
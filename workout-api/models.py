@@ -1,6 +1,7 @@
 import enum
+from typing import Optional
 
-from sqlalchemy import Integer, String, Enum, ForeignKey, Boolean, Float
+from sqlalchemy import Integer, String, Enum, ForeignKey, Boolean, Float, UniqueConstraint, text
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -44,14 +45,17 @@ class Workout(Base):
     __tablename__ = "workout"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("user.id"))
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("user.id", ondelete="CASCADE"), index=True)
     workout_type: Mapped[ExerciseType] = mapped_column(Enum(ExerciseType), insert_default=ExerciseType.CARDIO)
     duration: Mapped[int] = mapped_column(Integer)
     calories: Mapped[int] = mapped_column(Integer)
     created_at: Mapped[int] = mapped_column(Integer)
     is_schedule: Mapped[bool] = mapped_column(Boolean, insert_default=False)
     schedule_date: Mapped[int] = mapped_column(Integer)
-    exercises: Mapped[list["Exercise"]] = relationship(back_populates="workout", lazy="selectin")
+    # bumped on every change of the workout or its exercises (used for the ETags)
+    version: Mapped[int] = mapped_column(Integer, server_default=text("1"))
+    # loaded explicitly (joinedload) only by the endpoints that return the exercises
+    exercises: Mapped[list["Exercise"]] = relationship(back_populates="workout", lazy="raise")
 
     def __repr__(self):
         return (f"Workout(id={self.id}, user_id={self.user_id!r}, workout_type={self.workout_type!r},  \
@@ -72,7 +76,7 @@ class Exercise(Base):
     calories: Mapped[int] = mapped_column(Integer)
     created_at: Mapped[int] = mapped_column(Integer)
 
-    workout_id: Mapped[int] = mapped_column(Integer, ForeignKey("workout.id"))
+    workout_id: Mapped[int] = mapped_column(Integer, ForeignKey("workout.id", ondelete="CASCADE"), index=True)
     workout: Mapped["Workout"] = relationship(back_populates="exercises")
 
     def __repr__(self):
@@ -88,14 +92,14 @@ class TrackingData(Base):
     __tablename__ = "tracking_data"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    description: Mapped[str] = mapped_column(String)
-    exercise_id: Mapped[int] = mapped_column(Integer, ForeignKey("exercise.id"))
+    description: Mapped[Optional[str]] = mapped_column(String)
+    exercise_id: Mapped[int] = mapped_column(Integer, ForeignKey("exercise.id", ondelete="CASCADE"), index=True)
     duration: Mapped[int] = mapped_column(Integer, nullable=False)
     is_new_set: Mapped[bool] = mapped_column(Boolean, insert_default=True)
-    is_new_record: Mapped[bool] = mapped_column(Boolean, insert_default=False)
-    distance_covered: Mapped[int] = mapped_column(Integer)  # if applicable
+    is_new_record: Mapped[Optional[bool]] = mapped_column(Boolean, insert_default=False)
+    distance_covered: Mapped[Optional[int]] = mapped_column(Integer)  # if applicable
     created_at: Mapped[int] = mapped_column(Integer)
-    last_updated_at: Mapped[int] = mapped_column(Integer)
+    last_updated_at: Mapped[Optional[int]] = mapped_column(Integer)
 
     route: Mapped[list["MapPoint"]] = relationship(back_populates="tracking_data")  # if applicable
 
@@ -110,14 +114,19 @@ class MapPoint(Base):
     MapPoint model
     """
     __tablename__ = "map_point"
+    # a point resent after a reconnection is only stored once (the index of the constraint also serves
+    # the lookups of the points of a tracking data)
+    __table_args__ = (UniqueConstraint("tracking_data_id", "seq", name="uq_map_point_tracking_data_id_seq"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     lat: Mapped[float] = mapped_column(Float)
     lon: Mapped[float] = mapped_column(Float)
     created_at: Mapped[int] = mapped_column(Integer)
-    last_updated_at: Mapped[int] = mapped_column(Integer)
+    last_updated_at: Mapped[Optional[int]] = mapped_column(Integer)
+    # sequence number of the point in its tracking session (sent by the client, null for imported points)
+    seq: Mapped[Optional[int]] = mapped_column(Integer)
 
-    tracking_data_id: Mapped[int] = mapped_column(Integer, ForeignKey("tracking_data.id"))
+    tracking_data_id: Mapped[int] = mapped_column(Integer, ForeignKey("tracking_data.id", ondelete="CASCADE"))
     tracking_data: Mapped["TrackingData"] = relationship(back_populates="route")
 
     def __repr__(self):
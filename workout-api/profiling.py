@@ -0,0 +1,232 @@
+"""
+profiling.py
+Module with the on-demand sampling profiler. A request (or a WebSocket session) is profiled when it sends the
+"X-Profile" header with a valid "X-Admin-Token", or randomly with the PROFILE_SAMPLE_RATE setting.
+While a profile is active a helper thread samples the stack of the event loop thread, and every sample is
+attributed to the profiled request whose middleware frame is on the stack (or counted as awaiting).
+The stored profiles can be downloaded as collapsed stacks or speedscope JSON from the admin routes.
+"""
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+
+from repository.auth import is_admin_token
+from settings import PROFILE_SAMPLE_RATE, PROFILE_INTERVAL_MS, PROFILE_MAX_STORED
+
+AWAITING_FRAME = "(awaiting)"
+
+
+def frame_label(code) -> str:
+    """
+    Function to get the label of a code object (function name, file and line).
+    """
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+class Profile:
+    """
+    Class with the samples of a profiled request or WebSocket session.
+    """
+
+    def __init__(self, kind: str, path: str, thread_id: int, frame_id: int, interval: float):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.path = path
+        self.thread_id = thread_id
+        self.frame_id = frame_id
+        self.interval = interval
+        self.started_at = time.time()
+        self.duration = None
+        # stack (root to leaf labels) -> number of samples
+        self.samples = Counter()
+
+    def summary(self):
+        """
+        Function to get the profile info without the samples.
+        """
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "path": self.path,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "samples": sum(self.samples.values()),
+        }
+
+    def collapsed(self) -> str:
+        """
+        Function to get the samples as collapsed stacks ("root;child;leaf count" lines, the flamegraph format).
+        """
+        return ''.join(f"{';'.join(stack)} {count}\n" for stack, count in self.samples.most_common())
+
+    def speedscope(self):
+        """
+        Function to get the samples as a speedscope (https://www.speedscope.app) sampled profile.
+        """
+        frames = []
+        frame_indexes = {}
+        samples = []
+        weights = []
+        for stack, count in self.samples.items():
+            sample = []
+            for label in stack:
+                if label not in frame_indexes:
+                    frame_indexes[label] = len(frames)
+                    frames.append({"name": label})
+                sample.append(frame_indexes[label])
+            samples.append(sample)
+            weights.append(count * self.interval)
+
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": f"{self.kind} {self.path}",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }],
+            "name": f"{self.kind} {self.path}",
+            "exporter": "workout-api",
+        }
+
+
+class SamplingProfiler:
+    """
+    Class to handle the sampler thread and the stored profiles.
+    The thread only runs while there is an active profile.
+    """
+
+    def __init__(self, interval: float, max_profiles: int):
+        self.interval = interval
+        self.max_profiles = max_profiles
+        # middleware frame id -> active profile
+        self.active = {}
+        self.profiles = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, kind: str, path: str, frame) -> Profile:
+        """
+        Function to start profiling the code running under the given (middleware) frame.
+        """
+        profile = Profile(kind, path, threading.get_ident(), id(frame), self.interval)
+        with self._lock:
+            self.active[profile.frame_id] = profile
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+                self._thread.start()
+        return profile
+
+    def stop(self, profile: Profile):
+        """
+        Function to stop a profile and store it.
+        """
+        with self._lock:
+            self.active.pop(profile.frame_id, None)
+        profile.duration = time.time() - profile.started_at
+        self.profiles[profile.id] = profile
+        while len(self.profiles) > self.max_profiles:
+            self.profiles.popitem(last=False)
+
+    def get(self, profile_id: str):
+        """
+        Function to get a stored profile.
+        """
+        return self.profiles.get(profile_id)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self.active:
+                    self._thread = None
+                    return
+                active = dict(self.active)
+            self._sample(active)
+            time.sleep(self.interval)
+
+    @staticmethod
+    def _sample(active: dict):
+        frames = sys._current_frames()
+        sampled = set()
+        for thread_id in {profile.thread_id for profile in active.values()}:
+            stack = []
+            frame = frames.get(thread_id)
+            while frame is not None:
+                profile = active.get(id(frame))
+                if profile is not None:
+                    # innermost profiled request running on the thread
+                    profile.samples[tuple(reversed(stack))] += 1
+                    sampled.add(profile.id)
+                    break
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+
+        for profile in active.values():
+            if profile.id not in sampled:
+                # the request is suspended (database, network, sleep...)
+                profile.samples[(AWAITING_FRAME,)] += 1
+
+
+def should_profile(scope) -> tuple[bool, bool]:
+    """
+    Function to check if a request has to be profiled.
+    Returns: If the request is profiled, and if the id of the profile can be returned to the client
+    (only with a valid admin token).
+    """
+    profile_requested = False
+    admin_token = None
+    for name, value in scope["headers"]:
+        if name == b"x-profile":
+            profile_requested = True
+        elif name == b"x-admin-token":
+            admin_token = value.decode("latin-1")
+    is_admin = is_admin_token(admin_token)
+
+    if profile_requested and is_admin:
+        return True, True
+    return bool(PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE), is_admin
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that profiles the selected HTTP requests and WebSocket sessions.
+    The id of the profile is returned in the X-Profile-Id header to the admin clients.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        profiled, is_admin = should_profile(scope)
+        if not profiled:
+            await self.app(scope, receive, send)
+            return
+
+        profile = profiler.start(scope["type"], scope["path"], sys._getframe())
+
+        async def send_with_profile_id(message):
+            if message["type"] in ("http.response.start", "websocket.accept"):
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-id", profile.id.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            # the sampled requests of the other clients are profiled without exposing the id
+            await self.app(scope, receive, send_with_profile_id if is_admin else send)
+        finally:
+            profiler.stop(profile)
+
+
+profiler = SamplingProfiler(interval=PROFILE_INTERVAL_MS / 1000, max_profiles=PROFILE_MAX_STORED)
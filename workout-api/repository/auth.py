@@ -2,15 +2,16 @@
 auth.py
 Handles token creation and verification.
 """
+import hmac
 from datetime import datetime, timedelta, timezone
 
 import jwt
-from fastapi import Depends, HTTPException
+from fastapi import Depends, HTTPException, Header
 from fastapi.security import OAuth2PasswordBearer
 from jwt import PyJWTError
 
 from schemas import AccessTokenData
-from settings import SECRET_KEY
+from settings import SECRET_KEY, ADMIN_TOKEN
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='/api/v1/login')
 ALGORITHM = "HS256"
@@ -58,3 +59,20 @@ def get_current_user(access_token: str = Depends(oauth2_scheme)):
 
     user_id = verify_access_token(access_token, credentials_exception=credentials_exception)
     return user_id
+
+
+def is_admin_token(token: str | None):
+    """
+    Function to check an admin token (admin access is disabled when no ADMIN_TOKEN is configured).
+    """
+    if not ADMIN_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+def verify_admin(x_admin_token: str | None = Header(None)):
+    """
+    Function to protect the admin endpoints with the X-Admin-Token header.
+    """
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail='Admin access required.')
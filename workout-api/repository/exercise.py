@@ -8,8 +8,11 @@ from fastapi import HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import joinedload
 
+from cache import response_cache, workout_scope, exercises_scope, tracking_scope
+from ingest import map_point_row, write_rows
 from models import Exercise, Workout, TrackingData, MapPoint
-from repository.utils import handle_errors, get_current_time
+from repository.fieldsets import select_columns, EXERCISE_FIELDS, TRACKING_DATA_FIELDS
+from repository.utils import handle_errors, get_current_time, commit, after_commit, tracking_ws_handler
 
 ERROR_401 = 'You are not authorized to perform this action.'
 
@@ -19,14 +22,14 @@ async def verify_if_user_is_valid(user_id: int, workout_id: int, db: AsyncSessio
     Function to verify the user_id of the exercise. Also, it verifies if the workout exists.
     """
 
-    workout_query = sa.select(Workout).where(Workout.id == workout_id)
+    workout_query = sa.select(Workout.user_id).where(Workout.id == workout_id)
     workout_result = await db.execute(workout_query)
-    retrieved_workout = workout_result.scalar()
+    workout_user_id = workout_result.scalar()
 
-    if not retrieved_workout:
+    if workout_user_id is None:
         raise HTTPException(status_code=404, detail='Workout related to this exercise/tracking not found.')
 
-    if retrieved_workout.user_id != user_id:
+    if workout_user_id != user_id:
         raise HTTPException(status_code=401, detail=ERROR_401)
 
 
@@ -37,12 +40,20 @@ async def verify_if_exercise_exists(exercise_id: int, db: AsyncSession):
     Returns:
         The exercise workout_id.
     """
-    query = sa.select(Exercise).where(Exercise.id == exercise_id)
+    query = sa.select(Exercise.workout_id).where(Exercise.id == exercise_id)
     result = await db.execute(query)
-    exercise = result.scalar()
-    if not exercise:
+    workout_id = result.scalar()
+    if workout_id is None:
         raise HTTPException(status_code=404, detail='Exercise not found.')
-    return exercise.workout_id
+    return workout_id
+
+
+async def bump_workout_version(workout_id: int, db: AsyncSession):
+    """
+    Function to bump the version of a workout when its exercises change.
+    """
+    query = sa.update(Workout).where(Workout.id == workout_id).values(version=Workout.version + 1)
+    await db.execute(query)
 
 
 @handle_errors
@@ -67,7 +78,10 @@ async def create_new_exercise(exercise_data: dict, user_id: int, db: AsyncSessio
     query = sa.select(Exercise.id).order_by(Exercise.id.desc()).limit(1)
     result = await db.execute(query)
     exercise_id = result.scalar()
-    await db.commit()
+    await bump_workout_version(workout_id, db)
+    await commit(db)
+
+    await after_commit(db, response_cache.invalidate, workout_scope(workout_id), exercises_scope(workout_id))
 
     return {'status': 'success',
             'message': f'Exercise {exercise_id} added successfully.'}
@@ -92,25 +106,36 @@ async def update_exercise(exercise_id: int, exercise_data: dict, user_id: int, d
 
     update_query = sa.update(Exercise).where(Exercise.id == exercise_id).values(**exercise_data)
     await db.execute(update_query)
-    await db.commit()
+    await bump_workout_version(exercise.workout_id, db)
+    new_workout_id = exercise_data.get('workout_id', exercise.workout_id)
+    if new_workout_id != exercise.workout_id:
+        await bump_workout_version(new_workout_id, db)
+    await commit(db)
+
+    await after_commit(db, response_cache.invalidate,
+                       workout_scope(exercise.workout_id), exercises_scope(exercise.workout_id),
+                       workout_scope(new_workout_id), exercises_scope(new_workout_id), tracking_scope(exercise_id))
 
     return {'status': 'success',
             'message': f'Exercise {exercise_id} updated successfully.'}
 
 
 @handle_errors
-async def get_exercises(db: AsyncSession, user_id: int, workout_id: int):
+async def get_exercises(db: AsyncSession, user_id: int, workout_id: int, fields: dict = None):
     """
     Function to get all exercises from the "exercise" table.
+    Only the requested fields (see repository.fieldsets) are selected.
 
     Returns:
         All exercises.
     """
+    columns, _ = select_columns(fields, EXERCISE_FIELDS)
+
     await verify_if_user_is_valid(user_id, workout_id, db)
 
-    query = sa.select(Exercise).where(Exercise.workout_id == workout_id)
+    query = sa.select(*columns).where(Exercise.workout_id == workout_id)
     result = await db.execute(query)
-    exercises = result.scalars().all()
+    exercises = [dict(exercise) for exercise in result.mappings()]
 
     return {
         'status': 'success',
@@ -119,26 +144,36 @@ async def get_exercises(db: AsyncSession, user_id: int, workout_id: int):
 
 
 @handle_errors
-async def get_exercise(db: AsyncSession, user_id: int, exercise_id: int):
+async def get_exercise(db: AsyncSession, user_id: int, exercise_id: int, fields: dict = None):
     """
     Function to get an exercise from the "exercise" table.
+    Only the requested fields (see repository.fieldsets) are selected,
+    the owner of the workout is checked in the same query.
 
     Returns:
         The exercise info.
     """
+    columns, _ = select_columns(fields, EXERCISE_FIELDS)
 
-    query = sa.select(Exercise).where(Exercise.id == exercise_id)
+    query = (
+        sa.select(Workout.user_id.label("_owner_id"), *columns)
+        .select_from(Exercise)
+        .join(Workout, Workout.id == Exercise.workout_id)
+        .where(Exercise.id == exercise_id)
+    )
     result = await db.execute(query)
-    exercise = result.scalar()
+    exercise = result.mappings().first()
 
     if not exercise:
         raise HTTPException(status_code=404, detail='Exercise not found.')
 
-    await verify_if_user_is_valid(user_id, exercise.workout_id, db)
+    mapped_exercise = dict(exercise)
+    if mapped_exercise.pop("_owner_id") != user_id:
+        raise HTTPException(status_code=401, detail=ERROR_401)
 
     return {
         'status': 'success',
-        'data': exercise
+        'data': mapped_exercise
     }
 
 
@@ -160,7 +195,12 @@ async def delete_exercise(db: AsyncSession, user_id: int, exercise_id: int):
     await verify_if_user_is_valid(user_id, exercise_to_delete.workout_id, db)
 
     await db.delete(exercise_to_delete)
-    await db.commit()
+    await bump_workout_version(exercise_to_delete.workout_id, db)
+    await commit(db)
+
+    await after_commit(db, response_cache.invalidate, workout_scope(exercise_to_delete.workout_id),
+                       exercises_scope(exercise_to_delete.workout_id), tracking_scope(exercise_id))
+    await after_commit(db, tracking_ws_handler.close_rooms, exercise_id)
 
     return {'status': 'success',
             'message': f'Exercise with {exercise_id} deleted successfully.'}
@@ -189,42 +229,47 @@ async def create_exercise_tracking_data_room(db: AsyncSession, user_id: int, exe
     query = sa.select(TrackingData.id).order_by(TrackingData.id.desc()).limit(1)
     result = await db.execute(query)
     tracking_data_id = result.scalar()
-    await db.commit()
+    await commit(db)
+
+    await after_commit(db, response_cache.invalidate, tracking_scope(exercise_id))
 
     return {'status': 'success',
             'message': f'Tracking data {tracking_data_id} added successfully.'}
 
 
 @handle_errors
-async def get_exercise_tracking_data_list(db: AsyncSession, user_id: int, exercise_id: int):
+async def get_exercise_tracking_data_list(db: AsyncSession, user_id: int, exercise_id: int, fields: dict = None):
     """
     Function to get all exercise tracking data from the "tracking_data" table.
+    Only the requested fields (see repository.fieldsets) are selected.
 
     Returns:
         The list of tracking_data.
     """
-    query = sa.select(TrackingData).where(TrackingData.exercise_id == exercise_id)
+    columns, _ = select_columns(fields, TRACKING_DATA_FIELDS)
+    query = sa.select(*columns).where(TrackingData.exercise_id == exercise_id)
     result = await db.execute(query)
-    tracking_data = result.scalars().all()
+    tracking_data = result.mappings().all()
 
     if not tracking_data:
         raise HTTPException(status_code=404, detail='Tracking data not found.')
 
-    workout_id = await verify_if_exercise_exists(exercise_id, db)
+    # exercise and workout ownership in a single query
+    owner_query = (
+        sa.select(Workout.user_id)
+        .join(Exercise, Exercise.workout_id == Workout.id)
+        .where(Exercise.id == exercise_id)
+    )
+    result = await db.execute(owner_query)
+    workout_user_id = result.scalar()
 
-    await verify_if_user_is_valid(user_id, workout_id, db)
+    if workout_user_id is None:
+        raise HTTPException(status_code=404, detail='Exercise not found.')
 
-    mapped_data = [
-        {
-            "id": track.id,
-            "description": track.description,
-            "exercise_id": track.exercise_id,
-            "duration": track.duration,
-            "distance_covered": track.distance_covered,
-            "created_at": track.created_at
-        }
-        for track in tracking_data
-    ]
+    if workout_user_id != user_id:
+        raise HTTPException(status_code=401, detail=ERROR_401)
+
+    mapped_data = [dict(track) for track in tracking_data]
 
     return {
         'status': 'success',
@@ -301,29 +346,52 @@ async def get_exercise_tracking_data_updates(db: AsyncSession, tracking_data_id:
 
 
 @handle_errors
-async def create_map_point(db: AsyncSession, tracking_data_id: int, map_point: dict):
+async def get_exercise_tracking_route(db: AsyncSession, user_id: int, tracking_data_id: int):
     """
-    Function to create a new map point in the "map_point" table.
-    This function is meant to be used for the tracking data (location) updates.
+    Function to get the route coordinates of an exercise tracking data from the "map_point" table.
 
     Returns:
-        Success message with the new map point id and map point id as data.
+        The latitudes and longitudes of the route (in insertion order).
     """
-    map_point.update({"tracking_data_id": tracking_data_id})
-    map_point.update({"created_at": get_current_time()})
-    map_point.update({"last_updated_at": get_current_time()})
+    query = sa.select(TrackingData.exercise_id).where(TrackingData.id == tracking_data_id)
+    result = await db.execute(query)
+    exercise_id = result.scalar()
 
-    new_map_point = MapPoint(**map_point)
+    if not exercise_id:
+        raise HTTPException(status_code=404, detail='Tracking data not found.')
 
-    db.add(new_map_point)
-    query = sa.select(MapPoint.id).order_by(MapPoint.id.desc()).limit(1)
-    result = await db.execute(query)
-    map_point_id = result.scalar()
-    await db.commit()
+    workout_id = await verify_if_exercise_exists(exercise_id, db)
 
-    return {'status': 'success',
-            'message': f'Map point {map_point_id} added successfully.',
-            'data': map_point_id}
+    await verify_if_user_is_valid(user_id, workout_id, db)
+
+    route_query = (
+        sa.select(MapPoint.lat, MapPoint.lon)
+        .where(MapPoint.tracking_data_id == tracking_data_id)
+        .order_by(MapPoint.id)
+    )
+    result = await db.execute(route_query)
+    rows = result.all()
+
+    lats = [row.lat for row in rows]
+    lons = [row.lon for row in rows]
+
+    return lats, lons
+
+
+@handle_errors
+async def create_tracking_map_point(db: AsyncSession, tracking_data_id: int, map_point: dict):
+    """
+    Function to store a tracking point without the ingest buffer, in the transaction of the session
+    (a point sent with a tracking data update is committed with the update).
+
+    Returns:
+        The id of the new map point, or None if the point (same tracking data and sequence number) is stored.
+    """
+    connection = await db.connection()
+    map_point_ids = await write_rows(connection, [map_point_row(tracking_data_id, map_point)])
+    await commit(db)
+
+    return map_point_ids[0]
 
 
 @handle_errors
@@ -344,7 +412,10 @@ async def update_exercise_tracking_data(db: AsyncSession, tracking_data_id: int,
 
     update_query = sa.update(TrackingData).where(TrackingData.id == tracking_data_id).values(**tracking_data)
     await db.execute(update_query)
-    await db.commit()
+    await commit(db)
+
+    await after_commit(db, response_cache.invalidate, tracking_scope(existing_tracking_data.exercise_id),
+                       tracking_scope(tracking_data.get('exercise_id', existing_tracking_data.exercise_id)))
 
     return {'status': True,
             'message': f'Tracking data {tracking_data_id} updated successfully.'}
@@ -0,0 +1,157 @@
+"""
+fieldsets.py
+Module to handle the sparse fieldsets ("fields" query parameter) of the read endpoints,
+e.g. "id,calories,exercises(name,calories)". The selected fields are turned into the columns of the SQL query.
+"""
+import hashlib
+
+from fastapi import HTTPException
+
+from models import Workout, Exercise, TrackingData
+
+WORKOUT_FIELDS = {
+    "id": Workout.id,
+    "user_id": Workout.user_id,
+    "workout_type": Workout.workout_type,
+    "duration": Workout.duration,
+    "calories": Workout.calories,
+    "created_at": Workout.created_at,
+    "is_schedule": Workout.is_schedule,
+    "schedule_date": Workout.schedule_date,
+}
+
+# exercises as returned inside a workout
+WORKOUT_EXERCISE_FIELDS = {
+    "id": Exercise.id,
+    "name": Exercise.name,
+    "exercise_type": Exercise.exercise_type,
+    "duration": Exercise.duration,
+    "calories": Exercise.calories,
+    "created_at": Exercise.created_at,
+}
+
+EXERCISE_FIELDS = {
+    **WORKOUT_EXERCISE_FIELDS,
+    "workout_id": Exercise.workout_id,
+}
+
+TRACKING_DATA_FIELDS = {
+    "id": TrackingData.id,
+    "description": TrackingData.description,
+    "exercise_id": TrackingData.exercise_id,
+    "duration": TrackingData.duration,
+    "distance_covered": TrackingData.distance_covered,
+    "created_at": TrackingData.created_at,
+}
+
+
+def invalid_fields(detail: str):
+    """
+    Function to build the error of an invalid fields parameter.
+    """
+    return HTTPException(status_code=400, detail=f'Invalid fields parameter: {detail}')
+
+
+def parse_fields(fields: str | None) -> dict | None:
+    """
+    Function to parse a fields parameter.
+
+    Returns:
+        None if no fields were requested, otherwise a dict with the requested field names
+        (the value is None for a plain field and a nested dict for a field with its own selection).
+    """
+    if fields is None or not fields.strip():
+        return None
+
+    stack = [{}]
+    name = ''
+    last_nested = None
+
+    def add_field():
+        nonlocal name, last_nested
+        field_name = name.strip()
+        name = ''
+        if last_nested is not None:
+            if field_name:
+                raise invalid_fields(f'unexpected "{field_name}".')
+            last_nested = None
+            return
+        if not field_name:
+            raise invalid_fields('empty field name.')
+        if field_name in stack[-1]:
+            raise invalid_fields(f'duplicated field "{field_name}".')
+        stack[-1][field_name] = None
+
+    for char in fields:
+        if char == ',':
+            add_field()
+        elif char == '(':
+            field_name = name.strip()
+            if not field_name or last_nested is not None:
+                raise invalid_fields('nested selection without a field name.')
+            if field_name in stack[-1]:
+                raise invalid_fields(f'duplicated field "{field_name}".')
+            nested = {}
+            stack[-1][field_name] = nested
+            stack.append(nested)
+            name = ''
+        elif char == ')':
+            if len(stack) == 1:
+                raise invalid_fields('unbalanced parentheses.')
+            add_field()
+            last_nested = stack.pop()
+        else:
+            name += char
+
+    if len(stack) != 1:
+        raise invalid_fields('unbalanced parentheses.')
+    add_field()
+    return stack[0]
+
+
+def select_columns(selection: dict | None, columns: dict, nested: dict = None):
+    """
+    Function to get the columns of a selection.
+
+    Args:
+        selection: The parsed selection (None selects every field).
+        columns: The selectable fields with their columns.
+        nested: The selectable nested fields with their own selectable fields.
+
+    Returns:
+        A tuple with the labeled columns to select and the selection of each requested nested field.
+    """
+    nested = nested or {}
+    if selection is None:
+        return (
+            [column.label(name) for name, column in columns.items()],
+            {name: None for name in nested}
+        )
+
+    selected_columns = []
+    selected_nested = {}
+    for name, sub_selection in selection.items():
+        if name in nested:
+            selected_nested[name] = sub_selection
+        elif name in columns and sub_selection is None:
+            selected_columns.append(columns[name].label(name))
+        else:
+            raise invalid_fields(f'unknown field "{name}".')
+    return selected_columns, selected_nested
+
+
+def fields_variant(selection: dict | None) -> str:
+    """
+    Function to get a short key of a selection, used to tell the cached responses and ETags apart.
+    The key does not depend on the order of the fields.
+    """
+    if selection is None:
+        return ''
+
+    def canonical(value: dict) -> str:
+        return ','.join(
+            name if sub_selection is None else f'{name}({canonical(sub_selection)})'
+            for name, sub_selection in sorted(value.items())
+        )
+
+    return hashlib.sha1(canonical(selection).encode()).hexdigest()[:12]
@@ -0,0 +1,401 @@
+"""
+imports.py
+Module to handle the bulk import of workout history from CSV logs and GPX tracks.
+Files are parsed incrementally and inserted in chunks from a background job. The parsing runs in the thread pool
+(one chunk of rows at a time), so a large file does not block the event loop between two inserts.
+"""
+import asyncio
+import csv
+import io
+import itertools
+import logging
+import os
+import uuid
+import xml.etree.ElementTree as ElementTree
+from collections import OrderedDict
+from datetime import datetime
+
+import sqlalchemy as sa
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+from analytics import haversine_distance
+from cache import response_cache, workout_scope, exercises_scope, tracking_scope
+from models import Workout, Exercise, TrackingData, MapPoint, ExerciseType
+from repository.exercise import bump_workout_version
+from repository.utils import get_current_time, commit, after_commit
+from settings import IMPORT_BATCH_SIZE, IMPORT_MAX_JOBS, IMPORT_MAX_RUNNING
+
+IMPORT_FORMATS = ('csv', 'gpx')
+CSV_REQUIRED_COLUMNS = {'workout_ref', 'workout_type', 'duration', 'calories'}
+
+
+class ImportJob:
+    """
+    Class to keep the progress of an import job.
+    """
+
+    def __init__(self, user_id: int, import_format: str):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.format = import_format
+        self.status = 'pending'
+        self.rows_processed = 0
+        self.rows_skipped = 0
+        self.workouts = 0
+        self.exercises = 0
+        self.tracking_data = 0
+        self.map_points = 0
+        self.error = None
+        self.created_at = get_current_time()
+        self.finished_at = None
+        self.task = None
+
+    def as_dict(self):
+        """
+        Function to get the public job info.
+        """
+        return {
+            "id": self.id,
+            "format": self.format,
+            "status": self.status,
+            "rows_processed": self.rows_processed,
+            "rows_skipped": self.rows_skipped,
+            "workouts": self.workouts,
+            "exercises": self.exercises,
+            "tracking_data": self.tracking_data,
+            "map_points": self.map_points,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at
+        }
+
+
+import_jobs: OrderedDict[str, ImportJob] = OrderedDict()
+
+
+def parse_timestamp(value):
+    """
+    Function to parse a unix timestamp or an ISO 8601 date into a unix timestamp.
+    """
+    if value is None or value == '':
+        return None
+    try:
+        return int(float(value))
+    except ValueError:
+        return int(datetime.fromisoformat(value).timestamp())
+
+
+def iter_csv_workouts(file):
+    """
+    Function to read a CSV workout log row by row.
+    Consecutive rows with the same "workout_ref" belong to the same workout,
+    the optional "exercise_*" columns describe one exercise per row.
+
+    Yields:
+        A (workout, exercises, rows) tuple per workout or (None, None, rows) for invalid rows.
+    """
+    reader = csv.DictReader(io.TextIOWrapper(file, encoding='utf-8', newline=''))
+    missing_columns = CSV_REQUIRED_COLUMNS - set(reader.fieldnames or [])
+    if missing_columns:
+        raise ValueError(f'Missing CSV columns: {", ".join(sorted(missing_columns))}.')
+
+    current_ref = None
+    workout = None
+    exercises = []
+    rows = 0
+    for row in reader:
+        if row['workout_ref'] != current_ref:
+            if workout is not None or rows:
+                yield workout, exercises, rows
+            current_ref = row['workout_ref']
+            exercises = []
+            rows = 0
+            try:
+                workout = {
+                    "workout_type": ExerciseType(row['workout_type'].strip().lower()),
+                    "duration": int(row['duration']),
+                    "calories": int(row['calories']),
+                    "created_at": parse_timestamp(row.get('created_at')) or get_current_time(),
+                    "is_schedule": False
+                }
+                workout["schedule_date"] = workout["created_at"]
+            except (ValueError, TypeError):
+                workout = None
+
+        rows += 1
+        if workout is not None and row.get('exercise_name'):
+            try:
+                exercises.append({
+                    "name": row['exercise_name'],
+                    "exercise_type": row.get('exercise_type') or row['workout_type'],
+                    "duration": int(row.get('exercise_duration') or 0),
+                    "calories": int(row.get('exercise_calories') or 0),
+                    "created_at": workout["created_at"]
+                })
+            except ValueError:
+                workout = None
+
+    if workout is not None or rows:
+        yield workout, exercises, rows
+
+
+def iter_gpx_points(file):
+    """
+    Function to read a GPX file incrementally. Parsed points are dropped from the tree
+    as soon as they are yielded, so memory does not grow with the file size.
+
+    Yields:
+        ("point", track, lat, lon, time) per track point and ("track_end", track) per track.
+    """
+    track = None
+    segment = None
+    in_point = False
+    for event, element in ElementTree.iterparse(file, events=('start', 'end')):
+        tag = element.tag.rsplit('}', 1)[-1]
+
+        if event == 'start':
+            if tag == 'trk':
+                track = {"name": None, "type": None}
+            elif tag == 'trkseg':
+                segment = element
+            elif tag == 'trkpt':
+                in_point = True
+            continue
+
+        if tag == 'trkpt':
+            in_point = False
+            time_element = next((child for child in element if child.tag.rsplit('}', 1)[-1] == 'time'), None)
+            point_time = parse_timestamp(time_element.text) if time_element is not None else None
+            yield 'point', track, float(element.get('lat')), float(element.get('lon')), point_time
+            if segment is not None:
+                segment.clear()
+        elif track is not None and not in_point and tag in ('name', 'type'):
+            track[tag] = element.text
+        elif tag == 'trk':
+            yield 'track_end', track
+            track = None
+            element.clear()
+
+
+async def iter_in_threadpool(iterator, chunk_size: int = IMPORT_BATCH_SIZE):
+    """
+    Function to consume a parser in the thread pool, one chunk of items per call.
+
+    Yields:
+        The items of the parser.
+    """
+    iterator = iter(iterator)
+    while True:
+        chunk = await run_in_threadpool(list, itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        for item in chunk:
+            yield item
+
+
+async def import_csv(job: ImportJob, file, session_factory):
+    """
+    Function to import a CSV workout log, inserting workouts and exercises in chunks.
+    """
+    batch = []
+
+    async def flush():
+        async with session_factory() as db:
+            workout_rows = [dict(workout, user_id=job.user_id) for workout, _ in batch]
+            query = sa.insert(Workout).returning(Workout.id, sort_by_parameter_order=True)
+            result = await db.execute(query, workout_rows)
+            workout_ids = result.scalars().all()
+
+            exercise_rows = [
+                dict(exercise, workout_id=workout_id)
+                for workout_id, (_, exercises) in zip(workout_ids, batch)
+                for exercise in exercises
+            ]
+            if exercise_rows:
+                await db.execute(sa.insert(Exercise), exercise_rows)
+            await db.commit()
+
+        job.workouts += len(workout_rows)
+        job.exercises += len(exercise_rows)
+        batch.clear()
+
+    async for workout, exercises, rows in iter_in_threadpool(iter_csv_workouts(file)):
+        job.rows_processed += rows
+        if workout is None:
+            job.rows_skipped += rows
+            continue
+
+        batch.append((workout, exercises))
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await flush()
+
+    if batch:
+        await flush()
+
+
+async def import_gpx(job: ImportJob, file, session_factory):
+    """
+    Function to import a GPX file. Every track becomes a cardio workout with one exercise
+    and one tracking data room, the track points are inserted into "map_point" in chunks.
+    """
+    points = []
+    state = {}
+
+    async def start_track(track, point_time):
+        creation_date = point_time or get_current_time()
+        async with session_factory() as db:
+            query = sa.insert(Workout).values(user_id=job.user_id, workout_type=ExerciseType.CARDIO, duration=0,
+                                              calories=0, created_at=creation_date, is_schedule=False,
+                                              schedule_date=creation_date).returning(Workout.id)
+            workout_id = (await db.execute(query)).scalar()
+
+            query = sa.insert(Exercise).values(workout_id=workout_id, name=track["name"] or 'GPX track',
+                                               exercise_type=track["type"] or 'gpx', duration=0, calories=0,
+                                               created_at=creation_date).returning(Exercise.id)
+            exercise_id = (await db.execute(query)).scalar()
+
+            query = sa.insert(TrackingData).values(exercise_id=exercise_id, description=track["name"] or 'GPX track',
+                                                   duration=0, is_new_set=True, is_new_record=False,
+                                                   distance_covered=0, created_at=creation_date,
+                                                   last_updated_at=creation_date).returning(TrackingData.id)
+            tracking_data_id = (await db.execute(query)).scalar()
+            await db.commit()
+
+        job.workouts += 1
+        job.exercises += 1
+        job.tracking_data += 1
+        state.update({"workout_id": workout_id, "exercise_id": exercise_id, "tracking_data_id": tracking_data_id,
+                      "start_time": point_time, "end_time": point_time, "distance": 0.0, "last_point": None})
+
+    async def flush():
+        async with session_factory() as db:
+            await db.execute(sa.insert(MapPoint), points)
+            await db.commit()
+        job.map_points += len(points)
+        points.clear()
+
+    async def end_track():
+        if points:
+            await flush()
+        duration = 0
+        if state["start_time"] is not None and state["end_time"] is not None:
+            duration = (state["end_time"] - state["start_time"]) // 60
+        async with session_factory() as db:
+            await db.execute(sa.update(Workout).where(Workout.id == state["workout_id"]).values(duration=duration))
+            await db.execute(sa.update(Exercise).where(Exercise.id == state["exercise_id"]).values(duration=duration))
+            await bump_workout_version(state["workout_id"], db)
+            await db.execute(
+                sa.update(TrackingData)
+                .where(TrackingData.id == state["tracking_data_id"])
+                .values(duration=duration, distance_covered=int(state["distance"]))
+            )
+            await commit(db)
+            await after_commit(db, response_cache.invalidate, workout_scope(state["workout_id"]),
+                               exercises_scope(state["workout_id"]), tracking_scope(state["exercise_id"]))
+        state.clear()
+
+    async for event in iter_in_threadpool(iter_gpx_points(file)):
+        if event[0] == 'track_end':
+            if state:
+                await end_track()
+            continue
+
+        _, track, lat, lon, point_time = event
+        job.rows_processed += 1
+        if not state:
+            await start_track(track, point_time)
+
+        if state["last_point"] is not None:
+            state["distance"] += haversine_distance(*state["last_point"], lat, lon)
+        state["last_point"] = (lat, lon)
+        if point_time is not None:
+            state["start_time"] = state["start_time"] or point_time
+            state["end_time"] = point_time
+
+        point_date = point_time or get_current_time()
+        points.append({"tracking_data_id": state["tracking_data_id"], "lat": lat, "lon": lon,
+                       "created_at": point_date, "last_updated_at": point_date})
+        if len(points) >= IMPORT_BATCH_SIZE:
+            await flush()
+
+    if state:
+        await end_track()
+
+
+async def run_import_job(job: ImportJob, path: str, session_factory):
+    """
+    Function to run an import job over a spooled upload. The file is removed once the job ends.
+    """
+    job.status = 'running'
+    try:
+        with open(path, 'rb') as file:
+            if job.format == 'csv':
+                await import_csv(job, file, session_factory)
+            else:
+                await import_gpx(job, file, session_factory)
+        job.status = 'completed'
+    except Exception as error:
+        logging.error("Import job %s failed: %s", job.id, error, exc_info=True)
+        job.status = 'failed'
+        job.error = str(error)
+    finally:
+        job.finished_at = get_current_time()
+        job.task = None
+        os.remove(path)
+
+
+def verify_import_slot():
+    """
+    Function to check that a new import job can start (at most IMPORT_MAX_RUNNING jobs run at the same time).
+
+    Raises:
+        HTTPException 429 if the limit is reached.
+    """
+    running_jobs = sum(1 for job in import_jobs.values() if job.task is not None)
+    if running_jobs >= IMPORT_MAX_RUNNING:
+        raise HTTPException(status_code=429, detail='Too many imports running, please try again later.',
+                            headers={"Retry-After": "30"})
+
+
+def start_import_job(user_id: int, import_format: str, path: str, session_factory):
+    """
+    Function to register a new import job and start it in the background.
+    The spooled file is removed if the job can not start.
+
+    Returns:
+        The import job.
+
+    Raises:
+        HTTPException 429 if too many imports are running.
+    """
+    try:
+        verify_import_slot()
+    except HTTPException:
+        os.remove(path)
+        raise
+
+    # keep only the most recent jobs, running jobs are never dropped
+    for job_id in list(import_jobs):
+        if len(import_jobs) < IMPORT_MAX_JOBS:
+            break
+        if import_jobs[job_id].task is None:
+            del import_jobs[job_id]
+
+    job = ImportJob(user_id=user_id, import_format=import_format)
+    import_jobs[job.id] = job
+    job.task = asyncio.create_task(run_import_job(job, path, session_factory))
+    return job
+
+
+def get_import_job(job_id: str, user_id: int):
+    """
+    Function to get an import job of the user.
+
+    Returns:
+        The import job or None if it does not exist.
+    """
+    job = import_jobs.get(job_id)
+    if job is None or job.user_id != user_id:
+        return None
+    return job
@@ -0,0 +1,143 @@
+"""
+live_tracking.py
+Module with the in-memory state of the live tracking rooms. The state of a room is loaded once when its first
+socket connects, then every point updates it in O(1) (coordinate arrays, last fix and running distance),
+so the spectators and the live endpoint are served without reading the route back from the database.
+The state also keeps the last stored sequence number, sent to a reconnecting client so it only resends the missing
+points.
+"""
+from array import array
+
+import sqlalchemy as sa
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from analytics import haversine_distance, route_distance
+from models import Exercise, Workout, TrackingData, MapPoint
+from repository.utils import handle_errors
+
+# tracking data fields kept in the room state (and updated by the tracking data updates)
+LIVE_TRACKING_FIELDS = ("duration", "is_new_set", "is_new_record", "distance_covered", "last_updated_at")
+
+
+class LiveRoomState:
+    """
+    Class to keep the route and the running stats of a live tracking room.
+    """
+
+    def __init__(self, tracking_data_id: int, user_id: int, tracking_data: dict, exercise_id: int = None):
+        self.tracking_data_id = tracking_data_id
+        self.user_id = user_id
+        # the room is closed when its exercise (or the workout of the exercise) is deleted
+        self.exercise_id = exercise_id
+        self.tracking_data = tracking_data
+        self.map_point_ids = array('q')
+        self.lats = array('d')
+        self.lons = array('d')
+        self.distance = 0.0
+        self.started_at = None
+        self.last_fix_at = None
+        self.last_seq = None
+
+    def add_point(self, map_point_id: int, lat: float, lon: float, created_at: int, seq: int = None):
+        """
+        Function to append a stored point to the route and update the running stats.
+        """
+        if seq is not None and (self.last_seq is None or seq > self.last_seq):
+            self.last_seq = seq
+        if self.lats:
+            self.distance += haversine_distance(self.lats[-1], self.lons[-1], lat, lon)
+        else:
+            self.started_at = created_at
+        self.map_point_ids.append(map_point_id)
+        self.lats.append(lat)
+        self.lons.append(lon)
+        self.last_fix_at = created_at
+
+    def apply_update(self, tracking_data: dict):
+        """
+        Function to apply a persisted tracking data update.
+        """
+        for field in LIVE_TRACKING_FIELDS:
+            if field in tracking_data:
+                self.tracking_data[field] = tracking_data[field]
+        self.exercise_id = tracking_data.get("exercise_id", self.exercise_id)
+
+    def stats(self):
+        """
+        Function to get the running stats (distance in meters, duration in seconds, pace in seconds per km).
+        """
+        duration = self.last_fix_at - self.started_at if self.lats else 0
+        return {
+            "points": len(self.lats),
+            "distance": self.distance,
+            "duration": duration,
+            "pace": duration / (self.distance / 1000) if self.distance else None,
+            "last_fix": {"latitude": self.lats[-1], "longitude": self.lons[-1],
+                         "created_at": self.last_fix_at} if self.lats else None,
+        }
+
+    def as_dict(self):
+        """
+        Function to get the tracking data with its route (same fields as the tracking data updates) and the stats.
+        """
+        return {
+            "id": self.tracking_data_id,
+            **self.tracking_data,
+            "last_seq": self.last_seq,
+            "route": [
+                {
+                    "id": map_point_id,
+                    "latitude": lat,
+                    "longitude": lon,
+                    "tracking_data_id": self.tracking_data_id,
+                }
+                for map_point_id, lat, lon in zip(self.map_point_ids, self.lats, self.lons)
+            ],
+            "live": self.stats(),
+        }
+
+
+@handle_errors
+async def get_live_room(db: AsyncSession, tracking_data_id: int):
+    """
+    Function to load the state of a tracking room (tracking data, owner and route) when it becomes live.
+
+    Returns:
+        The room state.
+    """
+    query = (
+        sa.select(Workout.user_id, TrackingData.exercise_id,
+                  *(getattr(TrackingData, field) for field in LIVE_TRACKING_FIELDS))
+        .join(Exercise, Exercise.id == TrackingData.exercise_id)
+        .join(Workout, Workout.id == Exercise.workout_id)
+        .where(TrackingData.id == tracking_data_id)
+    )
+    result = await db.execute(query)
+    row = result.one_or_none()
+
+    if row is None:
+        raise HTTPException(status_code=404, detail='Tracking data not found.')
+
+    tracking_data = row._asdict()
+    live_room = LiveRoomState(tracking_data_id, tracking_data.pop("user_id"), tracking_data,
+                              exercise_id=tracking_data.pop("exercise_id"))
+
+    route_query = (
+        sa.select(MapPoint.id, MapPoint.lat, MapPoint.lon, MapPoint.created_at, MapPoint.seq)
+        .where(MapPoint.tracking_data_id == tracking_data_id)
+        .order_by(MapPoint.id)
+    )
+    result = await db.execute(route_query)
+    rows = result.all()
+
+    if rows:
+        live_room.map_point_ids.extend(row.id for row in rows)
+        live_room.lats.extend(row.lat for row in rows)
+        live_room.lons.extend(row.lon for row in rows)
+        live_room.distance = route_distance(live_room.lats, live_room.lons)
+        live_room.started_at = rows[0].created_at
+        live_room.last_fix_at = rows[-1].created_at
+        live_room.last_seq = max((row.seq for row in rows if row.seq is not None), default=None)
+
+    return live_room
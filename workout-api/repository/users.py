@@ -12,7 +12,7 @@ from crypto import verify_password
 from dtos import UpdateUserDTO
 from models import User
 from repository.auth import create_access_token
-from repository.utils import handle_errors, get_current_time
+from repository.utils import handle_errors, get_current_time, commit
 
 ERROR_401 = 'You are not authorized to perform this action.'
 ERROR_403 = 'Invalid credentials.'
@@ -39,7 +39,7 @@ async def create_new_user(user_data: dict, db: AsyncSession):
 
     try:
         db.add(new_user)
-        await db.commit()
+        await commit(db)
         await db.refresh(new_user)
     except IntegrityError:
         raise HTTPException(status_code=409, detail=ERROR_409)
@@ -101,7 +101,7 @@ async def update_user(user_id: int, requester_id, user_data: UpdateUserDTO, db:
     if user_data.age is not None:
         modified_user.age = user_data.age
 
-    await db.commit()
+    await commit(db)
     await db.refresh(modified_user)
     return modified_user
 
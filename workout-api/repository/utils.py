@@ -1,13 +1,17 @@
 import logging
+from contextlib import asynccontextmanager
 from datetime import datetime
 from functools import wraps
 
-from fastapi import HTTPException
-from fastapi.websockets import WebSocket
+from fastapi import HTTPException, status
+from fastapi.websockets import WebSocket, WebSocketDisconnect, WebSocketState
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 
+from json_response import dump_json
+from metrics import repository_errors
+
 
 def get_current_time():
     """
@@ -16,6 +20,74 @@ def get_current_time():
     return int(datetime.now().timestamp())
 
 
+TRANSACTION_SCOPE = "transaction_scope"
+
+
+def in_transaction_scope(db: AsyncSession) -> bool:
+    """
+    Function to check if the session is used by a transaction scope.
+    """
+    return TRANSACTION_SCOPE in db.info
+
+
+async def commit(db: AsyncSession):
+    """
+    Function to commit the changes of a repository operation.
+    Inside a transaction scope the changes are only flushed (the errors are raised at the same place),
+    the scope commits them once at its end.
+    """
+    if in_transaction_scope(db):
+        await db.flush()
+    else:
+        await db.commit()
+
+
+async def after_commit(db: AsyncSession, callback, *args):
+    """
+    Function to run a callback (e.g. a cache invalidation) once the changes are committed.
+    """
+    if in_transaction_scope(db):
+        db.info[TRANSACTION_SCOPE].append((callback, args))
+    else:
+        await callback(*args)
+
+
+@asynccontextmanager
+async def transaction_scope(db: AsyncSession):
+    """
+    Context manager to run several repository operations in one transaction of the same session.
+    The operations do not commit nor close the session, the scope commits once at the end (or rolls back
+    if an operation fails). A nested scope joins the outer one.
+    """
+    if in_transaction_scope(db):
+        yield db
+        return
+
+    db.info[TRANSACTION_SCOPE] = []
+    try:
+        try:
+            yield db
+        except BaseException:
+            await db.rollback()
+            raise
+
+        try:
+            await db.commit()
+        except SQLAlchemyError as error:
+            await db.rollback()
+            logging.error("Data base error has occurred: %s", error, exc_info=True)
+            repository_errors.inc("transaction_scope")
+            raise HTTPException(
+                status_code=500,
+                detail='An internal database-related error occurred. Please try again later.'
+            ) from error
+
+        for callback, args in db.info[TRANSACTION_SCOPE]:
+            await callback(*args)
+    finally:
+        db.info.pop(TRANSACTION_SCOPE, None)
+
+
 def handle_errors(func):
     """
     Decorator function to maintain generic error handling.
@@ -27,6 +99,7 @@ def handle_errors(func):
             return await func(*args, db=db, **kwargs)
         except SQLAlchemyError as error:
             logging.error("Data base error has occurred: %s", error, exc_info=True)
+            repository_errors.inc(func.__name__)
             raise HTTPException(
                 status_code=500,
                 detail='An internal database-related error occurred. Please try again later.'
@@ -37,12 +110,15 @@ def handle_errors(func):
             raise
         except Exception as error:
             logging.error("An unexpected error occurred: %s", error, exc_info=True)
+            repository_errors.inc(func.__name__)
             raise HTTPException(
                 status_code=500,
                 detail='An internal server error occurred. Please try again later.'
             ) from error
         finally:
-            await db.close()
+            # the transaction scope owns the session until its commit
+            if not in_transaction_scope(db):
+                await db.close()
 
     return wrapper
 
@@ -65,34 +141,73 @@ class WebsocketTrackingHandler:
 
     def __init__(self):
         self.active_connections = []
+        # tracking room id -> connected websockets
+        self.rooms = {}
+        # tracking room id -> in-memory state of the room (repository.live_tracking), dropped with the room
+        self.live_rooms = {}
 
-    async def connect(self, websocket):
+    async def connect(self, websocket, tracking_data_id: int = None):
         """
         Function to connect to the websocket.
         """
         await websocket.accept()
         self.active_connections.append(websocket)
+        self.rooms.setdefault(tracking_data_id, []).append(websocket)
 
-    async def disconnect(self, websocket):
+    async def disconnect(self, websocket, tracking_data_id: int = None):
         """
         Function to disconnect from the websocket.
         """
-        await websocket.close()
         self.active_connections.remove(websocket)
+        # the socket can be closed by the client or already by the endpoint (e.g. with a policy violation code)
+        if WebSocketState.DISCONNECTED not in (websocket.client_state, websocket.application_state):
+            await websocket.close()
+        room = self.rooms.get(tracking_data_id, [])
+        if websocket in room:
+            room.remove(websocket)
+        if not room:
+            self.rooms.pop(tracking_data_id, None)
+            self.live_rooms.pop(tracking_data_id, None)
+
+    async def close_rooms(self, *exercise_ids: int):
+        """
+        Function to close the live rooms of deleted exercises: the room state is dropped at once
+        (the live endpoint stops serving the deleted route) and the sockets are closed, their handlers leave the room.
+        """
+        for tracking_data_id, live_room in list(self.live_rooms.items()):
+            if live_room.exercise_id not in exercise_ids:
+                continue
+            del self.live_rooms[tracking_data_id]
+            for websocket in list(self.rooms.get(tracking_data_id, [])):
+                if WebSocketState.DISCONNECTED in (websocket.client_state, websocket.application_state):
+                    continue
+                try:
+                    await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason='Tracking data not found.')
+                except (WebSocketDisconnect, RuntimeError):
+                    # the socket closed meanwhile, its own handler disconnects it
+                    continue
 
     @staticmethod
     async def send_message(data, websocket: WebSocket):
         """
         Function to send a message to the websocket.
         """
-        await websocket.send_json(data)
+        await websocket.send_text(dump_json(data).decode())
 
-    async def broadcast(self, data):
+    async def broadcast(self, data, tracking_data_id: int = None):
         """
-        Function to broadcast data to all websockets.
+        Function to broadcast data to the websockets of a tracking room, or to all websockets without a room
+        (the message is serialized only once).
         """
-        for connection in self.active_connections:
-            await connection.send_json(data)
+        message = dump_json(data).decode()
+        connections = self.rooms.get(tracking_data_id, []) if tracking_data_id is not None \
+            else self.active_connections
+        for connection in list(connections):
+            try:
+                await connection.send_text(message)
+            except (WebSocketDisconnect, RuntimeError):
+                # the socket closed during the broadcast, its own handler disconnects it
+                continue
 
 
 tracking_ws_handler = WebsocketTrackingHandler()
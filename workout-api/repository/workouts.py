@@ -5,12 +5,15 @@ to the workout endpoints.
 """
 import sqlalchemy as sa
 from fastapi import HTTPException
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import joinedload
 
-from models import Workout
-from repository.utils import handle_errors, get_current_time
+from cache import response_cache, workout_scope, exercises_scope, tracking_scope
+from json_response import dump_json
+from models import Workout, Exercise, TrackingData
+from repository.fieldsets import select_columns, WORKOUT_FIELDS, WORKOUT_EXERCISE_FIELDS
+from repository.utils import handle_errors, get_current_time, commit, after_commit, tracking_ws_handler
 
 ERROR_401 = 'You are not authorized to perform this action.'
 
@@ -36,7 +39,7 @@ async def create_new_workout(workout_data: dict, user_id: int, db: AsyncSession)
     try:
         result = await db.execute(query)
         workout_id = result.scalar()
-        await db.commit()
+        await commit(db)
     except DBAPIError:
         raise HTTPException(status_code=400, detail='Invalid workout type or invalid data provided.')
 
@@ -44,6 +47,80 @@ async def create_new_workout(workout_data: dict, user_id: int, db: AsyncSession)
             'message': f'Workout {workout_id} added successfully.'}
 
 
+@handle_errors
+async def create_new_workout_with_exercises(workout_data: dict, user_id: int, db: AsyncSession):
+    """
+    Function to add a new workout with its exercises (and their tracking rooms) in a single transaction.
+    The exercises and the tracking rooms are added with multi-row inserts.
+
+    Returns:
+        The success message with the workout, exercises and tracking data ids.
+    """
+    exercises_data = workout_data.pop('exercises')
+    creation_date = get_current_time()
+    workout_data.update({"created_at": creation_date})
+    workout_data.update({"user_id": user_id})
+    workout_data.update({"schedule_date": creation_date})
+
+    try:
+        workout_query = sa.insert(Workout).values(**workout_data).returning(Workout.id)
+        result = await db.execute(workout_query)
+        workout_id = result.scalar()
+
+        exercise_ids = []
+        if exercises_data:
+            exercise_rows = [
+                {
+                    "name": exercise["name"],
+                    "exercise_type": exercise["exercise_type"],
+                    "duration": exercise["duration"],
+                    "calories": exercise["calories"],
+                    "created_at": creation_date,
+                    "workout_id": workout_id
+                }
+                for exercise in exercises_data
+            ]
+            exercise_query = sa.insert(Exercise).returning(Exercise.id, sort_by_parameter_order=True)
+            result = await db.execute(exercise_query, exercise_rows)
+            exercise_ids = list(result.scalars().all())
+
+        tracking_rows = [
+            {
+                "description": tracking_room["description"],
+                "duration": tracking_room["duration"],
+                "is_new_set": tracking_room["is_new_set"],
+                "is_new_record": tracking_room["is_new_record"],
+                "distance_covered": tracking_room["distance_covered"],
+                "created_at": creation_date,
+                "last_updated_at": creation_date,
+                "exercise_id": exercise_id
+            }
+            for exercise_id, exercise in zip(exercise_ids, exercises_data)
+            for tracking_room in exercise["tracking_rooms"]
+        ]
+        tracking_data_ids = {exercise_id: [] for exercise_id in exercise_ids}
+        if tracking_rows:
+            tracking_query = sa.insert(TrackingData).returning(TrackingData.exercise_id, TrackingData.id,
+                                                               sort_by_parameter_order=True)
+            result = await db.execute(tracking_query, tracking_rows)
+            for row in result:
+                tracking_data_ids[row.exercise_id].append(row.id)
+
+        await commit(db)
+    except DBAPIError:
+        raise HTTPException(status_code=400, detail='Invalid workout type or invalid data provided.')
+
+    return {'status': 'success',
+            'message': f'Workout {workout_id} added successfully.',
+            'data': {
+                "workout_id": workout_id,
+                "exercises": [
+                    {"id": exercise_id, "tracking_data_ids": tracking_data_ids[exercise_id]}
+                    for exercise_id in exercise_ids
+                ]
+            }}
+
+
 @handle_errors
 async def update_workout(workout_id: int, workout_data: dict, user_id: int, db: AsyncSession):
     """
@@ -63,12 +140,18 @@ async def update_workout(workout_id: int, workout_data: dict, user_id: int, db:
         raise HTTPException(status_code=401, detail=ERROR_401)
 
     try:
-        update_query = sa.update(Workout).where(Workout.id == workout_id).values(**workout_data)
+        update_query = (
+            sa.update(Workout)
+            .where(Workout.id == workout_id)
+            .values(**workout_data, version=Workout.version + 1)
+        )
         await db.execute(update_query)
-        await db.commit()
+        await commit(db)
     except DBAPIError:
         raise HTTPException(status_code=400, detail='Invalid workout type or invalid data provided.')
 
+    await after_commit(db, response_cache.invalidate, workout_scope(workout_id), exercises_scope(workout_id))
+
     return {'status': 'success',
             'message': f'Workout {workout_id} updated successfully.'}
 
@@ -81,73 +164,195 @@ async def get_workouts(db: AsyncSession, user_id: int):
     Returns:
         The list of workouts (Without exercises).
     """
-    query = sa.select(Workout).where(Workout.user_id == user_id)
+    query = (
+        sa.select(Workout.id, Workout.user_id, Workout.workout_type, Workout.duration, Workout.calories,
+                  Workout.created_at, Workout.is_schedule, Workout.schedule_date)
+        .where(Workout.user_id == user_id)
+    )
     result = await db.execute(query)
-    workouts = result.scalars().all()
+    workouts = result.mappings().all()
     if not workouts:
         raise HTTPException(status_code=204, detail='No workouts found.')
-    mapped_workouts = [
-        {
-            "id": workout.id,
-            "user_id": workout.user_id,
-            "workout_type": workout.workout_type,
-            "duration": workout.duration,
-            "calories": workout.calories,
-            "created_at": workout.created_at,
-            "is_schedule": workout.is_schedule,
-            "schedule_date": workout.schedule_date
-        }
-        for workout in workouts
-    ]
+    mapped_workouts = [dict(workout) for workout in workouts]
     return mapped_workouts
 
 
 @handle_errors
-async def get_workout(db: AsyncSession, workout_id: int, user_id: int):
+async def get_workout_version(db: AsyncSession, workout_id: int, user_id: int):
+    """
+    Function to get the version of a workout (without loading it) from the "workouts" table.
+
+    Returns:
+        The workout version or None if the workout does not exist for this user.
+    """
+    query = (
+        sa.select(Workout.version)
+        .where(Workout.id == workout_id)
+        .where(Workout.user_id == user_id)
+    )
+    result = await db.execute(query)
+    return result.scalar()
+
+
+@handle_errors
+async def get_workout(db: AsyncSession, workout_id: int, user_id: int, fields: dict = None):
     """
     Function to get a specific workout with exercises from the "workouts" table.
+    Only the requested fields (see repository.fieldsets) are selected,
+    and the exercises are only queried if they were requested.
 
     Returns:
         The workout info with exercises.
     """
+    columns, nested = select_columns(fields, WORKOUT_FIELDS, nested={"exercises": WORKOUT_EXERCISE_FIELDS})
+    exercise_columns = None
+    if "exercises" in nested:
+        exercise_columns, _ = select_columns(nested["exercises"], WORKOUT_EXERCISE_FIELDS)
+
     query = (
-        sa.select(Workout)
-        .options(joinedload(Workout.exercises))  # Eager load the exercises relationship
+        sa.select(Workout.id.label("_workout_id"), *columns)
         .where(Workout.id == workout_id)
         .where(Workout.user_id == user_id)
     )
 
     result = await db.execute(query)
-    workout = result.scalars().first()
+    workout = result.mappings().first()
 
     if not workout:
         raise HTTPException(status_code=204, detail='No workouts found.')
 
-    mapped_workout = {
-        "id": workout.id,
-        "user_id": workout.user_id,
-        "workout_type": workout.workout_type,
-        "duration": workout.duration,
-        "calories": workout.calories,
-        "created_at": workout.created_at,
-        "is_schedule": workout.is_schedule,
-        "schedule_date": workout.schedule_date,
-        "exercises": [
-            {
-                "id": exercise.id,
-                "name": exercise.name,
-                "exercise_type": exercise.exercise_type,
-                "duration": exercise.duration,
-                "calories": exercise.calories,
-                "created_at": exercise.created_at
-            }
-            for exercise in workout.exercises
-        ]
-    }
+    mapped_workout = dict(workout)
+    del mapped_workout["_workout_id"]
+
+    if exercise_columns is not None:
+        exercises_query = sa.select(*exercise_columns).where(Exercise.workout_id == workout_id).order_by(Exercise.id)
+        result = await db.execute(exercises_query)
+        mapped_workout["exercises"] = [dict(exercise) for exercise in result.mappings()]
 
     return mapped_workout
 
 
+def json_object(**pairs):
+    """
+    Function to build a Postgres json_build_object expression.
+    The keys are rendered as literals (asyncpg can't infer the type of bound keys).
+    """
+    arguments = []
+    for key, value in pairs.items():
+        arguments.extend((sa.literal_column(f"'{key}'"), value))
+    return sa.func.json_build_object(*arguments)
+
+
+def workout_document_query(workout_id: int, user_id: int):
+    """
+    Function to build the query that renders a workout document (workout, exercises and
+    per-exercise tracking summaries) as JSON text in Postgres.
+    """
+    tracking_summary = (
+        sa.select(json_object(
+            sessions=sa.func.count(TrackingData.id),
+            duration=sa.func.coalesce(sa.func.sum(TrackingData.duration), 0),
+            distance_covered=sa.func.coalesce(sa.func.sum(TrackingData.distance_covered), 0),
+        ))
+        .where(TrackingData.exercise_id == Exercise.id)
+        .scalar_subquery()
+    )
+    exercise_document = json_object(
+        id=Exercise.id,
+        name=Exercise.name,
+        exercise_type=Exercise.exercise_type,
+        duration=Exercise.duration,
+        calories=Exercise.calories,
+        created_at=Exercise.created_at,
+        tracking=tracking_summary,
+    )
+    exercises = (
+        sa.select(sa.func.coalesce(
+            sa.func.json_agg(aggregate_order_by(exercise_document, Exercise.id)),
+            sa.literal_column("'[]'::json")
+        ))
+        .where(Exercise.workout_id == Workout.id)
+        .scalar_subquery()
+    )
+    workout_document = json_object(
+        id=Workout.id,
+        user_id=Workout.user_id,
+        workout_type=sa.func.lower(sa.cast(Workout.workout_type, sa.Text)),
+        duration=Workout.duration,
+        calories=Workout.calories,
+        created_at=Workout.created_at,
+        is_schedule=Workout.is_schedule,
+        schedule_date=Workout.schedule_date,
+        exercises=exercises,
+    )
+    return (
+        sa.select(sa.cast(workout_document, sa.Text))
+        .where(Workout.id == workout_id)
+        .where(Workout.user_id == user_id)
+    )
+
+
+async def build_workout_document(db: AsyncSession, workout_id: int, user_id: int):
+    """
+    Function to build the workout document in Python, for the databases without the Postgres JSON functions.
+    """
+    columns, _ = select_columns(None, WORKOUT_FIELDS)
+    result = await db.execute(
+        sa.select(*columns).where(Workout.id == workout_id).where(Workout.user_id == user_id)
+    )
+    workout = result.mappings().first()
+    if not workout:
+        return None
+
+    tracking_query = (
+        sa.select(
+            TrackingData.exercise_id,
+            sa.func.count(TrackingData.id).label("sessions"),
+            sa.func.coalesce(sa.func.sum(TrackingData.duration), 0).label("duration"),
+            sa.func.coalesce(sa.func.sum(TrackingData.distance_covered), 0).label("distance_covered"),
+        )
+        .join(Exercise, Exercise.id == TrackingData.exercise_id)
+        .where(Exercise.workout_id == workout_id)
+        .group_by(TrackingData.exercise_id)
+    )
+    result = await db.execute(tracking_query)
+    tracking = {row.exercise_id: {"sessions": row.sessions, "duration": row.duration,
+                                  "distance_covered": row.distance_covered} for row in result}
+
+    exercise_columns, _ = select_columns(None, WORKOUT_EXERCISE_FIELDS)
+    result = await db.execute(
+        sa.select(*exercise_columns).where(Exercise.workout_id == workout_id).order_by(Exercise.id)
+    )
+    empty_summary = {"sessions": 0, "duration": 0, "distance_covered": 0}
+    exercises = [
+        {**exercise, "tracking": tracking.get(exercise["id"], empty_summary)}
+        for exercise in result.mappings()
+    ]
+    return dump_json({**workout, "exercises": exercises})
+
+
+@handle_errors
+async def get_workout_document(db: AsyncSession, workout_id: int, user_id: int):
+    """
+    Function to get a workout with its exercises and their tracking summaries as a JSON document.
+    On Postgres the whole document is built by the database (json_build_object/json_agg) in a single query,
+    and the JSON is returned untouched.
+
+    Returns:
+        The workout document (JSON).
+    """
+    if db.bind.dialect.name == 'postgresql':
+        result = await db.execute(workout_document_query(workout_id, user_id))
+        document = result.scalar()
+    else:
+        document = await build_workout_document(db, workout_id, user_id)
+
+    if document is None:
+        raise HTTPException(status_code=404, detail='Workout not found.')
+
+    return document
+
+
 @handle_errors
 async def delete_workout(db: AsyncSession, workout_id: int, user_id: int):
     """
@@ -166,8 +371,16 @@ async def delete_workout(db: AsyncSession, workout_id: int, user_id: int):
     if existing_workout.user_id != user_id:
         raise HTTPException(status_code=401, detail=ERROR_401)
 
+    exercises_query = sa.select(Exercise.id).where(Exercise.workout_id == workout_id)
+    result = await db.execute(exercises_query)
+    exercise_ids = result.scalars().all()
+
     delete_query = sa.delete(Workout).where(Workout.id == workout_id)
     await db.execute(delete_query)
-    await db.commit()
+    await commit(db)
+
+    await after_commit(db, response_cache.invalidate, workout_scope(workout_id), exercises_scope(workout_id),
+                       *(tracking_scope(exercise_id) for exercise_id in exercise_ids))
+    await after_commit(db, tracking_ws_handler.close_rooms, *exercise_ids)
     return {'status': 'success',
             'message': f'Workout {workout_id} deleted successfully.'}
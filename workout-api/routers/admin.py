@@ -0,0 +1,125 @@
+"""
+admin.py
+Routes are configured for the admin (diagnostics) endpoints, protected by the X-Admin-Token header.
+"""
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from json_response import FastJSONResponse
+from loop_monitor import loop_monitor
+from memory_tracking import memory_tracker, session_stats
+from profiling import profiler
+
+router = APIRouter()
+
+PROFILE_FORMATS = ('collapsed', 'speedscope')
+
+
+@router.get("/profiles", status_code=200)
+async def get_profiles():
+    """
+    Function to get the stored request profiles.
+    Returns: The list of profiles (without the samples).
+    """
+    return [profile.summary() for profile in reversed(profiler.profiles.values())]
+
+
+@router.get("/profiles/{profile_id}", status_code=200)
+def get_profile(profile_id: str, profile_format: str = 'speedscope'):
+    """
+    Function to download a request profile.
+    Args:
+        profile_id:
+        profile_format: "collapsed" (flamegraph stacks) or "speedscope" (JSON).
+
+    Returns: The profile file.
+    """
+    if profile_format not in PROFILE_FORMATS:
+        raise HTTPException(status_code=400, detail=f'Unsupported profile format. Use one of {PROFILE_FORMATS}.')
+
+    profile = profiler.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail='Profile not found.')
+
+    if profile_format == 'collapsed':
+        return PlainTextResponse(profile.collapsed(), headers={
+            "Content-Disposition": f'attachment; filename="profile-{profile_id}.txt"'
+        })
+    return FastJSONResponse(profile.speedscope(), headers={
+        "Content-Disposition": f'attachment; filename="profile-{profile_id}.speedscope.json"'
+    })
+
+
+@router.get("/loop/stalls", status_code=200)
+async def get_loop_stalls():
+    """
+    Function to get the recent event loop stalls with the stack of the blocking code.
+    Returns: The lag percentiles and the list of stalls.
+    """
+    return {
+        "lag_quantiles": {quantile[0]: lag for quantile, lag in loop_monitor.quantiles().items()},
+        "stalls": loop_monitor.recent_stalls(),
+    }
+
+
+@router.get("/memory", status_code=200)
+async def get_memory_status():
+    """
+    Function to get the tracemalloc status and the identity-map sizes of the live ORM sessions.
+    Served from the event loop, the only thread using the sessions (both reads are cheap).
+    Returns: The memory status.
+    """
+    return {**memory_tracker.status(), "sessions": session_stats()}
+
+
+@router.post("/memory/tracing", status_code=200)
+def start_memory_tracing(frames: int = 1):
+    """
+    Function to start tracing the memory allocations.
+    Args:
+        frames: traceback depth stored per allocation (more frames, more overhead).
+
+    Returns: The tracing status.
+    """
+    return memory_tracker.start_tracing(frames=frames)
+
+
+@router.delete("/memory/tracing", status_code=200)
+def stop_memory_tracing():
+    """
+    Function to stop tracing the memory allocations (the snapshots are dropped).
+    Returns: The tracing status.
+    """
+    return memory_tracker.stop_tracing()
+
+
+@router.post("/memory/snapshots", status_code=201)
+def take_memory_snapshot(limit: int = 20):
+    """
+    Function to take a tracemalloc snapshot.
+    Args:
+        limit: number of allocation sites to return.
+
+    Returns: The snapshot id and its top allocation sites.
+    """
+    snapshot = memory_tracker.take_snapshot(limit=limit)
+    if snapshot is None:
+        raise HTTPException(status_code=409, detail='The memory tracing is not started.')
+    return snapshot
+
+
+@router.get("/memory/snapshots/{snapshot_id}/diff", status_code=200)
+def get_memory_snapshot_diff(snapshot_id: int, base_id: int | None = None, limit: int = 20):
+    """
+    Function to compare a snapshot with a previous one.
+    Args:
+        snapshot_id:
+        base_id: snapshot to compare with (the previous snapshot by default).
+        limit: number of allocation sites to return.
+
+    Returns: The top allocation differences.
+    """
+    diff = memory_tracker.diff(snapshot_id=snapshot_id, base_id=base_id, limit=limit)
+    if diff is None:
+        raise HTTPException(status_code=404, detail='Snapshot not found.')
+    return diff
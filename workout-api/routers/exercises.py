@@ -1,13 +1,22 @@
-from fastapi import APIRouter, Depends
+import asyncio
+
+from fastapi import APIRouter, Depends, HTTPException, Header, Response, status
 from fastapi.websockets import WebSocketDisconnect, WebSocket
 
-from dtos import CreateExerciseDTO, UpdateExerciseDTO, CreateTrackingRoomDTO
+from analytics import route_analytics, SharedRoute
+from cache import response_cache, exercises_scope, tracking_scope
+from dtos import CreateExerciseDTO, UpdateExerciseDTO, CreateTrackingRoomDTO, TrackingMessageDTO
+from ingest import map_point_ingest
+from json_response import FastJSONResponse
 from repository.auth import get_current_user
+from repository.fieldsets import parse_fields, fields_variant
 from repository.exercise import create_new_exercise, get_exercise, get_exercises, update_exercise, delete_exercise, \
     get_exercise_tracking_data_list, create_exercise_tracking_data_room, update_exercise_tracking_data, \
-    create_map_point, get_exercise_tracking_data_updates
-from repository.utils import tracking_ws_handler
-from routers.utils import get_db, AsyncSession
+    get_exercise_tracking_route, create_tracking_map_point, ERROR_401
+from repository.live_tracking import get_live_room
+from repository.utils import tracking_ws_handler, get_current_time, transaction_scope
+from repository.workouts import get_workout_version
+from routers.utils import get_db, get_session_factory, etag_matches, AsyncSession
 
 router = APIRouter()
 
@@ -58,28 +67,46 @@ async def update(exercise_data: UpdateExerciseDTO, db: AsyncSession = Depends(ge
 
 @router.get("/list/{workout_id}", status_code=200)
 async def get(db: AsyncSession = Depends(get_db), user_id: int = Depends(get_current_user_id),
-              workout_id: int = None):
+              workout_id: int = None, if_none_match: str | None = Header(None), fields: str | None = None):
     """
-    Function to get all exercises.
-    Returns: List of exercises.
+    Function to get all exercises (cached). Supports conditional requests through the ETag/If-None-Match headers
+    and sparse fieldsets through the fields parameter (e.g. "id,name,calories").
+    Returns: List of exercises (or 304 if they did not change).
     """
-    exercises = await get_exercises(db=db, user_id=user_id, workout_id=workout_id)
-    return exercises
+    selection = parse_fields(fields)
+    variant = fields_variant(selection)
+
+    headers = {}
+    version = await get_workout_version(db=db, workout_id=workout_id, user_id=user_id)
+    if version is not None:
+        etag = f'"exercises-{workout_id}-{version}{"-" + variant if variant else ""}"'
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        headers["ETag"] = etag
+
+    exercises = await response_cache.get_or_load(
+        exercises_scope(workout_id), user_id,
+        lambda: get_exercises(db=db, user_id=user_id, workout_id=workout_id, fields=selection),
+        variant=variant, version=version
+    )
+    return Response(content=exercises, media_type="application/json", headers=headers)
 
 
 @router.get("/{exercise_id}", status_code=200)
-async def get(exercise_id: int, db: AsyncSession = Depends(get_db), user_id: int = Depends(get_current_user_id)):
+async def get(exercise_id: int, db: AsyncSession = Depends(get_db), user_id: int = Depends(get_current_user_id),
+              fields: str | None = None):
     """
     Function to get an exercise.
     Args:
         exercise_id:
         db:
         user_id:
+        fields: optional sparse fieldset, e.g. "id,name,calories".
 
     Returns: The exercise info.
     """
-    exercise = await get_exercise(db=db, user_id=user_id, exercise_id=exercise_id)
-    return exercise
+    exercise = await get_exercise(db=db, user_id=user_id, exercise_id=exercise_id, fields=parse_fields(fields))
+    return FastJSONResponse(exercise)
 
 
 @router.delete("/{exercise_id}", status_code=200)
@@ -123,60 +150,198 @@ async def post_tracking(tracking_data: CreateTrackingRoomDTO, exercise_id: int,
 
 @router.get("/tracking/list/{exercise_id}", status_code=200)
 async def get_tracking(exercise_id: int, db: AsyncSession = Depends(get_db),
-                       user_id: int = Depends(get_current_user_id)):
+                       user_id: int = Depends(get_current_user_id), fields: str | None = None):
     """
-    Function to get all exercise tracking.
+    Function to get all exercise tracking (cached).
     Args:
         exercise_id:
         db:
         user_id:
+        fields: optional sparse fieldset, e.g. "id,duration,distance_covered".
 
     Returns: List of exercise tracking data.
 
     """
-    return await get_exercise_tracking_data_list(db=db, user_id=user_id, exercise_id=exercise_id)
+    selection = parse_fields(fields)
+    tracking_data = await response_cache.get_or_load(
+        tracking_scope(exercise_id), user_id,
+        lambda: get_exercise_tracking_data_list(db=db, user_id=user_id, exercise_id=exercise_id, fields=selection),
+        variant=fields_variant(selection)
+    )
+    return Response(content=tracking_data, media_type="application/json")
+
+
+@router.get("/tracking/{tracking_data_id}/analytics", status_code=200)
+async def get_tracking_analytics(tracking_data_id: int, split_length: float = 1000, tolerance: float = 5,
+                                 db: AsyncSession = Depends(get_db), user_id: int = Depends(get_current_user_id)):
+    """
+    Function to get the route analytics (distance, splits and simplified route) of an exercise tracking.
+    The computation runs in the analytics process pool, so it does not block the tracking sockets.
+    Args:
+        tracking_data_id:
+        split_length: split size in meters.
+        tolerance: simplification tolerance in meters.
+        db:
+        user_id:
+
+    Returns: The route analytics.
+
+    """
+    if split_length <= 0:
+        raise HTTPException(status_code=400, detail='The split length must be greater than 0.')
+    if tolerance < 0:
+        raise HTTPException(status_code=400, detail='The tolerance can not be negative.')
+
+    lats, lons = await get_exercise_tracking_route(db=db, user_id=user_id, tracking_data_id=tracking_data_id)
+
+    try:
+        # the coordinates are written once and shared by the three jobs
+        with SharedRoute(lats, lons) as route:
+            distance, splits, simplified = await asyncio.gather(
+                route_analytics.submit("distance", route),
+                route_analytics.submit("splits", route, split_length=split_length),
+                route_analytics.submit("simplify", route, tolerance=tolerance),
+            )
+    except asyncio.TimeoutError as error:
+        raise HTTPException(status_code=503, detail='The route analytics took too long. Please try again later.') \
+            from error
+
+    return FastJSONResponse({
+        'status': 'success',
+        'data': {
+            "distance": distance,
+            "splits": splits,
+            "simplified_route": [{"latitude": lats[index], "longitude": lons[index]} for index in simplified],
+        }
+    })
+
+
+@router.get("/tracking/live/{tracking_data_id}", status_code=200)
+async def get_live_tracking(tracking_data_id: int, user_id: int = Depends(get_current_user_id)):
+    """
+    Function to get the live state (route and running stats) of a tracking room with connected websockets.
+    It is served from memory, without database queries.
+    Args:
+        tracking_data_id:
+        user_id:
+
+    Returns: The live tracking data.
+
+    """
+    live_room = tracking_ws_handler.live_rooms.get(tracking_data_id)
+    if live_room is None:
+        raise HTTPException(status_code=404, detail='The tracking room is not live.')
+    if live_room.user_id != user_id:
+        raise HTTPException(status_code=401, detail=ERROR_401)
+    return FastJSONResponse({'status': 'success', 'data': live_room.as_dict()})
 
 
 # websockets operations
 @router.websocket("/ws/tracking/{tracking_data_id}")
-async def start_tracking(websocket: WebSocket, tracking_data_id: int, db: AsyncSession = Depends(get_db)):
+async def start_tracking(websocket: WebSocket, tracking_data_id: int, session_factory=Depends(get_session_factory)):
     """
     Function to start the tracking of an exercise using websockets if the tracking room exists (or if needed).
+    The socket holds no database connection while it waits for the client, a session is only opened
+    to load the room state and to write the tracking data updates (committed with their point in one transaction).
     Args:
         tracking_data_id:
         websocket:
-        db:
+        session_factory:
 
     Returns: The tracking status.
 
     """
 
     websocket_handler = tracking_ws_handler
-    await websocket_handler.connect(websocket=websocket)
-    await websocket_handler.broadcast({"status": True, "message": "The tracking has started."})
+    await websocket_handler.connect(websocket=websocket, tracking_data_id=tracking_data_id)
 
+    # whatever ends the socket, it leaves its room (and the room state goes with the last socket)
     try:
+        # the room state is loaded by its first socket and dropped when its last socket leaves
+        live_room = websocket_handler.live_rooms.get(tracking_data_id)
+        if live_room is None:
+            try:
+                async with session_factory() as db:
+                    loaded_room = await get_live_room(tracking_data_id=tracking_data_id, db=db)
+            except HTTPException as error:
+                await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=error.detail)
+                return {"status": False, "message": error.detail}
+            # another socket of the room could have loaded it meanwhile
+            live_room = websocket_handler.live_rooms.setdefault(tracking_data_id, loaded_room)
+
+        await websocket_handler.broadcast({"status": True, "message": "The tracking has started."},
+                                          tracking_data_id=tracking_data_id)
+        # resume handshake: a reconnecting client only resends the points after the last stored sequence number
+        await websocket_handler.send_message({"status": True, "message": "The tracking can resume.",
+                                              "tracking_data_id": tracking_data_id, "last_seq": live_room.last_seq},
+                                             websocket)
+
         while True:
-            data = await websocket.receive_json()
             # this is the data that the client sends to the server every time the user moves
-            response = await create_map_point(map_point=data['map_point'], tracking_data_id=tracking_data_id, db=db)
-
-            if data['update_tracking_data'] is True:
-                # if the user wants to update the tracking data every x seconds
-                update_response = await update_exercise_tracking_data(data=data['updated_tracking_data'],
-                                                                      tracking_data_id=response['data'], db=db)
-            else:
-                update_response = None
-
-            if update_response['status']:
-                await websocket_handler.broadcast({"status": True, "message": "The tracking data has been updated."})
-                tracking_updates = await get_exercise_tracking_data_updates(tracking_data_id=response['data'], db=db)
-                await websocket_handler.broadcast(tracking_updates)
+            try:
+                message = TrackingMessageDTO.model_validate(await websocket.receive_json())
+            except (ValueError, KeyError):
+                # not JSON, a binary frame or missing fields: the client is told and the socket stays open
+                await websocket_handler.send_message({"status": False, "message": "Invalid tracking message.",
+                                                      "tracking_data_id": tracking_data_id}, websocket)
+                continue
+            map_point = message.map_point.model_dump()
+
+            update_response = None
+            try:
+                if message.update_tracking_data:
+                    # if the user wants to update the tracking data every x seconds, the point and the update
+                    # are committed together (one transaction per message)
+                    async with session_factory() as db:
+                        # labels the session in the admin memory report
+                        db.info["owner"] = f"tracking websocket {tracking_data_id}"
+                        async with transaction_scope(db):
+                            map_point_id = await create_tracking_map_point(
+                                tracking_data_id=tracking_data_id, map_point=map_point, db=db
+                            )
+                            if map_point_id is not None:
+                                update_response = await update_exercise_tracking_data(
+                                    tracking_data=message.updated_tracking_data, tracking_data_id=tracking_data_id,
+                                    db=db
+                                )
+                else:
+                    # the point is committed with the points of the other rooms
+                    map_point_id = await map_point_ingest.submit(tracking_data_id=tracking_data_id,
+                                                                 map_point=map_point)
+            except HTTPException as error:
+                # the point (or the update) could not be stored, the client can send it again
+                await websocket_handler.send_message({"status": False, "message": error.detail,
+                                                      "tracking_data_id": tracking_data_id}, websocket)
+                continue
+
+            if map_point_id is None:
+                # the point was resent after a reconnection and it is already stored
+                await websocket_handler.send_message({"status": True, "message": "The point is already stored.",
+                                                      "tracking_data_id": tracking_data_id,
+                                                      "seq": map_point['seq']}, websocket)
+                continue
+            live_room.add_point(map_point_id, map_point['lat'], map_point['lon'], get_current_time(),
+                                map_point['seq'])
+            if update_response and update_response['status']:
+                live_room.apply_update(message.updated_tracking_data)
+
+            # the point ids let the clients match the broadcasts with the points they sent,
+            # the running stats come from the room state
+            point = {"tracking_data_id": tracking_data_id, "map_point_id": map_point_id, "live": live_room.stats()}
+
+            if update_response and update_response['status']:
+                await websocket_handler.broadcast({"status": True, "message": "The tracking data has been updated.",
+                                                   **point}, tracking_data_id=tracking_data_id)
+                await websocket_handler.broadcast(live_room.as_dict(), tracking_data_id=tracking_data_id)
             else:
                 await websocket_handler.broadcast(
-                    {"status": False, "message": "The tracking data has not been updated."})
+                    {"status": False, "message": "The tracking data has not been updated.", **point},
+                    tracking_data_id=tracking_data_id)
 
     except WebSocketDisconnect:
-        await websocket_handler.broadcast({"status": False, "message": "The tracking has stopped."})
-        await websocket_handler.disconnect(websocket=websocket)
         return {"status": True, "message": "The tracking has stopped."}
+    finally:
+        # the closed socket leaves the room before the broadcast, it can not receive it anymore
+        await websocket_handler.disconnect(websocket=websocket, tracking_data_id=tracking_data_id)
+        await websocket_handler.broadcast({"status": False, "message": "The tracking has stopped."},
+                                          tracking_data_id=tracking_data_id)
@@ -0,0 +1,83 @@
+"""
+imports.py
+Routes are configured for the bulk import endpoints.
+"""
+import os
+import shutil
+import tempfile
+
+from fastapi import APIRouter, Depends, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+
+from repository.auth import get_current_user
+from repository.imports import IMPORT_FORMATS, start_import_job, get_import_job, verify_import_slot
+from routers.utils import get_session_factory
+
+router = APIRouter()
+
+
+async def get_current_user_id(current_user_id: int = Depends(get_current_user)):
+    """
+    Function to get the current user id.
+    Args:
+        current_user_id:
+
+    Returns: The current user id.
+    """
+    return current_user_id
+
+
+def spool_upload(file: UploadFile):
+    """
+    Function to copy the uploaded file in chunks into a temporary file that outlives the request.
+
+    Returns: The temporary file path.
+    """
+    with tempfile.NamedTemporaryFile(prefix='workout-import-', delete=False) as spooled_file:
+        shutil.copyfileobj(file.file, spooled_file)
+    return spooled_file.name
+
+
+@router.post("/", status_code=202)
+async def post(file: UploadFile, import_format: str | None = None, user_id: int = Depends(get_current_user_id),
+               session_factory=Depends(get_session_factory)):
+    """
+    Function to start the import of a CSV workout log or a GPX file.
+    Args:
+        file:
+        import_format: "csv" or "gpx" (taken from the file extension if not provided).
+        user_id:
+        session_factory:
+
+    Returns: The import job info.
+    """
+    if import_format is None:
+        import_format = os.path.splitext(file.filename or '')[1].lstrip('.').lower()
+    if import_format not in IMPORT_FORMATS:
+        raise HTTPException(status_code=400, detail='Unsupported import format, use a CSV or GPX file.')
+    # checked before spooling the upload, and again when the job starts
+    verify_import_slot()
+
+    path = await run_in_threadpool(spool_upload, file)
+    job = start_import_job(user_id=user_id, import_format=import_format, path=path,
+                           session_factory=session_factory)
+    return {'status': 'success',
+            'message': f'Import {job.id} started.',
+            'data': job.as_dict()}
+
+
+@router.get("/{job_id}", status_code=200)
+async def get(job_id: str, user_id: int = Depends(get_current_user_id)):
+    """
+    Function to get the progress of an import job.
+    Args:
+        job_id:
+        user_id:
+
+    Returns: The import job info.
+    """
+    job = get_import_job(job_id=job_id, user_id=user_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail='Import job not found.')
+    return {'status': 'success',
+            'data': job.as_dict()}
@@ -1,6 +1,7 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 
-from routers import auth, users, workouts, exercises, misc_routes
+from repository.auth import verify_admin
+from routers import auth, users, workouts, exercises, misc_routes, imports, admin
 
 main_router_v1 = APIRouter()
 
@@ -9,3 +10,6 @@ main_router_v1.include_router(auth.router, tags=["auth"])
 main_router_v1.include_router(users.router, prefix="/users", tags=["users"])
 main_router_v1.include_router(workouts.router, prefix="/workout", tags=["workouts"])
 main_router_v1.include_router(exercises.router, prefix="/exercise", tags=["exercises"])
+main_router_v1.include_router(imports.router, prefix="/import", tags=["import"])
+main_router_v1.include_router(admin.router, prefix="/admin", tags=["admin"],
+                               dependencies=[Depends(verify_admin)])
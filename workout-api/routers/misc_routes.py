@@ -2,8 +2,12 @@
 misc_routes.py is a file that contains all the miscellaneous routes that are not related to the main routes of the application.
 """
 from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from cache import response_cache
+from metrics import registry
+from repository.auth import verify_admin
 from repository.utils import get_schema
 from routers.utils import get_db
 
@@ -25,4 +29,24 @@ async def get_db_schema(db: AsyncSession = Depends(get_db)):
     Returns: The schema version.
     """
     result = await get_schema(db=db)
-    return result
\ No newline at end of file
+    return result
+
+
+@router.get("/cache/stats", status_code=200, dependencies=[Depends(verify_admin)])
+async def get_cache_stats():
+    """
+    Function to get the response cache statistics (hit ratio, evictions), protected by the X-Admin-Token header.
+    Returns: The cache statistics.
+    """
+    return response_cache.stats()
+
+
+@router.get("/metrics", status_code=200, response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Function to get the metrics in the Prometheus text format
+    (route latency, in-flight requests, database pool, tracking sockets and repository errors).
+    Rendered on the event loop, which is the only writer of the metrics.
+    Returns: The metrics.
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
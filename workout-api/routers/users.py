@@ -5,6 +5,7 @@ Routes are configured for the users endpoints.
 from fastapi import APIRouter, Depends
 
 from dtos import CreateUserDTO, UpdateUserDTO, GetUserDTO
+from json_response import FastJSONResponse
 from repository.users import create_new_user, update_user, get_user
 from routers.utils import get_db, AsyncSession
 from schemas import CreatedResponse
@@ -23,7 +24,7 @@ async def post(user: CreateUserDTO, db: AsyncSession = Depends(get_db)):
     user_data = user.model_dump()
     new_user = await create_new_user(user_data=user_data, db=db)
     result = CreatedResponse(status=True, message="User created successfully.", data=new_user.id)
-    return result
+    return FastJSONResponse(result.model_dump())
 
 
 @router.put("/{user_id}", response_model=CreatedResponse)
@@ -36,7 +37,7 @@ async def update(user_data: UpdateUserDTO, db: AsyncSession = Depends(get_db), u
     """
     updated_user = await update_user(user_data=user_data, user_id=user_id, requester_id=user_id, db=db)
     result = CreatedResponse(status=True, message="User updated successfully.", data=updated_user.id)
-    return result
+    return FastJSONResponse(result.model_dump())
 
 
 @router.get("/{user_id}", response_model=GetUserDTO)
@@ -49,4 +50,4 @@ async def get(user_id: int = None, db: AsyncSession = Depends(get_db)):
     """
     user = await get_user(user_id=user_id, db=db)
     result = GetUserDTO(id=user.id, name=user.name, username=user.username, age=user.age, email=user.email)
-    return result
+    return FastJSONResponse(result.model_dump())
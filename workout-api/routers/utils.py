@@ -16,3 +16,22 @@ async def get_db() -> AsyncSession:
             yield session
         finally:
             await session.close()
+
+
+def get_session_factory():
+    """
+    Provides the session factory for work that outlives the request (background jobs).
+    """
+    return async_session
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    Checks if the ETag is listed in the If-None-Match request header.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    candidates = (candidate.strip().removeprefix('W/') for candidate in if_none_match.split(','))
+    return etag in candidates
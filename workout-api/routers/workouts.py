@@ -1,9 +1,13 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Header, Response
 
-from dtos import UpdateWorkoutDTO, CreateWorkoutDTO
+from cache import response_cache, workout_scope
+from dtos import UpdateWorkoutDTO, CreateWorkoutDTO, CreateWorkoutWithExercisesDTO
+from json_response import FastJSONResponse
 from repository.auth import get_current_user
-from repository.workouts import create_new_workout, update_workout, get_workouts, get_workout, delete_workout
-from routers.utils import get_db, AsyncSession
+from repository.fieldsets import parse_fields, fields_variant
+from repository.workouts import create_new_workout, update_workout, get_workouts, get_workout, delete_workout, \
+    create_new_workout_with_exercises, get_workout_version, get_workout_document
+from routers.utils import get_db, etag_matches, AsyncSession
 
 router = APIRouter()
 
@@ -35,6 +39,22 @@ async def post(workout_data: CreateWorkoutDTO, db: AsyncSession = Depends(get_db
     return await create_new_workout(workout_data=workout_data_dump, user_id=user_id, db=db)
 
 
+@router.post("/create/bulk", status_code=201)
+async def post_bulk(workout_data: CreateWorkoutWithExercisesDTO, db: AsyncSession = Depends(get_db),
+                    user_id: int = Depends(get_current_user_id)):
+    """
+    Function to create a new workout with its exercises (and optionally their tracking rooms) in one request.
+    Args:
+        workout_data:
+        user_id:
+        db:
+
+    Returns: The new workout, exercises and tracking data ids.
+    """
+    workout_data_dump = workout_data.model_dump()
+    return await create_new_workout_with_exercises(workout_data=workout_data_dump, user_id=user_id, db=db)
+
+
 @router.patch("/{workout_id}", status_code=200)
 async def update(workout_data: UpdateWorkoutDTO, db: AsyncSession = Depends(get_db),
                  user_id: int = Depends(get_current_user_id), workout_id: int = None):
@@ -63,22 +83,58 @@ async def get(db: AsyncSession = Depends(get_db), user_id: int = Depends(get_cur
     Returns: workout list.
     """
     workout_results = await get_workouts(db=db, user_id=user_id)
-    return workout_results
+    return FastJSONResponse(workout_results)
 
 
 @router.get("/{workout_id}", status_code=200)
-async def get(workout_id: int, db: AsyncSession = Depends(get_db), user_id: int = Depends(get_current_user_id)):
+async def get(workout_id: int, db: AsyncSession = Depends(get_db),
+              user_id: int = Depends(get_current_user_id), if_none_match: str | None = Header(None),
+              fields: str | None = None):
     """
-    Function to get a workout.
+    Function to get a workout (cached). Supports conditional requests through the ETag/If-None-Match headers.
     Args:
         user_id:
         workout_id:
         db:
+        if_none_match:
+        fields: optional sparse fieldset, e.g. "id,calories,exercises(name,calories)".
+
+    Returns: The specified workout info (or 304 if it did not change).
+    """
+    selection = parse_fields(fields)
+    variant = fields_variant(selection)
+
+    headers = {}
+    version = await get_workout_version(db=db, workout_id=workout_id, user_id=user_id)
+    if version is not None:
+        etag = f'"workout-{workout_id}-{version}{"-" + variant if variant else ""}"'
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        headers["ETag"] = etag
+
+    workout = await response_cache.get_or_load(
+        workout_scope(workout_id), user_id,
+        lambda: get_workout(db=db, workout_id=workout_id, user_id=user_id, fields=selection),
+        variant=variant, version=version
+    )
+    return Response(content=workout, media_type="application/json", headers=headers)
+
+
+@router.get("/{workout_id}/document", status_code=200)
+async def get_document(workout_id: int, db: AsyncSession = Depends(get_db),
+                       user_id: int = Depends(get_current_user_id)):
+    """
+    Function to get a workout with its exercises and their tracking summaries.
+    The JSON document is rendered by the database and passed through as is.
+    Args:
+        workout_id:
+        db:
+        user_id:
 
-    Returns: The specified workout info.
+    Returns: The workout document.
     """
-    workout = await get_workout(db=db, workout_id=workout_id, user_id=user_id)
-    return workout
+    document = await get_workout_document(db=db, workout_id=workout_id, user_id=user_id)
+    return Response(content=document, media_type="application/json")
 
 
 @router.delete("/{workout_id}", status_code=200)
@@ -2,6 +2,8 @@
 This module contains the settings for the application.
 from .env file
 """
+import os
+
 from dotenv import dotenv_values
 
 config = dotenv_values(".env") or dotenv_values("../.env")
@@ -17,7 +19,63 @@ test_database = config.get("TEST_DATABASE") or 'test_workout_db'
 test_user = config.get("TEST_DB_USER") or 'test_user'
 test_password = config.get("TEST_DB_PASSWORD") or 'test_password'
 
-connection_string = f"postgresql+asyncpg://{user}:{password}@{HOST}/{database}"
-test_connection_string = f"postgresql+asyncpg://{test_user}:{test_password}@{HOST}:5433/{test_database}"
+# database backend ("postgresql" or "sqlite"), the environment overrides the .env file to switch the suites
+# SQLite paths are files or ":memory:" (an in-memory database is migrated when the engine starts)
+DB_BACKEND = (os.environ.get("DB_BACKEND") or config.get("DB_BACKEND") or 'postgresql').lower()
+SQLITE_PATH = os.environ.get("SQLITE_PATH") or config.get("SQLITE_PATH") or 'workout.db'
+TEST_SQLITE_PATH = os.environ.get("TEST_SQLITE_PATH") or config.get("TEST_SQLITE_PATH") or ':memory:'
+
+if DB_BACKEND == 'sqlite':
+    connection_string = f"sqlite+aiosqlite:///{SQLITE_PATH}"
+    test_connection_string = f"sqlite+aiosqlite:///{TEST_SQLITE_PATH}"
+else:
+    connection_string = f"postgresql+asyncpg://{user}:{password}@{HOST}/{database}"
+    test_connection_string = f"postgresql+asyncpg://{test_user}:{test_password}@{HOST}:5433/{test_database}"
 
 SECRET_KEY = config.get("SECRET_KEY")
+
+# route analytics (process pool)
+ANALYTICS_MAX_WORKERS = int(config.get("ANALYTICS_MAX_WORKERS") or 2)
+ANALYTICS_MAX_CONCURRENT_JOBS = int(config.get("ANALYTICS_MAX_CONCURRENT_JOBS") or 4)
+ANALYTICS_JOB_TIMEOUT = float(config.get("ANALYTICS_JOB_TIMEOUT") or 10)
+
+# bulk imports
+IMPORT_BATCH_SIZE = int(config.get("IMPORT_BATCH_SIZE") or 1000)
+IMPORT_MAX_JOBS = int(config.get("IMPORT_MAX_JOBS") or 100)
+# imports running at the same time, the next uploads get a 429 until one of them ends
+IMPORT_MAX_RUNNING = int(config.get("IMPORT_MAX_RUNNING") or 4)
+
+# tracking points write-behind buffer (group commit every INGEST_FLUSH_INTERVAL_MS or INGEST_BATCH_SIZE points,
+# the sockets wait when INGEST_MAX_PENDING points are not flushed yet)
+INGEST_FLUSH_INTERVAL_MS = float(config.get("INGEST_FLUSH_INTERVAL_MS") or 5)
+INGEST_BATCH_SIZE = int(config.get("INGEST_BATCH_SIZE") or 500)
+INGEST_MAX_PENDING = int(config.get("INGEST_MAX_PENDING") or 10000)
+
+# response cache ("memory" or "external", CACHE_URL points to the external server)
+CACHE_BACKEND = config.get("CACHE_BACKEND") or 'memory'
+CACHE_URL = config.get("CACHE_URL")
+CACHE_MAX_ENTRIES = int(config.get("CACHE_MAX_ENTRIES") or 1024)
+CACHE_TTL = int(config.get("CACHE_TTL") or 300)
+
+# SQL instrumentation (slow statement log threshold and repeated statements reported as N+1)
+SLOW_QUERY_MS = float(config.get("SLOW_QUERY_MS") or 100)
+N_PLUS_ONE_THRESHOLD = int(config.get("N_PLUS_ONE_THRESHOLD") or 10)
+
+# admin endpoints (disabled when no token is configured)
+ADMIN_TOKEN = config.get("ADMIN_TOKEN")
+
+# sampling profiler (PROFILE_SAMPLE_RATE is the fraction of requests profiled without the X-Profile header)
+PROFILE_SAMPLE_RATE = float(config.get("PROFILE_SAMPLE_RATE") or 0)
+PROFILE_INTERVAL_MS = float(config.get("PROFILE_INTERVAL_MS") or 5)
+PROFILE_MAX_STORED = int(config.get("PROFILE_MAX_STORED") or 20)
+
+# event loop lag monitor (heartbeat interval and stall threshold)
+LOOP_LAG_INTERVAL_MS = float(config.get("LOOP_LAG_INTERVAL_MS") or 100)
+LOOP_LAG_THRESHOLD_MS = float(config.get("LOOP_LAG_THRESHOLD_MS") or 250)
+
+# logging ("json" or "text" format, the queue drop policy is "drop_new" or "drop_oldest")
+LOG_LEVEL = (config.get("LOG_LEVEL") or 'INFO').upper()
+LOG_FORMAT = config.get("LOG_FORMAT") or 'json'
+LOG_QUEUE_SIZE = int(config.get("LOG_QUEUE_SIZE") or 10000)
+LOG_BATCH_SIZE = int(config.get("LOG_BATCH_SIZE") or 100)
+LOG_DROP_POLICY = config.get("LOG_DROP_POLICY") or 'drop_new'
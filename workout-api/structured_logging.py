@@ -0,0 +1,225 @@
+"""
+structured_logging.py
+Module with the non-blocking logging pipeline. Log calls only put the record in a bounded queue,
+a background thread formats the records (JSON lines by default, tracebacks included) and writes them in batches.
+When the queue is full, records are dropped following LOG_DROP_POLICY instead of blocking the event loop.
+Also contains the access log middleware (route, status, latency and query counts of every request).
+"""
+import logging
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from instrumentation import current_query_stats
+from json_response import dump_json
+from metrics import registry, route_template, Counter
+from settings import LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE, LOG_BATCH_SIZE, LOG_DROP_POLICY
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+# attributes of every LogRecord, anything else was passed in "extra"
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+STOP = object()
+
+access_logger = logging.getLogger("workout_api.access")
+# records of the pipeline itself, written by the last resort handler once the pipeline is stopped
+pipeline_logger = logging.getLogger("workout_api.logging")
+
+log_records_dropped = registry.register(Counter(
+    'log_records_dropped_total', 'Log records dropped because the logging queue was full.', ('level',)
+))
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formatter of JSON lines with the record fields and its "extra" fields.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return dump_json(entry).decode()
+
+
+class NonBlockingQueueHandler(logging.Handler):
+    """
+    Handler that puts the records in a bounded queue without waiting.
+    Unlike logging.handlers.QueueHandler, the traceback formatting is left to the writer thread.
+    """
+
+    def __init__(self, log_queue: queue.Queue, drop_policy: str = 'drop_new'):
+        super().__init__()
+        self.queue = log_queue
+        self.drop_policy = drop_policy
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            # the arguments could change before the writer thread formats the record
+            record.msg = record.getMessage()
+            record.args = None
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+            return
+
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+
+        if self.drop_policy == 'drop_oldest':
+            try:
+                dropped = self.queue.get_nowait()
+                log_records_dropped.inc(dropped.levelname)
+                self.queue.put_nowait(record)
+                return
+            except (queue.Empty, queue.Full):
+                pass
+        log_records_dropped.inc(record.levelname)
+
+
+class BatchingLogWriter(threading.Thread):
+    """
+    Thread that formats the queued records and writes them in batches.
+    """
+
+    def __init__(self, log_queue: queue.Queue, stream, formatter: logging.Formatter, batch_size: int):
+        super().__init__(name="log-writer", daemon=True)
+        self.queue = log_queue
+        self.stream = stream
+        self.formatter = formatter
+        self.batch_size = batch_size
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines = [self.format(record) for record in batch if record is not STOP]
+            if lines:
+                self.stream.write('\n'.join(lines) + '\n')
+                self.stream.flush()
+            if any(record is STOP for record in batch):
+                return
+
+    def format(self, record) -> str:
+        try:
+            return self.formatter.format(record)
+        except Exception as error:  # pylint: disable=broad-except
+            return f"Unable to format the log record {record.msg!r}: {error!r}"
+
+
+class LoggingPipeline:
+    """
+    Class to install and stop the logging pipeline.
+    """
+
+    def __init__(self):
+        self.handler = None
+        self.writer = None
+
+    def start(self, stream=None):
+        """
+        Function to replace the root logger handlers with the queue handler and start the writer thread.
+        """
+        if self.writer is not None:
+            return
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        formatter = JSONFormatter() if LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT)
+        self.writer = BatchingLogWriter(log_queue, stream or sys.stderr, formatter, LOG_BATCH_SIZE)
+        self.writer.start()
+
+        self.handler = NonBlockingQueueHandler(log_queue, drop_policy=LOG_DROP_POLICY)
+        root_logger = logging.getLogger()
+        root_logger.handlers = [self.handler]
+        root_logger.setLevel(LOG_LEVEL)
+
+    def stop(self, timeout: float = 5):
+        """
+        Function to write the pending records and stop the writer thread.
+        A writer stuck on its stream does not block the shutdown: after the timeout the queued records are dropped
+        (and reported).
+        """
+        if self.writer is None:
+            return
+        logging.getLogger().removeHandler(self.handler)
+        deadline = time.monotonic() + timeout
+        try:
+            self.writer.queue.put(STOP, timeout=timeout)
+            self.writer.join(timeout=max(deadline - time.monotonic(), 0))
+        except queue.Full:
+            pass
+
+        if self.writer.is_alive():
+            dropped = 0
+            while True:
+                try:
+                    record = self.writer.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is not STOP:
+                    log_records_dropped.inc(record.levelname)
+                    dropped += 1
+            pipeline_logger.warning("The log writer did not stop in %s s, %d queued log records were dropped.",
+                                    timeout, dropped)
+        self.handler = None
+        self.writer = None
+
+
+class AccessLogMiddleware:
+    """
+    ASGI middleware that writes an access log record per HTTP request.
+    It must run inside QueryStatsMiddleware to report the query counts.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        start_time = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            if access_logger.isEnabledFor(logging.INFO):
+                latency_ms = (time.perf_counter() - start_time) * 1000
+                stats = current_query_stats.get()
+                access_logger.info("%s %s %s", scope["method"], scope["path"], status_code, extra={
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "route": route_template(scope),
+                    "status": status_code,
+                    "latency_ms": round(latency_ms, 2),
+                    "db_queries": stats.count if stats else 0,
+                    "db_time_ms": round(stats.total_time * 1000, 2) if stats else 0,
+                })
+
+
+logging_pipeline = LoggingPipeline()
@@ -3,13 +3,18 @@ conftest.py
 - This file is used to configure the tests for the workout-api
 """
 import asyncio
+import pytest
 import pytest_asyncio
 import sqlalchemy as sa
+from fastapi.testclient import TestClient
 from httpx import AsyncClient, ASGITransport
-from db_context import test_async_session
+from db_context import test_async_session, test_db_engine, prepare_database
 from app import app
+import repository.auth
 from models import User, Workout
-from routers.utils import get_db, AsyncSession
+from routers.utils import get_db, get_session_factory, AsyncSession
+
+ADMIN_TOKEN = "test-admin-token"
 
 async def replace_db() -> AsyncSession:
     """
@@ -38,6 +43,7 @@ async def test_client():
     Fixture to create a test client. override the db session with the test db session.
     """
     app.dependency_overrides[get_db] = replace_db
+    app.dependency_overrides[get_session_factory] = lambda: test_async_session
     async with AsyncClient(
             transport=ASGITransport(app=app),
             base_url="http://testserver"
@@ -45,6 +51,26 @@ async def test_client():
         yield _test_client
 
 
+@pytest_asyncio.fixture(scope="session")
+def sync_client(test_client):
+    """
+    Fixture to create a test client running the app lifespan (needed by the websockets: the tracking points
+    buffer is started by the lifespan, with the test db session factory of the overrides).
+    """
+    app.state.session_factory = test_async_session
+    with TestClient(app) as _sync_client:
+        yield _sync_client
+
+
+@pytest.fixture(name="admin_headers")
+def admin_headers_fixture(monkeypatch):
+    """
+    Fixture to enable the admin endpoints with a test token.
+    """
+    monkeypatch.setattr(repository.auth, "ADMIN_TOKEN", ADMIN_TOKEN)
+    return {"X-Admin-Token": ADMIN_TOKEN}
+
+
 @pytest_asyncio.fixture(name="db", scope="session")
 async def db_fixture() -> AsyncSession:
     """
@@ -60,6 +86,7 @@ async def clean_test_db(db: AsyncSession):
     """
     Fixture to clean the test db before each test run.
     """
+    await prepare_database(test_db_engine)
     query = sa.delete(User).where(User.id > 1)
     await db.execute(query)
     await db.commit()
@@ -0,0 +1,118 @@
+"""
+test_admin.py
+This module contains the tests for the admin (diagnostics) endpoints.
+"""
+import time
+
+import pytest
+
+import profiling
+from loop_monitor import loop_monitor
+
+BASE_URL = "api/v1/admin"
+
+
+async def test_admin_requires_token(test_client, admin_headers):
+    """
+    Function to test that the admin endpoints reject a missing or wrong token.
+    """
+    missing_token_response = await test_client.get(f"{BASE_URL}/profiles")
+    wrong_token_response = await test_client.get(f"{BASE_URL}/profiles", headers={"X-Admin-Token": "wrong"})
+    response = await test_client.get(f"{BASE_URL}/profiles", headers=admin_headers)
+
+    assert missing_token_response.status_code == 403
+    assert wrong_token_response.status_code == 403
+    assert response.status_code == 200
+
+
+async def test_request_profile(test_client, admin_headers):
+    """
+    Function to test the profiling of a request and the profile downloads.
+    """
+    response = await test_client.get("/api/v1/schema", headers={**admin_headers, "X-Profile": "1"})
+    profile_id = response.headers["X-Profile-Id"]
+
+    not_profiled_response = await test_client.get("/api/v1/schema", headers={"X-Profile": "1"})
+    assert "X-Profile-Id" not in not_profiled_response.headers
+
+    profiles = (await test_client.get(f"{BASE_URL}/profiles", headers=admin_headers)).json()
+    assert profiles[0]["id"] == profile_id
+    assert profiles[0]["path"] == "/api/v1/schema"
+
+    speedscope_response = await test_client.get(f"{BASE_URL}/profiles/{profile_id}", headers=admin_headers)
+    assert speedscope_response.status_code == 200
+    assert speedscope_response.json()["profiles"][0]["type"] == "sampled"
+
+    collapsed_response = await test_client.get(f"{BASE_URL}/profiles/{profile_id}?profile_format=collapsed",
+                                               headers=admin_headers)
+    assert collapsed_response.status_code == 200
+    assert collapsed_response.headers["content-type"].startswith("text/plain")
+
+    missing_response = await test_client.get(f"{BASE_URL}/profiles/unknown", headers=admin_headers)
+    assert missing_response.status_code == 404
+
+
+async def test_sampled_profile(test_client, admin_headers, monkeypatch):
+    """
+    Function to test that the sampled requests only return the profile id to the admin clients.
+    """
+    monkeypatch.setattr(profiling, "PROFILE_SAMPLE_RATE", 1.0)
+
+    response = await test_client.get("/api/v1/schema")
+    admin_response = await test_client.get("/api/v1/schema", headers=admin_headers)
+
+    assert "X-Profile-Id" not in response.headers
+    profiles = (await test_client.get(f"{BASE_URL}/profiles", headers=admin_headers)).json()
+    assert [profile["path"] for profile in profiles[:2]] == ["/api/v1/schema", "/api/v1/schema"]
+    assert profiles[0]["id"] == admin_response.headers["X-Profile-Id"]
+
+
+def block_event_loop():
+    """
+    Function to block the event loop of the app over the stall threshold.
+    """
+    time.sleep(loop_monitor.threshold + loop_monitor.interval * 3)
+
+
+async def test_loop_stalls(sync_client, admin_headers):
+    """
+    Function to test that a blocking call on the event loop is captured with its stack.
+    """
+    # the lifespan of the sync client runs the monitor, the portal runs the call in the event loop thread
+    sync_client.portal.call(block_event_loop)
+    response = sync_client.get(f"{BASE_URL}/loop/stalls", headers=admin_headers)
+
+    assert response.status_code == 200
+    stalls = response.json()["stalls"]
+    assert stalls
+    assert stalls[0]["blocked_for"] >= loop_monitor.threshold
+    assert "block_event_loop" in stalls[0]["stack"]
+    assert response.json()["lag_quantiles"]
+
+
+async def test_memory_snapshots(test_client, admin_headers):
+    """
+    Function to test the tracemalloc snapshots and diffs.
+    """
+    not_started_response = await test_client.post(f"{BASE_URL}/memory/snapshots", headers=admin_headers)
+    assert not_started_response.status_code == 409
+
+    tracing_response = await test_client.post(f"{BASE_URL}/memory/tracing", headers=admin_headers)
+    assert tracing_response.json()["tracing"] is True
+
+    try:
+        first_snapshot = (await test_client.post(f"{BASE_URL}/memory/snapshots", headers=admin_headers)).json()
+        await test_client.get("/api/v1/schema")
+        second_snapshot = (await test_client.post(f"{BASE_URL}/memory/snapshots", headers=admin_headers)).json()
+
+        diff_response = await test_client.get(f"{BASE_URL}/memory/snapshots/{second_snapshot['id']}/diff",
+                                              headers=admin_headers)
+        assert diff_response.status_code == 200
+        assert diff_response.json()["base_id"] == first_snapshot["id"]
+
+        status_response = await test_client.get(f"{BASE_URL}/memory", headers=admin_headers)
+        assert isinstance(status_response.json()["sessions"], list)
+    finally:
+        stop_response = await test_client.delete(f"{BASE_URL}/memory/tracing", headers=admin_headers)
+
+    assert stop_response.json()["tracing"] is False
@@ -2,15 +2,28 @@
 test_workouts.py
 This module contains the tests for the workouts endpoints.
 """
+import asyncio
 import random
 import re
-from fastapi.testclient import TestClient
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import pytest
+import sqlalchemy as sa
+from fastapi import HTTPException
+from sqlalchemy import event
 from starlette.websockets import WebSocketDisconnect
 
-from conftest import app
-from test_utils import get_test_token, Headers
+import analytics
+import routers.exercises
+from analytics import RouteAnalyticsExecutor, SharedRoute
+from db_context import test_async_session, test_db_engine
+from models import MapPoint, TrackingData
+from repository.exercise import create_tracking_map_point, update_exercise_tracking_data
+from repository.utils import tracking_ws_handler, transaction_scope, after_commit
+from test_utils import get_test_token, assert_query_budget, Headers
 
-sync_client = TestClient(app)
 BASE_URL = "api/v1/exercise"
 WORKOUT_BASE_URL = "api/v1/workout"
 USER_BASE_URL = "api/v1/users"
@@ -50,7 +63,7 @@ async def get_exercise_id(test_client, exercise_data):
     return workout_id
 
 
-def test_ping():
+def test_ping(sync_client):
     response = sync_client.get("api/v1/")
     assert response.status_code == 200
     assert response.json() == {"message": "Welcome to the Workout API"}
@@ -92,6 +105,78 @@ async def test_get_exercises(test_client):
     assert unauthorized_response.status_code == 401
 
 
+async def test_get_exercises_conditional(test_client):
+    """
+    Function to test the ETag support of the get Exercises endpoint.
+    Args:
+        test_client:
+
+    Returns: The test result.
+    """
+    header.token = await get_test_token(test_client, base_url=USER_BASE_URL, user_data=test_user)
+    workout_data = {
+        "user_id": random.randint(1, 100),
+        "workout_type": "cardio",
+        "duration": 60,
+        "calories": 4000,
+    }
+    workout_id = await get_workout_id(test_client, workout_data)
+
+    response = await test_client.get(f"{BASE_URL}/list/{workout_id}", headers=header.headers)
+    etag = response.headers["ETag"]
+
+    not_modified_response = await test_client.get(f"{BASE_URL}/list/{workout_id}",
+                                                  headers={**header.headers, "If-None-Match": etag})
+    assert not_modified_response.status_code == 304
+
+    exercise_data = {
+        "workout_id": workout_id,
+        "name": "run 10 miles",
+        "exercise_type": "run",
+        "duration": 10,
+        "calories": 3
+    }
+    await get_exercise_id(test_client, exercise_data)
+
+    modified_response = await test_client.get(f"{BASE_URL}/list/{workout_id}",
+                                              headers={**header.headers, "If-None-Match": etag})
+    assert modified_response.status_code == 200
+    assert len(modified_response.json()['data']) == 1
+
+
+async def test_get_exercises_fields(test_client):
+    """
+    Function to test the sparse fieldsets of the get Exercises endpoint.
+    Args:
+        test_client:
+
+    Returns: The test result.
+    """
+    header.token = await get_test_token(test_client, base_url=USER_BASE_URL, user_data=test_user)
+    workout_data = {
+        "user_id": random.randint(1, 100),
+        "workout_type": "cardio",
+        "duration": 60,
+        "calories": 4000,
+    }
+    workout_id = await get_workout_id(test_client, workout_data)
+    exercise_data = {
+        "workout_id": workout_id,
+        "name": "run 10 miles",
+        "exercise_type": "run",
+        "duration": 10,
+        "calories": 3
+    }
+    await get_exercise_id(test_client, exercise_data)
+
+    response = await test_client.get(f"{BASE_URL}/list/{workout_id}?fields=name,calories", headers=header.headers)
+    invalid_response = await test_client.get(f"{BASE_URL}/list/{workout_id}?fields=name(", headers=header.headers)
+
+    assert response.status_code == 200
+    assert response.json()['data'] == [{"name": "run 10 miles", "calories": 3}]
+    assert invalid_response.status_code == 400
+
+
 async def test_get_exercise(test_client):
     """
     Function to test the get Exercise endpoint.
@@ -325,16 +410,18 @@ async def test_get_tracking_data_list(test_client):
     if response.status_code != 204 and isinstance(response.json(), dict):
         assert response.status_code == 200
         assert isinstance(response.json()['data'], list)
+        assert_query_budget(response, 2)
 
     unauthorized_response = await test_client.get(f"{BASE_URL}/tracking/list/{exercise_id}")
     assert unauthorized_response.status_code == 401
 
 
-async def test_start_tracking(test_client):
+async def test_start_tracking(test_client, sync_client):
     """
     Function to test the start tracking endpoint.
     Args:
         test_client:
+        sync_client:
 
     Returns: The test result.
     """
@@ -370,4 +457,481 @@ async def test_start_tracking(test_client):
             assert data['status'] == True
             assert data['message'] == "The tracking has started."
         except WebSocketDisconnect:
-            assert True
\ No newline at end of file
+            assert True
+
+async def test_get_live_tracking(test_client, sync_client):
+    """
+    Function to test the live tracking state of a room with a connected websocket.
+    Args:
+        test_client:
+        sync_client:
+
+    Returns: The test result.
+    """
+    header.token = await get_test_token(test_client, base_url=USER_BASE_URL, user_data=test_user)
+    workout_data = {
+        "user_id": random.randint(1, 100),
+        "workout_type": "cardio",
+        "duration": 60,
+        "calories": 400,
+    }
+    workout_id = await get_workout_id(test_client, workout_data)
+
+    exercise_data = {
+        "workout_id": workout_id,
+        "name": "live run",
+        "exercise_type": "run",
+        "duration": 10,
+        "calories": 3
+    }
+    exercise_id = await get_exercise_id(test_client, exercise_data)
+
+    response = await test_client.post(f"{BASE_URL}/tracking/{exercise_id}", json={"duration": 0, "description": "live"},
+                                      headers=header.headers)
+    tracking_data_id = re.search(r'Tracking data (\d+) added successfully.', response.json()['message']).group(1)
+
+    with sync_client.websocket_connect(f"{BASE_URL}/ws/tracking/{tracking_data_id}") as websocket:
+        assert websocket.receive_json()['message'] == "The tracking has started."
+        assert websocket.receive_json()['last_seq'] is None
+        websocket.send_json({"map_point": {"lat": 40.0, "lon": -3.0, "seq": 1}})
+        first_point = websocket.receive_json()
+        websocket.send_json({"map_point": {"lat": 40.001, "lon": -3.0, "seq": 2}})
+        second_point = websocket.receive_json()
+
+        assert second_point['map_point_id'] > first_point['map_point_id']
+        assert second_point['live']['points'] == 2
+        assert 110 < second_point['live']['distance'] < 112
+
+        response = sync_client.get(f"{BASE_URL}/tracking/live/{tracking_data_id}", headers=header.headers)
+        assert response.status_code == 200
+        live_data = response.json()['data']
+        assert [point['id'] for point in live_data['route']] == [first_point['map_point_id'],
+                                                                 second_point['map_point_id']]
+        assert live_data['live']['last_fix']['latitude'] == 40.001
+
+    # the room state is dropped with its last socket
+    response = await test_client.get(f"{BASE_URL}/tracking/live/{tracking_data_id}", headers=header.headers)
+    assert response.status_code == 404
+
+
+async def test_resume_tracking(test_client, sync_client):
+    """
+    Function to test that a reconnecting client gets the last stored sequence number and that resent points
+    are stored once.
+    Args:
+        test_client:
+        sync_client:
+
+    Returns: The test result.
+    """
+    header.token = await get_test_token(test_client, base_url=USER_BASE_URL, user_data=test_user)
+    workout_data = {
+        "user_id": random.randint(1, 100),
+        "workout_type": "cardio",
+        "duration": 60,
+        "calories": 400,
+    }
+    workout_id = await get_workout_id(test_client, workout_data)
+    exercise_data = {
+        "workout_id": workout_id,
+        "name": "resumed run",
+        "exercise_type": "run",
+        "duration": 10,
+        "calories": 3
+    }
+    exercise_id = await get_exercise_id(test_client, exercise_data)
+    response = await test_client.post(f"{BASE_URL}/tracking/{exercise_id}",
+                                      json={"duration": 0, "description": "resumed"}, headers=header.headers)
+    tracking_data_id = re.search(r'Tracking data (\d+) added successfully.', response.json()['message']).group(1)
+    tracking_url = f"{BASE_URL}/ws/tracking/{tracking_data_id}"
+
+    with sync_client.websocket_connect(tracking_url) as websocket:
+        websocket.receive_json()
+        websocket.receive_json()
+        for seq in (1, 2, 3):
+            websocket.send_json({"map_point": {"lat": 40.0 + seq / 1000, "lon": -3.0, "seq": seq}})
+            assert websocket.receive_json()['map_point_id']
+
+    with sync_client.websocket_connect(tracking_url) as websocket:
+        websocket.receive_json()
+        assert websocket.receive_json()['last_seq'] == 3
+        websocket.send_json({"map_point": {"lat": 40.003, "lon": -3.0, "seq": 3}})
+        assert websocket.receive_json()['message'] == "The point is already stored."
+        websocket.send_json({"map_point": {"lat": 40.004, "lon": -3.0, "seq": 4}})
+        assert websocket.receive_json()['live']['points'] == 4
+
+
+async def test_tracking_invalid_messages(test_client, sync_client):
+    """
+    Function to test that the invalid tracking messages are answered without closing the socket,
+    and that a closed socket leaves no state behind.
+    Args:
+        test_client:
+        sync_client:
+
+    Returns: The test result.
+    """
+    header.token = await get_test_token(test_client, base_url=USER_BASE_URL, user_data=test_user)
+    workout_data = {
+        "user_id": random.randint(1, 100),
+        "workout_type": "cardio",
+        "duration": 60,
+        "calories": 400,
+    }
+    workout_id = await get_workout_id(test_client, workout_data)
+    exercise_data = {
+        "workout_id": workout_id,
+        "name": "invalid run",
+        "exercise_type": "run",
+        "duration": 10,
+        "calories": 3
+    }
+    exercise_id = await get_exercise_id(test_client, exercise_data)
+    response = await test_client.post(f"{BASE_URL}/tracking/{exercise_id}",
+                                      json={"duration": 0, "description": "invalid"}, headers=header.headers)
+    tracking_data_id = int(re.search(r'Tracking data (\d+) added successfully.', response.json()['message']).group(1))
+
+    with sync_client.websocket_connect(f"{BASE_URL}/ws/tracking/{tracking_data_id}") as websocket:
+        websocket.receive_json()
+        websocket.receive_json()
+        websocket.send_text("not json")
+        assert websocket.receive_json() == {"status": False, "message": "Invalid tracking message.",
+                                            "tracking_data_id": tracking_data_id}
+        for message in ([1, 2], {"lat": 40.0}, {"map_point": {"lat": 40.0}},
+                        {"map_point": {"lat": 40.0, "lon": -3.0}, "update_tracking_data": True},
+                        {"map_point": {"lat": "40.0", "lon": -3.0}},
+                        {"map_point": {"lat": 40.0, "lon": -3.0, "seq": "1"}},
+                        {"map_point": {"lat": 40.0, "lon": -3.0, "seq": 1.0}},
+                        {"map_point": {"lat": 40.0, "lon": -3.0, "seq": -1}}):
+            websocket.send_json(message)
+            assert websocket.receive_json()['message'] == "Invalid tracking message."
+
+        websocket.send_json({"map_point": {"lat": 40.0, "lon": -3.0, "seq": 1}})
+        assert websocket.receive_json()['live']['points'] == 1
+
+    assert tracking_data_id not in tracking_ws_handler.rooms
+    assert tracking_data_id not in tracking_ws_handler.live_rooms
+
+    with sync_client.websocket_connect(f"{BASE_URL}/ws/tracking/454543") as websocket:
+        try:
+            websocket.receive_json()
+            assert False
+        except WebSocketDisconnect as error:
+            assert error.code == 1008
+    assert 454543 not in tracking_ws_handler.rooms
+    assert not tracking_ws_handler.active_connections
+
+
+def test_route_analytics_release_after_loop_closed(monkeypatch):
+    """
+    Function to test that the shared memory of a route is freed when its job finishes after the event loop closed.
+    Args:
+        monkeypatch:
+
+    Returns: The test result.
+    """
+    job_started = threading.Event()
+    finish_job = threading.Event()
+
+    def blocking_distance(_lats, _lons):
+        job_started.set()
+        finish_job.wait(5)
+        return 0.0
+
+    monkeypatch.setitem(analytics.ROUTE_JOBS, "distance", blocking_distance)
+    executor = RouteAnalyticsExecutor(max_workers=1, max_concurrent_jobs=1, timeout=5)
+    # a thread pool runs the jobs in this process, with the patched job
+    executor._executor = ThreadPoolExecutor(max_workers=1)
+    route = SharedRoute([40.0, 40.001], [-3.0, -3.0])
+
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(executor.submit("distance", route))
+    loop.run_until_complete(loop.run_in_executor(None, job_started.wait, 5))
+    # the request is gone with the loop: neither the owner nor the job release the route on it
+    task.cancel()
+    loop.run_until_complete(asyncio.gather(task, return_exceptions=True))
+    loop.close()
+    finish_job.set()
+    executor._executor.shutdown(wait=True)
+
+    assert route.unlinked
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=route.name)
+
+
+async def create_tracking_room(test_client, name: str):
+    """
+    Function to create a workout with an exercise and its tracking room.
+    Args:
+        test_client:
+        name:
+
+    Returns: The exercise id and the tracking data id.
+    """
+    header.token = await get_test_token(test_client, base_url=USER_BASE_URL, user_data=test_user)
+    workout_data = {
+        "user_id": random.randint(1, 100),
+        "workout_type": "cardio",
+        "duration": 60,
+        "calories": 400,
+    }
+    workout_id = await get_workout_id(test_client, workout_data)
+    exercise_data = {
+        "workout_id": workout_id,
+        "name": name,
+        "exercise_type": "run",
+        "duration": 10,
+        "calories": 3
+    }
+    exercise_id = await get_exercise_id(test_client, exercise_data)
+    response = await test_client.post(f"{BASE_URL}/tracking/{exercise_id}", json={"duration": 0, "description": name},
+                                      headers=header.headers)
+    tracking_data_id = int(re.search(r'Tracking data (\d+) added successfully.', response.json()['message']).group(1))
+    return int(exercise_id), tracking_data_id
+
+
+async def test_transaction_scope(test_client):
+    """
+    Function to test that the operations of a transaction scope are committed once, rolled back together
+    when one of them fails, and that their callbacks only run after the commit.
+    Args:
+        test_client:
+
+    Returns: The test result.
+    """
+    _exercise_id, tracking_data_id = await create_tracking_room(test_client, "scoped run")
+    commits = []
+    callbacks = []
+
+    def on_commit(_connection):
+        commits.append(True)
+
+    event.listen(test_db_engine.sync_engine, 'commit', on_commit)
+    try:
+        async with test_async_session() as db:
+            async def record():
+                callbacks.append(db.in_transaction())
+
+            async with transaction_scope(db):
+                await create_tracking_map_point(tracking_data_id=tracking_data_id,
+                                                map_point={"lat": 40.0, "lon": -3.0, "seq": 1}, db=db)
+                await update_exercise_tracking_data(tracking_data_id=tracking_data_id, tracking_data={"duration": 7},
+                                                    db=db)
+                await after_commit(db, record)
+                assert not commits
+                assert not callbacks
+        assert len(commits) == 1
+        assert callbacks == [False]
+
+        commits.clear()
+        callbacks.clear()
+        with pytest.raises(HTTPException):
+            async with test_async_session() as db:
+                async with transaction_scope(db):
+                    await create_tracking_map_point(tracking_data_id=tracking_data_id,
+                                                    map_point={"lat": 40.1, "lon": -3.0, "seq": 2}, db=db)
+                    await update_exercise_tracking_data(tracking_data_id=tracking_data_id,
+                                                        tracking_data={"duration": 8}, db=db)
+                    await after_commit(db, record)
+                    await update_exercise_tracking_data(tracking_data_id=tracking_data_id,
+                                                        tracking_data={"no_such_field": 1}, db=db)
+        assert not commits
+        assert not callbacks
+    finally:
+        event.remove(test_db_engine.sync_engine, 'commit', on_commit)
+
+    async with test_async_session() as db:
+        query = sa.select(MapPoint.seq).where(MapPoint.tracking_data_id == tracking_data_id)
+        assert list((await db.execute(query)).scalars()) == [1]
+        assert await db.scalar(sa.select(TrackingData.duration).where(TrackingData.id == tracking_data_id)) == 7
+
+
+async def test_tracking_cache_invalidated_during_load(test_client, monkeypatch):
+    """
+    Function to test that a tracking list loaded while its cache scope is invalidated is not cached.
+    Args:
+        test_client:
+        monkeypatch:
+
+    Returns: The test result.
+    """
+    exercise_id, _tracking_data_id = await create_tracking_room(test_client, "cached run")
+    list_url = f"{BASE_URL}/tracking/list/{exercise_id}"
+    get_tracking_data_list = routers.exercises.get_exercise_tracking_data_list
+    loaded = asyncio.Event()
+    resume = asyncio.Event()
+
+    async def slow_get_tracking_data_list(**kwargs):
+        tracking_data_list = await get_tracking_data_list(**kwargs)
+        loaded.set()
+        await resume.wait()
+        return tracking_data_list
+
+    monkeypatch.setattr(routers.exercises, "get_exercise_tracking_data_list", slow_get_tracking_data_list)
+    read = asyncio.create_task(test_client.get(list_url, headers=header.headers))
+    await loaded.wait()
+    # a new tracking room is committed (and the scope invalidated) while the read holds the old list
+    response = await test_client.post(f"{BASE_URL}/tracking/{exercise_id}", json={"duration": 0, "description": "2"},
+                                      headers=header.headers)
+    assert response.status_code == 201
+    resume.set()
+
+    assert len((await read).json()['data']) == 1
+    assert len((await test_client.get(list_url, headers=header.headers)).json()['data']) == 2
+
+
+async def test_tracking_update_transaction(test_client, sync_client):
+    """
+    Function to test that a tracking message with an update commits its point and the update once,
+    and stores nothing when the update fails.
+    Args:
+        test_client:
+        sync_client:
+
+    Returns: The test result.
+    """
+    exercise_id, tracking_data_id = await create_tracking_room(test_client, "updated run")
+    list_url = f"{BASE_URL}/tracking/list/{exercise_id}"
+    response = await test_client.get(list_url, headers=header.headers)
+    assert response.json()['data'][0]['duration'] == 0
+
+    commits = []
+
+    def on_commit(_connection):
+        commits.append(True)
+
+    with sync_client.websocket_connect(f"{BASE_URL}/ws/tracking/{tracking_data_id}") as websocket:
+        websocket.receive_json()
+        websocket.receive_json()
+
+        event.listen(test_db_engine.sync_engine, 'commit', on_commit)
+        try:
+            websocket.send_json({"map_point": {"lat": 40.0, "lon": -3.0, "seq": 1}, "update_tracking_data": True,
+                                 "updated_tracking_data": {"duration": 30}})
+            assert websocket.receive_json()['message'] == "The tracking data has been updated."
+            assert len(commits) == 1
+        finally:
+            event.remove(test_db_engine.sync_engine, 'commit', on_commit)
+        room = websocket.receive_json()
+        assert room['duration'] == 30
+        assert len(room['route']) == 1
+
+        websocket.send_json({"map_point": {"lat": 40.1, "lon": -3.0, "seq": 2}, "update_tracking_data": True,
+                             "updated_tracking_data": {"no_such_field": 1}})
+        assert websocket.receive_json()['status'] is False
+        websocket.send_json({"map_point": {"lat": 40.1, "lon": -3.0, "seq": 2}})
+        assert websocket.receive_json()['live']['points'] == 2
+
+    # the update was committed before the tracking list cache was invalidated
+    response = await test_client.get(list_url, headers=header.headers)
+    assert response.json()['data'][0]['duration'] == 30
+
+
+async def test_close_deleted_tracking_rooms(test_client, sync_client):
+    """
+    Function to test that deleting the exercise or the workout of a live tracking room closes the room.
+    Args:
+        test_client:
+        sync_client:
+
+    Returns: The test result.
+    """
+    for delete_url in ("exercise", "workout"):
+        exercise_id, tracking_data_id = await create_tracking_room(test_client, f"deleted {delete_url} run")
+        response = await test_client.get(f"{BASE_URL}/{exercise_id}", headers=header.headers)
+        workout_id = response.json()['data']['workout_id']
+        live_url = f"{BASE_URL}/tracking/live/{tracking_data_id}"
+
+        with sync_client.websocket_connect(f"{BASE_URL}/ws/tracking/{tracking_data_id}") as websocket:
+            websocket.receive_json()
+            websocket.receive_json()
+            websocket.send_json({"map_point": {"lat": 40.0, "lon": -3.0, "seq": 1}})
+            websocket.receive_json()
+            assert sync_client.get(live_url, headers=header.headers).status_code == 200
+
+            # the delete runs on the loop of the socket
+            if delete_url == "exercise":
+                response = sync_client.delete(f"{BASE_URL}/{exercise_id}", headers=header.headers)
+            else:
+                response = sync_client.delete(f"{WORKOUT_BASE_URL}/{workout_id}", headers=header.headers)
+            assert response.status_code == 200
+            assert sync_client.get(live_url, headers=header.headers).status_code == 404
+
+            with pytest.raises(WebSocketDisconnect) as error:
+                websocket.receive_json()
+            assert error.value.code == 1008
+
+        assert tracking_data_id not in tracking_ws_handler.rooms
+        assert tracking_data_id not in tracking_ws_handler.live_rooms
+
+
+async def test_get_tracking_analytics(test_client):
+    """
+    Function to test the tracking route analytics endpoint.
+    Args:
+        test_client:
+
+    Returns: The test result.
+    """
+    header.token = await get_test_token(test_client, base_url=USER_BASE_URL, user_data=test_user)
+    workout_data = {
+        "user_id": random.randint(1, 100),
+        "workout_type": "cardio",
+        "duration": 60,
+        "calories": 4000,
+    }
+    workout_id = await get_workout_id(test_client, workout_data)
+
+    exercise_data = {
+        "workout_id": workout_id,
+        "name": "run 10 miles",
+        "exercise_type": "run",
+        "duration": 10,
+        "calories": 3
+    }
+    exercise_id = await get_exercise_id(test_client, exercise_data)
+
+    tracking_data = {
+        "duration": 45,
+        "description": "test"
+    }
+    response = await test_client.post(f"{BASE_URL}/tracking/{exercise_id}", json=tracking_data, headers=header.headers)
+    match = re.search(r'Tracking data (\d+) added successfully.', response.json()['message'])
+    tracking_data_id = match.group(1)
+
+    response = await test_client.get(f"{BASE_URL}/tracking/{tracking_data_id}/analytics", headers=header.headers)
+
+    assert response.status_code == 200
+    assert response.json()['data']['distance'] == 0
+    assert response.json()['data']['splits'] == []
+
+    # 1.1 km to the north (0.001 degrees of latitude every ~111.2 m) with a ~170 m detour to the east at 40.0055
+    route = [(40.0 + index / 1000, -3.0) for index in range(6)] + [(40.0055, -2.998)] \
+        + [(40.0 + index / 1000, -3.0) for index in range(6, 11)]
+    async with test_async_session() as db:
+        for lat, lon in route:
+            await create_tracking_map_point(tracking_data_id=int(tracking_data_id), map_point={"lat": lat, "lon": lon},
+                                            db=db)
+
+    response = await test_client.get(f"{BASE_URL}/tracking/{tracking_data_id}/analytics?split_length=500",
+                                     headers=header.headers)
+
+    assert response.status_code == 200
+    data = response.json()['data']
+    assert data['distance'] == pytest.approx(1359.14, abs=0.01)
+    assert [(split['point_index'], round(split['distance'], 2)) for split in data['splits']] == \
+        [(5, 555.98), (8, 1025.55)]
+    # the straight stretches are dropped, the detour and its ends are kept
+    assert [(point['latitude'], point['longitude']) for point in data['simplified_route']] == \
+        [route[index] for index in (0, 5, 6, 7, 11)]
+
+    bad_response = await test_client.get(f"{BASE_URL}/tracking/454543/analytics", headers=header.headers)
+    assert bad_response.status_code == 404
+
+    for params in ("split_length=0", "split_length=-5", "tolerance=-1"):
+        invalid_response = await test_client.get(f"{BASE_URL}/tracking/{tracking_data_id}/analytics?{params}",
+                                                 headers=header.headers)
+        assert invalid_response.status_code == 400
+
+    unauthorized_response = await test_client.get(f"{BASE_URL}/tracking/{tracking_data_id}/analytics")
+    assert unauthorized_response.status_code == 401
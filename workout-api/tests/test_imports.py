@@ -0,0 +1,152 @@
+"""
+test_imports.py
+This module contains the tests for the import endpoints.
+"""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import repository.imports
+from repository.imports import ImportJob, start_import_job
+from test_utils import get_test_token, Headers
+
+BASE_URL = "api/v1/import"
+WORKOUT_BASE_URL = "api/v1/workout"
+USER_BASE_URL = "api/v1/users"
+header = Headers()
+test_user = {}
+
+CSV_LOG = b"""workout_ref,workout_type,duration,calories,created_at,exercise_name,exercise_type,exercise_duration,exercise_calories
+1,cardio,30,300,2020-01-01T10:00:00,run,run,25,250
+1,cardio,30,300,2020-01-01T10:00:00,walk,walk,5,50
+2,strength,40,200,1600000000,,,,
+3,unknown,10,10,1600000000,,,,
+"""
+
+GPX_TRACK = b"""<?xml version="1.0" encoding="UTF-8"?>
+<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1">
+  <trk>
+    <name>Morning run</name>
+    <type>running</type>
+    <trkseg>
+      <trkpt lat="40.4168" lon="-3.7038"><time>2020-01-01T10:00:00Z</time></trkpt>
+      <trkpt lat="40.4178" lon="-3.7038"><time>2020-01-01T10:01:00Z</time></trkpt>
+      <trkpt lat="40.4188" lon="-3.7038"><time>2020-01-01T10:02:00Z</time></trkpt>
+    </trkseg>
+  </trk>
+</gpx>
+"""
+
+
+async def wait_for_job(test_client, job_id):
+    """
+    Function to wait until an import job ends.
+    Args:
+        test_client:
+        job_id:
+
+    Returns: The import job info.
+    """
+    for _ in range(50):
+        response = await test_client.get(f"{BASE_URL}/{job_id}", headers=header.headers)
+        job = response.json()['data']
+        if job['status'] in ('completed', 'failed'):
+            return job
+        await asyncio.sleep(0.1)
+    return job
+
+
+async def test_import_csv(test_client):
+    """
+    Function to test the CSV import endpoint.
+    Args:
+        test_client:
+
+    Returns: The test result.
+    """
+    header.token = await get_test_token(test_client, base_url=USER_BASE_URL, user_data=test_user)
+    response = await test_client.post(f"{BASE_URL}/", files={"file": ("log.csv", CSV_LOG)}, headers=header.headers)
+
+    assert response.status_code == 202
+    job = await wait_for_job(test_client, response.json()['data']['id'])
+
+    assert job['status'] == 'completed'
+    assert job['rows_processed'] == 4
+    assert job['rows_skipped'] == 1
+    assert job['workouts'] == 2
+    assert job['exercises'] == 2
+
+    unauthorized_response = await test_client.post(f"{BASE_URL}/", files={"file": ("log.csv", CSV_LOG)})
+    assert unauthorized_response.status_code == 401
+
+
+async def test_import_gpx(test_client):
+    """
+    Function to test the GPX import endpoint.
+    Args:
+        test_client:
+
+    Returns: The test result.
+    """
+    header.token = await get_test_token(test_client, base_url=USER_BASE_URL, user_data=test_user)
+    response = await test_client.post(f"{BASE_URL}/", files={"file": ("run.gpx", GPX_TRACK)}, headers=header.headers)
+
+    assert response.status_code == 202
+    job = await wait_for_job(test_client, response.json()['data']['id'])
+
+    assert job['status'] == 'completed'
+    assert job['workouts'] == 1
+    assert job['tracking_data'] == 1
+    assert job['map_points'] == 3
+
+
+async def test_import_invalid_format(test_client):
+    """
+    Function to test the import endpoint with an unsupported file.
+    Args:
+        test_client:
+
+    Returns: The test result.
+    """
+    header.token = await get_test_token(test_client, base_url=USER_BASE_URL, user_data=test_user)
+    response = await test_client.post(f"{BASE_URL}/", files={"file": ("log.txt", b"test")}, headers=header.headers)
+    assert response.status_code == 400
+
+    not_found_response = await test_client.get(f"{BASE_URL}/unknown", headers=header.headers)
+    assert not_found_response.status_code == 404
+
+
+async def test_import_running_limit(test_client, monkeypatch, tmp_path):
+    """
+    Function to test that the uploads get a 429 while IMPORT_MAX_RUNNING imports are running.
+    Args:
+        test_client:
+        monkeypatch:
+        tmp_path:
+
+    Returns: The test result.
+    """
+    header.token = await get_test_token(test_client, base_url=USER_BASE_URL, user_data=test_user)
+    running_job = ImportJob(user_id=0, import_format='csv')
+    running_job.task = asyncio.get_running_loop().create_future()
+    monkeypatch.setitem(repository.imports.import_jobs, running_job.id, running_job)
+    monkeypatch.setattr(repository.imports, "IMPORT_MAX_RUNNING", 1)
+
+    response = await test_client.post(f"{BASE_URL}/", files={"file": ("log.csv", CSV_LOG)}, headers=header.headers)
+    assert response.status_code == 429
+    assert response.headers["Retry-After"]
+
+    # a slot taken while the upload was spooled: the spooled file is removed
+    spooled_file = tmp_path / "upload.csv"
+    spooled_file.write_bytes(CSV_LOG)
+    with pytest.raises(HTTPException) as error:
+        start_import_job(user_id=0, import_format='csv', path=str(spooled_file), session_factory=None)
+    assert error.value.status_code == 429
+    assert not spooled_file.exists()
+
+    running_job.task = None
+    response = await test_client.post(f"{BASE_URL}/", files={"file": ("log.csv", CSV_LOG)}, headers=header.headers)
+    assert response.status_code == 202
+    job = await wait_for_job(test_client, response.json()['data']['id'])
+    assert job['status'] == 'completed'
@@ -0,0 +1,192 @@
+"""
+test_ingest.py
+This module contains the tests for the write-behind buffer of the tracking points.
+"""
+import asyncio
+
+import pytest
+import sqlalchemy as sa
+from fastapi import HTTPException
+
+from db_context import test_async_session, test_db_engine
+from ingest import MapPointIngestBuffer, TRACKING_DATA_ID, ingest_backpressure_waits, copy_rows, map_point_row
+from models import User, Workout, Exercise, TrackingData, MapPoint, ExerciseType
+
+FAILING_TRACKING_DATA_ID = 666
+
+
+class RecordingIngestBuffer(MapPointIngestBuffer):
+    """
+    Ingest buffer writing nowhere: it records the groups, can hold the writes and fails the groups
+    with a point of FAILING_TRACKING_DATA_ID.
+    """
+
+    def __init__(self, flush_interval: float, batch_size: int, max_pending: int):
+        super().__init__(flush_interval=flush_interval, batch_size=batch_size, max_pending=max_pending)
+        self.groups = []
+        self.writes_allowed = asyncio.Event()
+        self.writes_allowed.set()
+        self.next_id = 0
+
+    async def _write(self, rows: list) -> list:
+        self.groups.append(len(rows))
+        await self.writes_allowed.wait()
+        if any(row[TRACKING_DATA_ID] == FAILING_TRACKING_DATA_ID for row in rows):
+            raise ValueError("Invalid tracking data id.")
+        ids = list(range(self.next_id, self.next_id + len(rows)))
+        self.next_id += len(rows)
+        return ids
+
+
+def submit(buffer: MapPointIngestBuffer, tracking_data_id: int = 1):
+    """
+    Function to submit a point in a task.
+    """
+    return asyncio.create_task(buffer.submit(tracking_data_id, {"lat": 40.0, "lon": -3.0}))
+
+
+async def test_ingest_group_commit_by_batch_size():
+    """
+    Function to test that a full group is written without waiting for the flush interval.
+    """
+    buffer = RecordingIngestBuffer(flush_interval=60, batch_size=3, max_pending=10)
+    buffer.start(session_factory=None)
+
+    ids = await asyncio.wait_for(asyncio.gather(*(submit(buffer) for _ in range(3))), timeout=1)
+
+    assert sorted(ids) == [0, 1, 2]
+    assert buffer.groups == [3]
+    await buffer.stop()
+
+
+async def test_ingest_group_commit_by_interval():
+    """
+    Function to test that a group smaller than the batch size is written after the flush interval.
+    """
+    buffer = RecordingIngestBuffer(flush_interval=0.05, batch_size=100, max_pending=10)
+    buffer.start(session_factory=None)
+
+    ids = await asyncio.wait_for(asyncio.gather(submit(buffer), submit(buffer)), timeout=1)
+
+    assert sorted(ids) == [0, 1]
+    assert buffer.groups == [2]
+    await buffer.stop()
+
+
+async def test_ingest_backpressure():
+    """
+    Function to test that the sockets wait for room when max_pending points are not flushed yet.
+    """
+    buffer = RecordingIngestBuffer(flush_interval=0.01, batch_size=100, max_pending=2)
+    buffer.writes_allowed.clear()
+    buffer.start(session_factory=None)
+    waits = ingest_backpressure_waits.values.get((), 0)
+
+    tasks = [submit(buffer) for _ in range(3)]
+    await asyncio.sleep(0.05)
+    assert buffer.groups == [2]
+    assert ingest_backpressure_waits.values.get((), 0) == waits + 1
+    assert not any(task.done() for task in tasks)
+
+    buffer.writes_allowed.set()
+    ids = await asyncio.wait_for(asyncio.gather(*tasks), timeout=1)
+    assert sorted(ids) == [0, 1, 2]
+    assert buffer.groups == [2, 1]
+    await buffer.stop()
+
+
+async def test_ingest_failed_group_retry():
+    """
+    Function to test that a failed group is written again point by point, so only the invalid point fails.
+    """
+    buffer = RecordingIngestBuffer(flush_interval=0.01, batch_size=3, max_pending=10)
+    buffer.start(session_factory=None)
+
+    results = await asyncio.wait_for(asyncio.gather(submit(buffer), submit(buffer, FAILING_TRACKING_DATA_ID),
+                                                    submit(buffer), return_exceptions=True), timeout=1)
+
+    assert buffer.groups == [3, 1, 1, 1]
+    assert isinstance(results[1], HTTPException) and results[1].status_code == 500
+    assert results[0] == 0 and results[2] == 1
+    assert buffer._slots._value == buffer.max_pending
+    await buffer.stop()
+
+
+async def test_ingest_stop_flushes_pending_points():
+    """
+    Function to test that stopping the buffer writes the pending points.
+    """
+    buffer = RecordingIngestBuffer(flush_interval=60, batch_size=100, max_pending=10)
+    buffer.start(session_factory=None)
+    tasks = [submit(buffer) for _ in range(2)]
+    await asyncio.sleep(0.01)
+
+    await buffer.stop()
+
+    assert sorted(await asyncio.gather(*tasks)) == [0, 1]
+    assert buffer.groups == [2]
+    assert not buffer.running
+    with pytest.raises(RuntimeError):
+        await buffer.submit(1, {"lat": 40.0, "lon": -3.0})
+
+
+async def test_ingest_stop_timeout():
+    """
+    Function to test that the points not written when the stop times out are failed with a 503
+    and release their slots.
+    """
+    buffer = RecordingIngestBuffer(flush_interval=0.01, batch_size=2, max_pending=3)
+    buffer.writes_allowed.clear()
+    buffer.start(session_factory=None)
+    tasks = [submit(buffer) for _ in range(5)]
+    await asyncio.sleep(0.05)
+
+    await buffer.stop(timeout=0.05)
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    assert [getattr(result, 'status_code', None) for result in results] == [503] * 5
+    assert buffer._slots._value == buffer.max_pending
+    assert not buffer.running
+
+
+@pytest.mark.skipif(test_db_engine.dialect.name != 'postgresql', reason='The COPY path only runs on PostgreSQL.')
+async def test_ingest_copy_rows():
+    """
+    Function to test the PostgreSQL write of the buffer (COPY into the staging table, then the insert that skips
+    the stored sequence numbers).
+    """
+    async with test_async_session() as db:
+        user = User(name='copy', age=30, username='copy_rows', email='copy_rows@test.com', password=b'x',
+                    created_at=0)
+        db.add(user)
+        await db.flush()
+        workout = Workout(user_id=user.id, workout_type=ExerciseType.CARDIO, duration=1, calories=1, created_at=0,
+                          is_schedule=False, schedule_date=0)
+        db.add(workout)
+        await db.flush()
+        exercise = Exercise(workout_id=workout.id, name='copy', exercise_type='run', duration=1, calories=1,
+                            created_at=0)
+        db.add(exercise)
+        await db.flush()
+        tracking_data = TrackingData(exercise_id=exercise.id, description='copy', duration=0, is_new_set=True,
+                                     is_new_record=False, distance_covered=0, created_at=0, last_updated_at=0)
+        db.add(tracking_data)
+        await db.commit()
+        tracking_data_id = tracking_data.id
+
+    rows = [map_point_row(tracking_data_id, {"lat": 40.0 + seq / 1000, "lon": -3.0, "seq": seq})
+            for seq in (1, 2, 2)] + [map_point_row(tracking_data_id, {"lat": 40.0, "lon": -3.0})]
+    async with test_async_session() as db:
+        first_ids = await copy_rows(await db.connection(), rows)
+        await db.commit()
+    async with test_async_session() as db:
+        second_ids = await copy_rows(await db.connection(), rows[1:2])
+        await db.commit()
+
+    assert first_ids[0] is not None and first_ids[1] is not None and first_ids[3] is not None
+    assert first_ids[2] is None
+    assert second_ids == [None]
+    async with test_async_session() as db:
+        query = sa.select(MapPoint.id, MapPoint.seq).where(MapPoint.tracking_data_id == tracking_data_id)
+        stored = {row.id: row.seq for row in await db.execute(query)}
+    assert stored == {first_ids[0]: 1, first_ids[1]: 2, first_ids[3]: None}
@@ -0,0 +1,75 @@
+"""
+test_logging.py
+This module contains the tests for the logging pipeline.
+"""
+import logging
+import threading
+import time
+
+from structured_logging import LoggingPipeline, log_records_dropped, pipeline_logger
+
+
+class BlockedStream:
+    """
+    Stream whose writes wait until it is released.
+    """
+
+    def __init__(self):
+        self.released = threading.Event()
+        self.lines = []
+
+    def write(self, text: str):
+        self.released.wait()
+        self.lines.append(text)
+
+    def flush(self):
+        pass
+
+
+def test_logging_pipeline_stop(monkeypatch):
+    """
+    Function to test that stopping the pipeline writes the pending records.
+    """
+    monkeypatch.setattr(logging.getLogger(), "handlers", [])
+    stream = BlockedStream()
+    stream.released.set()
+    pipeline = LoggingPipeline()
+    pipeline.start(stream=stream)
+
+    logging.getLogger("workout_api.test").warning("pending record")
+    pipeline.stop(timeout=1)
+
+    assert "pending record" in ''.join(stream.lines)
+    assert pipeline.writer is None
+
+
+def test_logging_pipeline_stop_blocked_writer(monkeypatch, caplog):
+    """
+    Function to test that a writer stuck on its stream does not block the stop, and that the records left in the
+    full queue are reported as dropped.
+    """
+    monkeypatch.setattr(logging.getLogger(), "handlers", [])
+    monkeypatch.setattr("structured_logging.LOG_QUEUE_SIZE", 2)
+    monkeypatch.setattr("structured_logging.LOG_BATCH_SIZE", 1)
+    stream = BlockedStream()
+    pipeline = LoggingPipeline()
+    pipeline.start(stream=stream)
+    writer = pipeline.writer
+    dropped = log_records_dropped.values.get(("WARNING",), 0)
+
+    test_logger = logging.getLogger("workout_api.test")
+    test_logger.warning("record written when the stream is released")
+    time.sleep(0.05)
+    test_logger.warning("queued record")
+    test_logger.warning("queued record")
+
+    # the pipeline handler is gone when the drop is reported
+    monkeypatch.setattr(pipeline_logger, "handlers", [caplog.handler])
+    started_at = time.monotonic()
+    pipeline.stop(timeout=0.2)
+
+    assert time.monotonic() - started_at < 1
+    assert log_records_dropped.values.get(("WARNING",), 0) == dropped + 2
+    assert "2 queued log records were dropped" in caplog.text
+    stream.released.set()
+    writer.join(timeout=1)
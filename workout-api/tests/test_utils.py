@@ -5,6 +5,7 @@ helper functions for tests module
 import random
 
 from crypto import generate_random_string
+from instrumentation import QUERY_COUNT_HEADER
 from repository.auth import create_access_token
 
 
@@ -74,4 +75,17 @@ class Headers:
         """
         generate headers based on the token
         """
-        return {"Authorization": f"Bearer {self.token}"}
\ No newline at end of file
+        return {"Authorization": f"Bearer {self.token}"}
+
+
+def assert_query_budget(response, budget: int):
+    """
+    Function to check that a request did not run more SQL statements than its budget
+    (catches the N+1 regressions).
+    Args:
+        response:
+        budget: The maximum number of statements.
+    """
+    query_count = int(response.headers[QUERY_COUNT_HEADER])
+    assert query_count <= budget, \
+        f"{response.request.method} {response.request.url.path} ran {query_count} queries (budget: {budget})"
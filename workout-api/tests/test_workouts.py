@@ -5,10 +5,13 @@ This module contains the tests for the workouts endpoints.
 import random
 import re
 
+import sqlalchemy as sa
 from fastapi.testclient import TestClient
 
 from conftest import app
-from test_utils import get_test_token, Headers
+from db_context import test_async_session, test_db_engine
+from models import Workout
+from test_utils import get_test_token, assert_query_budget, Headers
 
 sync_client = TestClient(app)
 BASE_URL = "api/v1/workout"
@@ -48,6 +51,25 @@ async def test_db_schema_version(test_client):
     assert isinstance(response.json(), str)
 
 
+async def test_metrics(test_client):
+    """
+    Function to test the metrics endpoint.
+    """
+    await test_client.get("/api/v1/")
+    await test_client.get(f"{BASE_URL}/454543")
+    response = await test_client.get("/api/v1/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'http_responses_total{method="GET",route="/api/v1/",status="200"}' in response.text
+    # the label is the full route template (with the router prefixes), not the request path
+    assert 'http_responses_total{method="GET",route="/api/v1/workout/{workout_id}",status="401"}' in response.text
+    assert "/454543" not in response.text
+    assert "http_request_duration_seconds_bucket" in response.text
+    assert "db_pool_checked_out" in response.text
+    assert "tracking_sockets_active 0" in response.text
+
+
 async def test_get_workouts(test_client):
     """
     Function to test the get workouts endpoint.
@@ -99,6 +121,128 @@ async def test_get_workout(test_client):
     assert unauthorized_response.status_code == 401
 
 
+async def test_get_workout_conditional(test_client):
+    """
+    Function to test the ETag support of the get workout endpoint.
+    Args:
+        test_client:
+
+    Returns: The test result.
+    """
+    header.token = await get_test_token(test_client, base_url=USER_BASE_URL, user_data=test_user)
+
+    workout_data = {
+        "user_id": random.randint(1, 100),
+        "workout_type": "cardio",
+        "duration": 60,
+        "calories": 4000,
+    }
+    workout_id = await get_workout_id(test_client, workout_data)
+
+    response = await test_client.get(f"{BASE_URL}/{workout_id}", headers=header.headers)
+    etag = response.headers["ETag"]
+
+    not_modified_response = await test_client.get(f"{BASE_URL}/{workout_id}",
+                                                  headers={**header.headers, "If-None-Match": etag})
+    assert not_modified_response.status_code == 304
+    assert not_modified_response.headers["ETag"] == etag
+
+    await test_client.patch(f"{BASE_URL}/{workout_id}", json={"duration": 30}, headers=header.headers)
+
+    modified_response = await test_client.get(f"{BASE_URL}/{workout_id}",
+                                              headers={**header.headers, "If-None-Match": etag})
+    assert modified_response.status_code == 200
+    assert modified_response.headers["ETag"] != etag
+    assert modified_response.json()["duration"] == 30
+
+    # a change committed by another worker (no local invalidation) must not be served from the old cached body
+    async with test_async_session() as session:
+        await session.execute(sa.update(Workout).where(Workout.id == int(workout_id))
+                              .values(duration=45, version=Workout.version + 1))
+        await session.commit()
+
+    other_worker_response = await test_client.get(f"{BASE_URL}/{workout_id}", headers=header.headers)
+    assert other_worker_response.headers["ETag"] != modified_response.headers["ETag"]
+    assert other_worker_response.json()["duration"] == 45
+
+
+async def test_get_workout_fields(test_client):
+    """
+    Function to test the sparse fieldsets of the get workout endpoint.
+    Args:
+        test_client:
+
+    Returns: The test result.
+    """
+    header.token = await get_test_token(test_client, base_url=USER_BASE_URL, user_data=test_user)
+    workout_data = {
+        "user_id": random.randint(1, 100),
+        "workout_type": "cardio",
+        "duration": 60,
+        "calories": 4000,
+        "exercises": [
+            {"name": "run", "exercise_type": "cardio", "duration": 10, "calories": 300},
+        ]
+    }
+    response = await test_client.post(f"{BASE_URL}/create/bulk", json=workout_data, headers=header.headers)
+    workout_id = response.json()["data"]["workout_id"]
+
+    response = await test_client.get(f"{BASE_URL}/{workout_id}?fields=id,calories,exercises(name,calories)",
+                                     headers=header.headers)
+    full_response = await test_client.get(f"{BASE_URL}/{workout_id}", headers=header.headers)
+    invalid_response = await test_client.get(f"{BASE_URL}/{workout_id}?fields=id,password", headers=header.headers)
+
+    assert response.status_code == 200
+    assert_query_budget(response, 3)
+    assert response.json() == {"id": workout_id, "calories": 4000, "exercises": [{"name": "run", "calories": 300}]}
+    assert response.headers["ETag"] != full_response.headers["ETag"]
+    assert "duration" in full_response.json()
+    assert invalid_response.status_code == 400
+
+
+async def test_get_workout_document(test_client):
+    """
+    Function to test that the database-rendered workout document matches the get workout endpoint.
+    Args:
+        test_client:
+
+    Returns: The test result.
+    """
+    header.token = await get_test_token(test_client, base_url=USER_BASE_URL, user_data=test_user)
+    workout_data = {
+        "user_id": random.randint(1, 100),
+        "workout_type": "strength",
+        "duration": 60,
+        "calories": 4000,
+        "exercises": [
+            {
+                "name": "run", "exercise_type": "cardio", "duration": 10, "calories": 300,
+                "tracking_rooms": [
+                    {"description": "first", "duration": 5, "distance_covered": 1000},
+                    {"description": "second", "duration": 4, "distance_covered": 800},
+                ]
+            },
+            {"name": "squats", "exercise_type": "strength", "duration": 5, "calories": 50},
+        ]
+    }
+    response = await test_client.post(f"{BASE_URL}/create/bulk", json=workout_data, headers=header.headers)
+    workout_id = response.json()["data"]["workout_id"]
+
+    document_response = await test_client.get(f"{BASE_URL}/{workout_id}/document", headers=header.headers)
+    workout_response = await test_client.get(f"{BASE_URL}/{workout_id}", headers=header.headers)
+
+    assert document_response.status_code == 200
+    # one query on PostgreSQL, the other databases build the document in Python
+    assert_query_budget(document_response, 1 if test_db_engine.dialect.name == 'postgresql' else 3)
+    document = document_response.json()
+    summaries = [exercise.pop("tracking") for exercise in document["exercises"]]
+    assert document == workout_response.json()
+    assert summaries == [
+        {"sessions": 2, "duration": 9, "distance_covered": 1800},
+        {"sessions": 0, "duration": 0, "distance_covered": 0},
+    ]
+
+
 async def test_create_workout(test_client):
     """
     Function to test the create workout endpoint.
@@ -123,6 +267,53 @@ async def test_create_workout(test_client):
     assert bad_response.status_code == 401
 
 
+async def test_create_workout_with_exercises(test_client):
+    """
+    Function to test the bulk create workout endpoint.
+    Args:
+        test_client:
+    Returns: The test result.
+    """
+
+    header.token = await get_test_token(test_client, base_url=USER_BASE_URL, user_data=test_user)
+    workout_data = {
+        "user_id": random.randint(1, 100),
+        "workout_type": "cardio",
+        "duration": 60,
+        "calories": 4000,
+        "exercises": [
+            {
+                "name": "run 10 miles",
+                "exercise_type": "run",
+                "duration": 10,
+                "calories": 3,
+                "tracking_rooms": [{"duration": 45, "description": "test"}]
+            },
+            {
+                "name": "push-ups",
+                "exercise_type": "strength",
+                "duration": 5,
+                "calories": 30
+            }
+        ]
+    }
+    response = await test_client.post(f"{BASE_URL}/create/bulk", json=workout_data, headers=header.headers)
+
+    assert response.status_code == 201
+    data = response.json()['data']
+    assert isinstance(data['workout_id'], int)
+    assert len(data['exercises']) == 2
+    assert len(data['exercises'][0]['tracking_data_ids']) == 1
+    assert data['exercises'][1]['tracking_data_ids'] == []
+
+    workout_response = await test_client.get(f"{BASE_URL}/{data['workout_id']}", headers=header.headers)
+    assert [exercise['id'] for exercise in workout_response.json()['exercises']] == \
+        [exercise['id'] for exercise in data['exercises']]
+
+    bad_response = await test_client.post(f"{BASE_URL}/create/bulk", json=workout_data)
+    assert bad_response.status_code == 401
+
+
 async def test_update_workout(test_client):
     """
     Function to test the update workout endpoint.
@@ -186,3 +377,30 @@ async def test_delete_workout(test_client):
 
     bad_response = await test_client.delete(f"{BASE_URL}/{workout_id}")
     assert bad_response.status_code == 401
+
+
+async def test_cache_stats(test_client, admin_headers):
+    """
+    Function to test the response cache statistics (admin only).
+    """
+    header.token = await get_test_token(test_client, base_url=USER_BASE_URL, user_data=test_user)
+    workout_data = {
+        "user_id": random.randint(1, 100),
+        "workout_type": "cardio",
+        "duration": 60,
+        "calories": 4000,
+    }
+    workout_id = await get_workout_id(test_client, workout_data)
+
+    stats = (await test_client.get("/api/v1/cache/stats", headers=admin_headers)).json()
+    first_response = await test_client.get(f"{BASE_URL}/{workout_id}", headers=header.headers)
+    second_response = await test_client.get(f"{BASE_URL}/{workout_id}", headers=header.headers)
+    new_stats = (await test_client.get("/api/v1/cache/stats", headers=admin_headers)).json()
+
+    assert first_response.json() == second_response.json()
+    assert new_stats["misses"] == stats["misses"] + 1
+    assert new_stats["hits"] == stats["hits"] + 1
+    assert "evictions" in new_stats
+
+    unauthorized_response = await test_client.get("/api/v1/cache/stats", headers=header.headers)
+    assert unauthorized_response.status_code == 403